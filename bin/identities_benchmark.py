@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ====================
+#       Set-up
+# ====================
+
+# Import required modules
+import getopt
+import sys
+from identities_tools.benchmark_tools import *
+
+__author__ = 'Victoria Morris'
+__license__ = 'MIT License'
+__version__ = '1.0.0'
+__status__ = '4 - Beta Development'
+
+
+# ====================
+#      Functions
+# ====================
+
+
+def usage():
+    """Function to print information about the program"""
+    print('Correct syntax is:')
+    print('identities_benchmark [options]')
+    print('\nOptions')
+    print('ANY of the following:')
+    print('    --scale=N    Number of synthetic identities to generate (default {})'.format(BENCHMARK_SCALE))
+    print('    --seed=N     Seed for the synthetic data generator (default {})'.format(BENCHMARK_SEED))
+    print('    --output=FILE    Save results to FILE (default {})'.format(BENCHMARK_OUTPUT))
+    print('    --compare=FILE   Compare the results with saved results in FILE')
+    print('    --storage    Also compare the throughput of each storage profile')
+    print('    --help    Display this message and exit')
+    sys.exit()
+
+
+# ====================
+#      Main code
+# ====================
+
+
+def main(argv=None):
+    scale, seed, output, baseline, storage = BENCHMARK_SCALE, BENCHMARK_SEED, BENCHMARK_OUTPUT, None, False
+
+    print('========================================')
+    print('identities_benchmark')
+    print('========================================')
+
+    try: opts, args = getopt.getopt(argv, '', ['help', 'scale=', 'seed=', 'output=', 'compare=', 'storage'])
+    except getopt.GetoptError as err:
+        exit_prompt('Error: {}'.format(str(err)))
+    for opt, arg in opts:
+        if opt == '--help': usage()
+        elif opt in ['--scale', '--seed']:
+            try: value = int(arg)
+            except ValueError: exit_prompt('Error: {} must be a number'.format(opt))
+            if opt == '--scale': scale = value
+            else: seed = value
+        elif opt == '--output': output = arg
+        elif opt == '--compare': baseline = arg
+        elif opt == '--storage': storage = True
+        else: exit_prompt('Error: Option {} not recognised'.format(opt))
+
+    results = run_benchmark(scale=scale, seed=seed, output=output, storage=storage)
+    if baseline: compare_benchmarks(baseline, results)
+
+    date_time_exit()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -7,11 +7,15 @@
 
 # Import required modules
 from collections import OrderedDict
+import atexit
 import gc
 import getopt
 import locale
 import sys
+import identities_tools.graph_tools as graph_tools
+import identities_tools.resolve_tools as resolve_tools
 from identities_tools.graph_tools import *
+from identities_tools.resolve_tools import close_explainer, explain_link, serve
 
 # Set locale to assist with sorting
 locale.setlocale(locale.LC_ALL, '')
@@ -38,6 +42,12 @@ OPTIONS = OrderedDict([
     ('Q', 'Parse list of ISBN eQuivalences'),
     ('I', 'build Indexes'),
     ('X', 'eXport graph'),
+    ('C', 'export Changes since last export'),
+    ('G', 'export Graph adjacency'),
+    ('A', 'export tables to Arrow/Parquet'),
+    ('S', 'Serve identifier lookups'),
+    ('U', 'extract sUbset of VIAF and NACO files'),
+    ('W', 'explain Why two identifiers are linked'),
     ('E', 'Exit program'),
 ])
 
@@ -50,6 +60,12 @@ ACTIONS = {
     'Q': parse_isbns,
     'I': index,
     'X': export_graph,
+    'C': export_changes,
+    'G': export_csr,
+    'A': export_columnar,
+    'S': serve,
+    'U': extract_subset,
+    'W': explain_link,
     'E': sys.exit,
 }
 
@@ -111,6 +127,14 @@ def usage():
     for o in OPTIONS:
         print('    -{}    {}'.format(o.lower(), OPTIONS[o]))
     print('ANY of the following:')
+    print('    --compress=gzip|zstd    Compress table dumps')
+    print('    --columnar=arrow|parquet    Format of columnar table exports')
+    print('    --port=PORT    Port on which to serve identifier lookups')
+    print('    --sql-profile    Record the time taken by each SQL statement')
+    print('    --profile    Sample the stack, and write the stacks sampled in each phase for flame graphs')
+    print('    --estimate    Estimate the time, rows and database size of parsing files (-l, -v, -n, -t or -q), without adding data')
+    print('    --storage={}    Use the same storage profile for every option'.format('|'.join(STORAGE_PROFILES)))
+    print('    --pipeline=STAGES    Run a comma-separated list of options in order (e.g. l,v,n,q,i,x) and exit')
     print('    --help    Display this message and exit')
     exit_prompt()
 
@@ -124,17 +148,38 @@ def main(argv=None):
     if argv is None:
         name = str(sys.argv[1])
 
-    selected_option = None
+    selected_option, stages = None, None
 
     print('========================================')
     print('identities_graph')
     print('========================================')
 
-    try: opts, args = getopt.getopt(argv, ''.join(o.lower() for o in OPTIONS), ['help'])
+    try: opts, args = getopt.getopt(argv, ''.join(o.lower() for o in OPTIONS), ['help', 'compress=', 'columnar=', 'port=', 'sql-profile', 'pipeline=', 'storage=', 'estimate', 'profile'])
     except getopt.GetoptError as err:
         exit_prompt('Error: {}'.format(str(err)))
     for opt, arg in opts:
         if opt == '--help': usage()
+        elif opt == '--compress':
+            if arg not in DUMP_EXTENSIONS: exit_prompt('Error: Compression {} not recognised'.format(arg))
+            graph_tools.DUMP_COMPRESSION = arg
+        elif opt == '--columnar':
+            if arg not in COLUMNAR_EXTENSIONS: exit_prompt('Error: Columnar format {} not recognised'.format(arg))
+            graph_tools.COLUMNAR_FORMAT = arg
+        elif opt == '--sql-profile': graph_tools.SQL_PROFILE = True
+        elif opt == '--profile': graph_tools.PROFILE = True
+        elif opt == '--estimate': graph_tools.ESTIMATE = True
+        elif opt == '--storage':
+            if arg not in STORAGE_PROFILES: exit_prompt('Error: Storage profile {} not recognised'.format(arg))
+            graph_tools.STORAGE_PROFILE = arg
+        elif opt == '--pipeline':
+            stages = [stage.strip().upper() for stage in arg.split(',') if stage.strip()]
+            # Serving lookups runs until it is interrupted, so can only be the last stage
+            for i, stage in enumerate(stages):
+                if stage not in PIPELINE_STAGES and not (stage == 'S' and i == len(stages) - 1):
+                    exit_prompt('Error: Option {} cannot be run in a pipeline'.format(stage))
+        elif opt == '--port':
+            try: resolve_tools.SERVER_PORT = int(arg)
+            except ValueError: exit_prompt('Error: Port {} is not a number'.format(arg))
         elif opt.upper().strip('-') in OPTIONS:
             selected_option = opt.upper().strip('-')
         else: exit_prompt('Error: Option {} not recognised'.format(opt))
@@ -143,10 +188,23 @@ def main(argv=None):
     if not os.path.isfile(DATABASE_PATH):
         exit_prompt('Error: The file {} cannot be found'.format(DATABASE_PATH))
 
+    # The connection to the database is shared between actions, and closed on exit
+    atexit.register(close_database)
+    atexit.register(close_explainer)
+
+    if stages:
+        date_time_message('Running pipeline {}'.format(','.join(stages)))
+        with sample_action():
+            run_pipeline(stages[:-1] if stages[-1] == 'S' else stages)
+        if stages[-1] == 'S': serve()
+        date_time_exit()
+
     option = OptionHandler(selected_option)
 
+    # With --profile, the stack is only sampled while an option runs, and not while waiting for the next option
     while option.selection:
-        option.execute()
+        with sample_action():
+            option.execute()
         option.get_selection()
 
     date_time_exit()
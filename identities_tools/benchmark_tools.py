@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ====================
+#       Set-up
+# ====================
+
+# Import required modules
+from contextlib import contextmanager, redirect_stdout
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+import identities_tools.graph_tools as graph_tools
+from identities_tools.graph_tools import *
+from identities_tools.resolve_tools import IdentityResolver
+
+
+__author__ = 'Victoria Morris'
+__license__ = 'MIT License'
+__version__ = '1.0.0'
+__status__ = '4 - Beta Development'
+
+
+# ====================
+#      Constants
+# ====================
+
+BENCHMARK_SCALE = 10000     # Number of synthetic identities
+BENCHMARK_SEED = 1
+BENCHMARK_OUTPUT = 'identities_benchmark.json'
+
+FORENAMES = ['Anne', 'Benjamin', 'Charlotte', 'David', 'Eleanor', 'Francis', 'George', 'Helen', 'Isaac', 'Jane',
+             'Katherine', 'Laurence', 'Margaret', 'Nathaniel', 'Olivia', 'Patrick', 'Rachel', 'Samuel', 'Thomas',
+             'Victoria', 'William']
+SURNAMES = ['Austen', 'Brontë', 'Carroll', 'Dickens', 'Eliot', 'Fielding', 'Gaskell', 'Hardy', 'Ishiguro', 'James',
+            'Kipling', 'Lawrence', 'Morris', 'Nesbit', 'Orwell', 'Pratchett', 'Rowling', 'Shelley', 'Trollope',
+            'Woolf', 'Zephaniah']
+PUBLISHERS = ['penguin', 'harpercollins', 'randomhouse']
+
+# Storage profile against which the other profiles are compared
+BENCHMARK_STORAGE_BASELINE = 'sqlite-default'
+BENCHMARK_LOOKUPS = 10000   # Maximum number of identifiers looked up with each storage profile
+
+
+# ====================
+#       Classes
+# ====================
+
+
+class SyntheticIdentities:
+    """Class to generate reproducible synthetic input files
+
+    Each synthetic identity has a VIAF cluster, an ISNI, a NACO identifier, name forms and ISBNs;
+    the input files are generated from the same identities, so that they link up in the graph"""
+
+    def __init__(self, scale=BENCHMARK_SCALE, seed=BENCHMARK_SEED):
+        self.scale = scale
+        self.rng = random.Random(seed)
+        self.identities = [self.identity(i) for i in range(scale)]
+
+    def identity(self, i):
+        rng = self.rng
+        forename, surname = rng.choice(FORENAMES), rng.choice(SURNAMES)
+        birth = rng.randint(1700, 1990)
+        name = '{}, {}'.format(surname, forename)
+        return {
+            'viaf': str(10000000 + i),
+            'isni': isni_with_check_digit('0000000{:08d}'.format(rng.randint(0, 99999999))),
+            'naco': 'n{:08d}'.format(90000000 + i),
+            'name': name,
+            'dates': '{}-{}'.format(birth, birth + rng.randint(30, 90)),
+            'variants': ['{}, {}.'.format(surname, forename[0]), '{} {}'.format(forename, surname)][:rng.randint(0, 2)],
+            'isbns': [random_isbn(rng) for j in range(rng.randint(1, 8))],
+            'publisher': rng.choice(PUBLISHERS),
+            'proprietary': str(rng.randint(1, 10 ** 7)),
+        }
+
+    def write_marc(self, path, record_type='VIAF'):
+        """Function to write MARC21 authority records, with 001, 024, 100, 400 and (for VIAF) 901 fields"""
+        with open(path, mode='wb') as file:
+            for identity in self.identities:
+                record = Record()
+                record.add_field(Field(tag='001', data=identity['naco'] if record_type == 'NACO' else 'viaf' + identity['viaf']))
+                record.add_field(Field(tag='024', indicators=['7', ' '],
+                                       subfields=['a', 'http://viaf.org/viaf/{}'.format(identity['viaf']), '2', 'viaf']))
+                record.add_field(Field(tag='024', indicators=['7', ' '],
+                                       subfields=['a', 'http://isni.org/isni/{}'.format(identity['isni']), '2', 'isni']))
+                record.add_field(Field(tag='100', indicators=['1', ' '],
+                                       subfields=['a', identity['name'], 'd', identity['dates'],
+                                                  '0', '(LC){}'.format(identity['naco'])]))
+                for variant in identity['variants']:
+                    record.add_field(Field(tag='400', indicators=['1', ' '], subfields=['a', variant]))
+                if record_type == 'VIAF':
+                    for isbn in identity['isbns']:
+                        record.add_field(Field(tag='901', indicators=[' ', ' '], subfields=['a', isbn]))
+                file.write(record.as_marc())
+
+    def write_viaf_links(self, path):
+        """Function to write a VIAF links table, including links of types which are ignored"""
+        with open(path, mode='w', encoding='utf-8') as file:
+            for identity in self.identities:
+                viaf = 'http://viaf.org/viaf/{}'.format(identity['viaf'])
+                file.write('{}\tISNI|{}\n'.format(viaf, identity['isni']))
+                file.write('{}\tLC|{}\n'.format(viaf, identity['naco']))
+                file.write('{}\tBNF|{}\n'.format(viaf, identity['proprietary']))
+
+    def write_tsv(self, path, publisher):
+        """Function to write a publisher TSV file, in which about half the names have an ISNI"""
+        with open(path, mode='w', encoding='utf-8') as file:
+            file.write('string\tisbn\tisni\t{}\n'.format(publisher))
+            for identity in self.identities:
+                if identity['publisher'] != publisher: continue
+                isni = identity['isni'] if int(identity['viaf']) % 2 else ''
+                for isbn in identity['isbns']:
+                    file.write('{}\t{}\t{}\t{}\n'.format(identity['name'], isbn, isni, identity['proprietary']))
+
+    def write_isbn_equivalents(self, path):
+        """Function to write a list of ISBN equivalences"""
+        with open(path, mode='w', encoding='utf-8') as file:
+            for identity in self.identities:
+                for isbn in identity['isbns']:
+                    file.write("('{}', '{}')\n".format(random_isbn(self.rng), isbn))
+
+    def write_all(self, path):
+        """Function to write a complete set of input files to a directory"""
+        files = {
+            'viaf_links': [os.path.join(path, 'viaf-links.txt')],
+            'viaf': [os.path.join(path, 'viaf-marc21.lex')],
+            'naco': [os.path.join(path, 'naco.lex')],
+            'tsv': [os.path.join(path, '{}.tsv'.format(p)) for p in PUBLISHERS],
+            'isbn': [os.path.join(path, 'isbns.txt')],
+        }
+        self.write_viaf_links(files['viaf_links'][0])
+        self.write_marc(files['viaf'][0], record_type='VIAF')
+        self.write_marc(files['naco'][0], record_type='NACO')
+        for publisher, file in zip(PUBLISHERS, files['tsv']):
+            self.write_tsv(file, publisher)
+        self.write_isbn_equivalents(files['isbn'][0])
+        return files
+
+
+class Benchmark:
+    """Class to time each stage of processing separately"""
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name, records=None):
+        """Function to time a stage; output printed during the stage is discarded"""
+        with quiet():
+            start = time.perf_counter()
+            yield
+            seconds = time.perf_counter() - start
+        self.stages[name] = {'seconds': round(seconds, 6), 'records': records,
+                             'records_per_second': round(records / seconds, 1) if records and seconds else None}
+        print('{:<40}{:>12.3f}s{}'.format(name, seconds,
+                                        '{:>14,.0f} records/s'.format(records / seconds) if records and seconds else ''))
+
+
+# ====================
+#      Functions
+# ====================
+
+
+@contextmanager
+def quiet():
+    """Function to discard output printed within a block"""
+    with open(os.devnull, mode='w') as devnull, redirect_stdout(devnull):
+        yield
+
+
+def run_benchmark(scale=BENCHMARK_SCALE, seed=BENCHMARK_SEED, output=BENCHMARK_OUTPUT, storage=False):
+    """Function to run the benchmark suite on synthetic data, and save the results as JSON
+
+    If storage is True, ingest, indexing, reporting and lookups are also timed with each storage profile"""
+    print('\nRunning benchmarks with {} synthetic identities ...'.format(str(scale)))
+    print('----------------------------------------')
+    print(str(datetime.datetime.now()))
+
+    cwd = os.getcwd()
+    output = os.path.abspath(output) if output else None
+    path = tempfile.mkdtemp(prefix='identities_benchmark_')
+    benchmark = Benchmark()
+    try:
+        os.chdir(path)
+        with benchmark.stage('generate'):
+            synthetic = SyntheticIdentities(scale=scale, seed=seed)
+            files = synthetic.write_all(path)
+        isbns = [isbn for identity in synthetic.identities for isbn in identity['isbns']]
+
+        # Parsing stages, measured without writing to the database
+        with benchmark.stage('decode MARC', records=scale):
+            with open(files['viaf'][0], mode='rb') as file:
+                records = list(MARCReader(file))
+        with benchmark.stage('extract MARC identifiers', records=scale):
+            identifiers = [(record.get_identifiers(record_type='VIAF'), record.get_name_strings()) for record in records]
+        with benchmark.stage('extract TSV identifiers', records=len(isbns)):
+            for f in files['tsv']:
+                with open(f, mode='r', encoding='utf-8') as file:
+                    headers = list(enumerate(file.readline().split('\t')))
+                    for line in file:
+                        TSV(line.strip('\n'), headers)
+        with benchmark.stage('normalise ISBNs', records=len(isbns)):
+            for isbn in isbns: str(Isbn(isbn))
+
+        with quiet():
+            db = IdentityGraphDatabase(path=os.path.join(path, 'benchmark.db'))
+        with benchmark.stage('add_values', records=scale):
+            queries, values = db.set_queries()
+            for ids, names in identifiers:
+                values = db.add_values(ids, names, values)
+        with benchmark.stage('insert', records=sum(len(values[v]) for v in values)):
+            db.flush(queries, values)
+        db.close()
+        os.remove(os.path.join(path, 'benchmark.db'))
+
+        # Ingest stages, with cleaning, indexing and reporting timed separately
+        with quiet():
+            db = IdentityGraphDatabase(path=os.path.join(path, 'benchmark.db'))
+        with benchmark.stage('ingest VIAF links', records=scale * 3):
+            db.add_viaf_links(file_list=files['viaf_links'], clean=False)
+        with benchmark.stage('ingest VIAF', records=scale):
+            db.add_marc(record_type='VIAF', file_list=files['viaf'], clean=False)
+        with benchmark.stage('ingest NACO', records=scale):
+            db.add_marc(record_type='NACO', file_list=files['naco'], clean=False)
+        with benchmark.stage('ingest TSV', records=len(isbns)):
+            db.add_tsv(file_list=files['tsv'], clean=False)
+        with benchmark.stage('ingest ISBN equivalences', records=len(isbns)):
+            db.add_isbns(file_list=files['isbn'], clean=False)
+        with benchmark.stage('clean'):
+            db.clean()
+        with benchmark.stage('index'):
+            db.build_indexes()
+        with benchmark.stage('report name matches', records=len(isbns)):
+            db.find_name_matches(file_list=files['tsv'])
+        with benchmark.stage('report NACO and ISNI equivalents'):
+            db.write_naco_isni_equivalents()
+        with benchmark.stage('report proprietary identifiers'):
+            db.write_proprietary_identifiers()
+        with benchmark.stage('dump', records=sum(db.fingerprint(table)[0] for table in GRAPH_TABLES)):
+            db.dump_database(force=True)
+        db.close()
+
+        if storage: benchmark_storage_profiles(benchmark, synthetic, files, path)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(path, ignore_errors=True)
+
+    results = {
+        'commit': git_commit(),
+        'date': str(datetime.datetime.now()),
+        'scale': scale,
+        'seed': seed,
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'stages': benchmark.stages,
+    }
+    if output:
+        with open(output, mode='w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        print('\nResults saved to {}'.format(output))
+    return results
+
+
+def benchmark_storage_profiles(benchmark, synthetic, files, path) -> None:
+    """Function to time ingest, indexing, reporting and lookups with each storage profile, in a new database,
+    and show the throughput of each relative to BENCHMARK_STORAGE_BASELINE"""
+    scale = len(synthetic.identities)
+    isbns = sum(len(identity['isbns']) for identity in synthetic.identities)
+    lookups = ['viaf:{}'.format(identity['viaf']) for identity in synthetic.identities[:BENCHMARK_LOOKUPS]]
+    stages = ['ingest', 'index', 'report', 'lookups']
+    profile = graph_tools.STORAGE_PROFILE
+    try:
+        for name in STORAGE_PROFILES:
+            graph_tools.STORAGE_PROFILE = name
+            database = os.path.join(path, 'benchmark_{}.db'.format(name))
+            with quiet():
+                db = IdentityGraphDatabase(path=database)
+            with benchmark.stage('{}: ingest'.format(name), records=scale * 5 + isbns * 2):
+                db.add_viaf_links(file_list=files['viaf_links'], clean=False)
+                db.add_marc(record_type='VIAF', file_list=files['viaf'], clean=False)
+                db.add_marc(record_type='NACO', file_list=files['naco'], clean=False)
+                db.add_tsv(file_list=files['tsv'], clean=False)
+                db.add_isbns(file_list=files['isbn'], clean=False)
+                db.clean(vacuum=False)
+            with benchmark.stage('{}: index'.format(name)):
+                db.build_indexes()
+            with benchmark.stage('{}: report'.format(name), records=sum(db.fingerprint(table)[0] for table in GRAPH_TABLES)):
+                db.dump_database(force=True, reports=True)
+            db.close()
+            with benchmark.stage('{}: lookups'.format(name), records=len(lookups)):
+                resolver = IdentityResolver(database, cache_size=0)
+                for identifier in lookups:
+                    resolver.resolve(identifier)
+                resolver.close()
+    finally: graph_tools.STORAGE_PROFILE = profile
+
+    print('\nThroughput relative to {} profile:'.format(BENCHMARK_STORAGE_BASELINE))
+    print('{:<20}'.format('Profile') + ''.join('{:>10}'.format(stage) for stage in stages))
+    for name in STORAGE_PROFILES:
+        if name == BENCHMARK_STORAGE_BASELINE: continue
+        line = '{:<20}'.format(name)
+        for stage in stages:
+            before = benchmark.stages['{}: {}'.format(BENCHMARK_STORAGE_BASELINE, stage)]['seconds']
+            after = benchmark.stages['{}: {}'.format(name, stage)]['seconds']
+            line += '{:>10}'.format('{:.2f}x'.format(before / after) if after else '-')
+        print(line)
+
+
+def compare_benchmarks(baseline, results) -> None:
+    """Function to compare the timings of each stage in two sets of saved benchmark results"""
+    baseline, results = load_benchmark(baseline), load_benchmark(results)
+    print('\nComparing benchmarks ...')
+    print('----------------------------------------')
+    print('{:<40}{:>12}{:>12}{:>10}'.format('Stage', baseline.get('commit') or 'baseline',
+                                          results.get('commit') or 'results', 'Change'))
+    if baseline.get('scale') != results.get('scale'):
+        print('Warning: benchmarks were run at different scales ({} and {})'.format(baseline.get('scale'), results.get('scale')))
+    for stage in results['stages']:
+        after = results['stages'][stage]['seconds']
+        if stage not in baseline['stages']:
+            print('{:<40}{:>12}{:>11.3f}s'.format(stage, '-', after))
+            continue
+        before = baseline['stages'][stage]['seconds']
+        change = '{:+.1f}%'.format(100 * (after - before) / before) if before else '-'
+        print('{:<40}{:>11.3f}s{:>11.3f}s{:>10}'.format(stage, before, after, change))
+
+
+def load_benchmark(results):
+    if isinstance(results, dict): return results
+    with open(results, mode='r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def git_commit():
+    """Function to get the current git commit, if the package is running from a git repository"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError): return None
+
+
+def random_isbn(rng) -> str:
+    """Function to generate a random valid 13-digit ISBN"""
+    twelve_digits = '978{:09d}'.format(rng.randint(0, 999999999))
+    return twelve_digits + isbn_13_check_digit(twelve_digits)
+
+
+def isni_with_check_digit(fifteen_digits) -> str:
+    """Function to add the ISO 7064 Mod 11-2 check digit to the first 15 digits of an ISNI"""
+    return fifteen_digits + isni_check_digit(fifteen_digits)
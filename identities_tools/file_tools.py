@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ====================
+#       Set-up
+# ====================
+
+# Import required modules
+import bz2
+import glob
+import gzip
+import io
+import lzma
+import os
+import queue
+import threading
+
+
+__author__ = 'Victoria Morris'
+__license__ = 'MIT License'
+__version__ = '1.0.0'
+__status__ = '4 - Beta Development'
+
+
+# ====================
+#      Constants
+# ====================
+
+# Extensions of compressed input files; an input file pattern also matches files with these extensions
+INPUT_EXTENSIONS = ['.gz', '.xz', '.bz2', '.zst']
+
+INPUT_BUFFER_SIZE = 1 << 20
+INPUT_BLOCK_SIZE = 1 << 20      # Size of the blocks of decompressed data passed from the decompression thread
+INPUT_QUEUE_BLOCKS = 8          # Maximum number of decompressed blocks waiting to be read
+
+
+# ====================
+#       Classes
+# ====================
+
+
+class BackgroundReader(io.RawIOBase):
+    """Class to read a stream in a background thread, so that (for example) decompression overlaps with parsing
+
+    Blocks are passed through a bounded queue, so the decompressed data held in memory is limited"""
+
+    def __init__(self, stream, name=None, block_size=INPUT_BLOCK_SIZE, blocks=INPUT_QUEUE_BLOCKS):
+        super(BackgroundReader, self).__init__()
+        self.stream = stream
+        self.name = name
+        self.block_size = block_size
+        self.queue = queue.Queue(maxsize=blocks)
+        self.block, self.position, self.eof = b'', 0, False
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            while not self.stopped.is_set():
+                block = self.stream.read(self.block_size)
+                self.put(block)
+                if not block: return
+        except Exception as e:
+            # Errors (e.g. in a corrupt file) are raised in the reading thread
+            self.put(e)
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full: continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.position >= len(self.block):
+            if self.eof: return 0
+            item = self.queue.get()
+            if isinstance(item, Exception): raise item
+            if not item:
+                self.eof = True
+                return 0
+            self.block, self.position = memoryview(item), 0
+        n = min(len(b), len(self.block) - self.position)
+        b[:n] = self.block[self.position:self.position + n]
+        self.position += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.stopped.set()
+            self.thread.join()
+            self.stream.close()
+        super(BackgroundReader, self).close()
+
+
+# ====================
+#      Functions
+# ====================
+
+
+def get_file_list(path, pattern):
+    """Function to get a sorted list of the files in a folder which match a pattern,
+    including compressed files (e.g. both viaf-links.txt and viaf-links.txt.gz match viaf*-links.txt)"""
+    files = set(glob.glob(os.path.join(path, pattern)))
+    for extension in INPUT_EXTENSIONS:
+        files.update(glob.glob(os.path.join(path, pattern + extension)))
+    return sorted(files)
+
+
+def uncompressed_name(filename) -> str:
+    """Function to get the name of a file without any compression extension"""
+    base, extension = os.path.splitext(filename)
+    return base if extension.lower() in INPUT_EXTENSIONS else filename
+
+
+def decompress(file, extension):
+    """Function to get a stream of the data decompressed from a compressed file object, given the extension of its name
+
+    The file is not closed when the stream is closed, and its position shows how much compressed data has been read"""
+    if extension == '.gz': return gzip.GzipFile(fileobj=file, mode='rb')
+    if extension == '.xz': return lzma.LZMAFile(file, mode='rb')
+    if extension == '.bz2': return bz2.BZ2File(file, mode='rb')
+    try: import zstandard
+    except ImportError: raise ImportError('Reading zstd files requires the zstandard module')
+    return zstandard.ZstdDecompressor().stream_reader(file, closefd=False)
+
+
+def open_input(filename, mode='rb', encoding='utf-8', errors='replace'):
+    """Function to open an input file for reading, in binary (mode='rb') or text (mode='r') mode
+
+    Compressed files (.gz, .xz, .bz2 or .zst) are decompressed as they are read, in a background thread"""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension not in INPUT_EXTENSIONS:
+        if 'b' in mode: return open(filename, mode='rb', buffering=INPUT_BUFFER_SIZE)
+        return open(filename, mode='r', buffering=INPUT_BUFFER_SIZE, encoding=encoding, errors=errors)
+    if extension == '.gz': stream = gzip.open(filename, mode='rb')
+    elif extension == '.xz': stream = lzma.open(filename, mode='rb')
+    elif extension == '.bz2': stream = bz2.open(filename, mode='rb')
+    else:
+        try: import zstandard
+        except ImportError: raise ImportError('Reading zstd files requires the zstandard module')
+        stream = zstandard.ZstdDecompressor().stream_reader(open(filename, mode='rb'), closefd=True)
+    file = io.BufferedReader(BackgroundReader(stream, name=filename), buffer_size=INPUT_BUFFER_SIZE)
+    if 'b' in mode: return file
+    return io.TextIOWrapper(file, encoding=encoding, errors=errors)
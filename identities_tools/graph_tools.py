@@ -6,17 +6,33 @@
 # ====================
 
 # Import required modules
+from array import array
+from collections import OrderedDict
+import bisect
+from contextlib import contextmanager, redirect_stdout
+import csv
 import datetime
-from fuzzywuzzy import fuzz
 import gc
-import glob
+import gzip
+import hashlib
+import io
+from itertools import groupby
+import json
+import math
+import mmap
 import os
+import queue
 import re
+import shutil
 import sqlite3
 import sys
+import tempfile
+import time
+from identities_tools.file_tools import *
+from identities_tools.identifier_tools import *
 from identities_tools.isbn_tools import *
 from identities_tools.marc_tools import *
-
+from identities_tools.metrics_tools import *
 
 __author__ = 'Victoria Morris'
 __license__ = 'MIT License'
@@ -30,25 +46,65 @@ __status__ = '4 - Beta Development'
 
 DATABASE_PATH = 'identities_graph.db'
 
-DUMP_FILE_PATH = os.path.join(os.getcwd(), 'Data\\DUMP')
+# Methods of IdentityGraphDatabase which upgrade the schema, in order;
+# the schema version (PRAGMA user_version) is the number of migrations which have been applied to the database
+MIGRATIONS = ['create_tables', 'create_names']
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Connection to the database shared between actions (see get_database)
+SHARED_DATABASE = None
+
+# Stages which can be run in a pipeline (see run_pipeline), identified by their command-line options
+PIPELINE_INGEST_STAGES = 'LVNTQ'
+PIPELINE_STAGES = PIPELINE_INGEST_STAGES + 'IFXCGAU'
+
+SQL_PROFILE = False         # If True, record the time taken by each SQL statement, and write a report on closing
+PROFILE = False             # If True, sample the stack while the shared database is open, and write the stacks of each phase on closing
+
+# PRAGMA settings for each kind of action; settings which are None are sized automatically (see storage_settings)
+# If the database is in WAL mode, it is left in WAL mode, and the locking mode is always NORMAL
+STORAGE_PROFILES = {
+    # Adding data: no journal, no syncing, and an exclusive lock, with a large cache
+    'bulk-ingest': {'journal_mode': 'OFF', 'synchronous': 'OFF', 'locking_mode': 'EXCLUSIVE', 'temp_store': 'FILE',
+                    'cache_size': None, 'mmap_size': 0, 'page_size': 16384},
+    # Indexing, matching, reporting and exporting: long scans of the whole database
+    'report': {'journal_mode': 'OFF', 'synchronous': 'OFF', 'locking_mode': 'EXCLUSIVE', 'temp_store': None,
+               'cache_size': None, 'mmap_size': None, 'page_size': 16384},
+    # Serving lookups, while data may be added by another process
+    'serve': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'locking_mode': 'NORMAL', 'temp_store': 'MEMORY',
+              'cache_size': None, 'mmap_size': None},
+    # SQLite's own defaults, for comparison
+    'sqlite-default': {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'locking_mode': 'NORMAL', 'temp_store': 'DEFAULT',
+                       'cache_size': -2000, 'mmap_size': 0},
+}
+STORAGE_PROFILE = None      # If set (e.g. with --storage), this profile is used for every action
+STORAGE_MEMORY_FRACTION = 0.25      # Fraction of the available memory which may be used by the cache
+STORAGE_DEFAULT_MEMORY = 1 << 30    # Memory assumed to be available if the platform does not report it
+STORAGE_MIN_CACHE = 2 << 20         # Minimum size of the cache of each connection, in bytes
+# Settings which apply to read-only connections
+STORAGE_READ_PRAGMAS = ['temp_store', 'cache_size', 'mmap_size']
+
+DUMP_FILE_PATH = os.path.join(os.getcwd(), 'Data', 'DUMP')
 DUMP_FILE_PATTERN = '*.tsv'
 
-TSV_FILE_PATH = os.path.join(os.getcwd(), 'Data\\TSV')
+TSV_FILE_PATH = os.path.join(os.getcwd(), 'Data', 'TSV')
 TSV_FILE_PATTERN = '*.tsv'
 
-ISBN_FILE_PATH = os.path.join(os.getcwd(), 'Data\\ISBN')
+ISBN_FILE_PATH = os.path.join(os.getcwd(), 'Data', 'ISBN')
 ISBN_FILE_PATTERN = '*.txt'
 
-VIAF_TABLE_PATH = os.path.join(os.getcwd(), 'Data\\VIAF')
+VIAF_TABLE_PATH = os.path.join(os.getcwd(), 'Data', 'VIAF')
 VIAF_TABLE_PATTERN = 'viaf*-links.txt'
-VIAF_FILE_PATH = os.path.join(os.getcwd(), 'Data\\VIAF')
+VIAF_FILE_PATH = os.path.join(os.getcwd(), 'Data', 'VIAF')
 VIAF_FILE_PATTERN = 'viaf*-marc21.lex'
 
-NACO_FILE_PATH = os.path.join(os.getcwd(), 'Data\\NACO')
+NACO_FILE_PATH = os.path.join(os.getcwd(), 'Data', 'NACO')
 NACO_FILE_PATTERN = 'naco*.lex'
-BNB_FILE_PATH = os.path.join(os.getcwd(), 'Data\\BNB')
+BNB_FILE_PATH = os.path.join(os.getcwd(), 'Data', 'BNB')
 BNB_FILE_PATTERN = '*-bnb.mrc'
 
+SUBSET_FILE_PATH = os.path.join(os.getcwd(), 'Data', 'SUBSET')
+
 NODE_TYPES = ['string', 'isbn', 'isni', 'viaf', 'naco', 'harpercollins', 'penguin', 'randomhouse']
 
 IDENTIFIER_PAIRS = [('naco', 'isni'), ('naco', 'harpercollins'), ('naco', 'penguin'), ('naco', 'randomhouse'),
@@ -57,11 +113,11 @@ IDENTIFIER_PAIRS = [('naco', 'isni'), ('naco', 'harpercollins'), ('naco', 'pengu
 GRAPH_TABLES = {
     'NACO_authorised': ([
         ('NACO', 'TEXT'),
-        ('string', 'TEXT'),
+        ('name_id', 'INTEGER'),
     ]),
     'NACO_variants': ([
         ('NACO', 'TEXT'),
-        ('string', 'TEXT'),
+        ('name_id', 'INTEGER'),
     ]),
     'VIAF_equivalences': ([
         ('VIAF', 'TEXT'),
@@ -82,10 +138,10 @@ GRAPH_TABLES = {
     ]),     # Can be NACO-isbn, ISNI-isbn, HarperCollins-isbn, Penguin-isbn, RandomHouse-isbn
     'VIAF_string': ([
         ('VIAF', 'TEXT'),
-        ('string', 'TEXT'),
+        ('name_id', 'INTEGER'),
     ]),
     'string_isbn': ([
-        ('string', 'TEXT'),
+        ('name_id', 'INTEGER'),
         ('isbn', 'NCHAR(13)'),
     ]),
     'isbn_equivalents': ([
@@ -94,6 +150,100 @@ GRAPH_TABLES = {
     ]),
 }
 
+# Graph tables as they were at schema version 1, before name strings were replaced by ids (see create_tables);
+# migrations must not depend on the current definitions, which are only valid once every migration has been applied
+SCHEMA_V1_TABLES = {
+    'NACO_authorised': [('NACO', 'TEXT'), ('string', 'TEXT')],
+    'NACO_variants': [('NACO', 'TEXT'), ('string', 'TEXT')],
+    'VIAF_equivalences': [('VIAF', 'TEXT'), ('identifier', 'TEXT')],
+    'other_equivalences': [('other', 'TEXT'), ('identifier', 'TEXT')],
+    'VIAF_isbn': [('VIAF', 'TEXT'), ('isbn', 'NCHAR(13)')],
+    'other_isbn': [('other', 'TEXT'), ('isbn', 'NCHAR(13)')],
+    'VIAF_string': [('VIAF', 'TEXT'), ('string', 'TEXT')],
+    'string_isbn': [('string', 'TEXT'), ('isbn', 'NCHAR(13)')],
+    'isbn_equivalents': [('isbna', 'NCHAR(13)'), ('isbnb', 'NCHAR(13)')],
+}
+
+# Name strings are stored once, in the names table, and referenced by id (in the column name_id) in the graph tables
+# Each graph table with a name_id column has a view, TABLE_text, in which name_id is replaced by the name string
+NAMES_TABLE = 'names'
+NAME_ID = 'name_id'
+NAME_CACHE_SIZE = 500000    # Number of name ids remembered in each generation of the intern cache
+
+# Records the key (first column) of every row inserted into or deleted from a graph table since the last export
+CHANGE_LOG_TABLE = 'change_log'
+
+# Records the row count and maximum rowid of each table when it was last dumped; rows are only added by inserting,
+# which changes both, except in clean, which can delete the rows with the highest rowids and renumber rowids by vacuuming,
+# so the fingerprints are cleared when it runs
+FINGERPRINT_TABLE = 'dump_fingerprints'
+
+DUMP_BATCH_SIZE = 10000
+DUMP_BUFFER_SIZE = 1 << 20
+DUMP_COMPRESSION = None     # Can be None, 'gzip' or 'zstd'
+DUMP_EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+# Limits on the batches of rows written to the database during ingest
+# The row limit starts at BATCH_INITIAL_ROWS, and is adjusted after each batch towards the number of rows
+# which can be written and committed in BATCH_TARGET_SECONDS
+BATCH_INITIAL_ROWS = 10000
+BATCH_MIN_ROWS = 1000
+BATCH_MAX_ROWS = 1000000
+BATCH_TARGET_SECONDS = 0.5
+BATCH_MEMORY_LIMIT = 256 << 20     # Maximum estimated size of a batch in memory, in bytes
+BATCH_ROW_OVERHEAD = 160            # Estimated size of a row in memory (a tuple of strings), excluding the characters
+BATCH_SAMPLE_SIZE = 100             # Number of rows per table sampled to estimate the size of a row
+
+# Estimates of the time taken to add data, and the rows and database size it adds (see IngestEstimator)
+ESTIMATE = False            # If True, ingest options estimate the effect of adding data, instead of adding it
+ESTIMATE_FILE_PATH = 'identities_graph_estimates.jsonl'
+ESTIMATE_SAMPLES = 20       # Number of places in each input file from which records are sampled
+ESTIMATE_SAMPLE_RECORDS = 500       # Number of consecutive records sampled from each place
+ESTIMATE_Z = 1.96           # Confidence bounds are 95%
+ESTIMATE_PAGE_FILL = 0.75   # Estimated fraction of each database page which is used
+ESTIMATE_ROW_OVERHEAD = 10  # Estimated bytes used by a table row on disk, besides its values
+ESTIMATE_INDEX_OVERHEAD = 8         # Estimated bytes used by an index entry on disk, besides its values
+# Descriptions, input files and record formats of the ingest options
+ESTIMATE_INPUTS = OrderedDict([
+    ('L', ('VIAF links table', VIAF_TABLE_PATH, VIAF_TABLE_PATTERN, 'link')),
+    ('V', ('VIAF files', VIAF_FILE_PATH, VIAF_FILE_PATTERN, 'VIAF')),
+    ('N', ('NACO files', NACO_FILE_PATH, NACO_FILE_PATTERN, 'NACO')),
+    ('T', ('TSV files', TSV_FILE_PATH, TSV_FILE_PATTERN, 'tsv')),
+    ('Q', ('lists of ISBN equivalences', ISBN_FILE_PATH, ISBN_FILE_PATTERN, 'isbn')),
+])
+
+# Number of edges remembered in each generation of the cache of edges written to the database
+EDGE_CACHE_SIZE = 500000
+
+CSR_FILE_PATH = os.path.join(os.getcwd(), 'Data', 'CSR')
+
+# Sorted array of the ISBNs (as little-endian uint64) which can match a name in a TSV file (see find_name_matches);
+# it is rebuilt when isbn_equivalents or VIAF_isbn has changed since it was written
+ISBN_FILTER_FILE = os.path.join(os.getcwd(), 'Data', 'known_isbns.bin')
+ISBN_FILTER_TABLES = ['isbn_equivalents', 'VIAF_isbn']
+
+# In-memory database attached to the main connection, to hold temporary tables
+MEMORY_DATABASE = 'memory'
+
+COLUMNAR_FILE_PATH = os.path.join(os.getcwd(), 'Data', 'COLUMNAR')
+COLUMNAR_BATCH_SIZE = 65536
+COLUMNAR_FORMAT = 'arrow'   # Can be 'arrow' (Arrow IPC file) or 'parquet'
+COLUMNAR_EXTENSIONS = {'arrow': '.arrow', 'parquet': '.parquet'}
+
+# SQL expressions giving the typed graph node in each column of each table
+# Bare NACO identifiers, ISBNs and name strings are prefixed, so that every node has the form type:value
+GRAPH_NODES = {
+    'NACO_authorised': ("'naco:' || NACO", "'string:' || string"),
+    'NACO_variants': ("'naco:' || NACO", "'string:' || string"),
+    'VIAF_equivalences': ('VIAF', 'identifier'),
+    'other_equivalences': ('other', 'identifier'),
+    'VIAF_isbn': ('VIAF', "'isbn:' || isbn"),
+    'other_isbn': ('other', "'isbn:' || isbn"),
+    'VIAF_string': ('VIAF', "'string:' || string"),
+    'string_isbn': ("'string:' || string", "'isbn:' || isbn"),
+    'isbn_equivalents': ("'isbn:' || isbna", "'isbn:' || isbnb"),
+}
+
 
 # ====================
 #      Functions
@@ -107,10 +257,44 @@ GRAPH_TABLES = {
 # ====================
 
 
+class BatchController:
+    """Class to decide when a batch of rows should be written to the database
+
+    A batch is written once it reaches the row limit, or its estimated size reaches the memory limit;
+    after each full batch is written, the row limit is adjusted towards the number of rows
+    which can be written and committed in the target time"""
+
+    def __init__(self, target_seconds=BATCH_TARGET_SECONDS, memory_limit=BATCH_MEMORY_LIMIT):
+        self.target_seconds = target_seconds
+        self.memory_limit = memory_limit
+        self.row_limit = BATCH_INITIAL_ROWS
+        self.row_bytes = BATCH_ROW_OVERHEAD + 32
+
+    def full(self, values):
+        """Function to test whether a batch (a dictionary of lists of rows) should be written"""
+        rows = sum(len(values[v]) for v in values)
+        return rows >= self.row_limit or rows * self.row_bytes >= self.memory_limit
+
+    def sample(self, values):
+        """Function to update the estimated size of a row in memory from a sample of a batch"""
+        sample = [row for v in values for row in values[v][:BATCH_SAMPLE_SIZE]]
+        if sample: self.row_bytes = BATCH_ROW_OVERHEAD + sum(len(x) for row in sample for x in row if isinstance(x, str)) / len(sample)
+
+    def update(self, rows, seconds):
+        """Function to adjust the row limit after a batch has been written"""
+        # Small batches (e.g. at the end of a file) are dominated by fixed costs, so are not used
+        if seconds <= 0 or rows < self.row_limit // 2: return
+        target = rows * self.target_seconds / seconds
+        # Move halfway towards the target, growing by no more than a factor of 2 at a time
+        row_limit = min((self.row_limit + target) / 2, self.row_limit * 2)
+        self.row_limit = int(min(max(row_limit, BATCH_MIN_ROWS), BATCH_MAX_ROWS, self.memory_limit / self.row_bytes))
+
+
 class TSV:
 
     def __init__(self, string, headers):
         self.identifiers = {a: set() for a in NODE_TYPES}
+        found = {a: [] for a in ['isni', 'viaf', 'naco']}
         entries = string.split('\t')
         for j, val in enumerate(entries):
             try:
@@ -122,8 +306,7 @@ class TSV:
             h = which(h.lower(), NODE_TYPES)
             if not h: continue
             if h in ['isni', 'viaf', 'naco']:
-                val = clean_identifier(val, type=h)
-                if not is_null(val): self.identifiers[h].add(val)
+                found[h].append(val)
                 continue
             if h in ['string', 'harpercollins', 'penguin', 'randomhouse']:
                 if not is_null(val): self.identifiers[h].add(val)
@@ -131,6 +314,8 @@ class TSV:
             if h == 'isbn':
                 val = str(Isbn(val))
                 if not is_null(val): self.identifiers['isbn'].add(val)
+        for h in found:
+            self.identifiers[h] = clean_identifiers(found[h], type=h)
         del entries
 
     def get_identifiers(self):
@@ -152,86 +337,395 @@ class TSV:
         return self.identifiers
 
 
+class EdgeCache:
+    """Class to remember the edges (rows) recently written to each table, so that they are not written again
+
+    Edges are held in two generations of exact sets; once the current generation is full, it replaces the previous one,
+    so memory use is bounded. Since the sets are exact, an edge which has not been written is never skipped"""
+
+    def __init__(self, size=EDGE_CACHE_SIZE):
+        self.size = size
+        self.current, self.previous, self.count = {}, {}, 0
+
+    def filter(self, table, rows):
+        """Function to remove duplicates, and edges already written, from a list of rows to be written to a table"""
+        current = self.current.setdefault(table, set())
+        previous = self.previous.get(table, ())
+        rows = [row for row in dict.fromkeys(rows) if row not in current and row not in previous]
+        current.update(rows)
+        self.count += len(rows)
+        if self.count >= self.size:
+            self.current, self.previous, self.count = {}, self.current, 0
+        return rows
+
+    def clear(self):
+        """Function to forget all edges, e.g. after rows have been deleted from the database"""
+        self.current, self.previous, self.count = {}, {}, 0
+
+
+class ISBNFilter:
+    """Class to test whether ISBNs are in a sorted file of ISBNs, which is memory-mapped
+
+    With NumPy, a batch of ISBNs is tested with a single vectorised binary search;
+    otherwise each ISBN is found by bisection. NumPy is optional, and only imported when a filter is opened"""
+
+    def __init__(self, path=ISBN_FILTER_FILE):
+        try: import numpy
+        except ImportError: numpy = None
+        self.numpy = numpy
+        self.path = path
+        self.file, self.map = None, None
+        self.isbns = []
+        if os.path.getsize(path) == 0: return
+        if numpy is not None:
+            self.isbns = numpy.memmap(path, dtype='<u8', mode='r')
+            return
+        self.file = open(path, mode='rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if sys.byteorder == 'little': self.isbns = memoryview(self.map).cast('Q')
+        else:
+            self.isbns = array('Q', self.map)
+            self.isbns.byteswap()
+
+    def __len__(self):
+        return len(self.isbns)
+
+    def contains(self, isbns):
+        """Function to test whether each of a list of ISBNs (as strings) is in the filter, returning a list of booleans"""
+        # ISBNs which are not 13 digits cannot be in the filter, and are replaced by 0
+        keys = [int(isbn) if len(isbn) == 13 and isbn.isdigit() else 0 for isbn in isbns]
+        if not keys or len(self.isbns) == 0: return [False] * len(keys)
+        numpy = self.numpy
+        if numpy is not None:
+            keys = numpy.array(keys, dtype=numpy.uint64)
+            positions = numpy.minimum(numpy.searchsorted(self.isbns, keys), len(self.isbns) - 1)
+            return (self.isbns[positions] == keys).tolist()
+        found = []
+        for key in keys:
+            i = bisect.bisect_left(self.isbns, key)
+            found.append(i < len(self.isbns) and self.isbns[i] == key)
+        return found
+
+    def filter(self, rows, column=1):
+        """Function to keep only the rows in which the ISBN in a given column is in the filter"""
+        return [row for row, found in zip(rows, self.contains([row[column] for row in rows])) if found]
+
+    def close(self):
+        if isinstance(self.isbns, memoryview): self.isbns.release()
+        self.isbns = []
+        if self.map: self.map.close()
+        if self.file: self.file.close()
+
+
+class NameDictionary:
+    """Class to intern name strings as integer ids in the names table
+
+    Names are looked up through an index on a hash of the name, rather than on the name itself;
+    the ids of recently used names are held in two generations of dictionaries, as in EdgeCache"""
+
+    def __init__(self, cursor, size=NAME_CACHE_SIZE):
+        self.cursor = cursor
+        self.size = size
+        self.current, self.previous = {}, {}
+
+    def get_id(self, string):
+        """Function to get the id of a name, adding it to the names table if necessary"""
+        if not string: return None
+        name_id = self.current.get(string) or self.previous.get(string)
+        if name_id is None:
+            h = name_hash(string)
+            self.cursor.execute('SELECT id FROM {} WHERE hash = ? AND string = ? ;'.format(NAMES_TABLE), (h, string))
+            row = self.cursor.fetchone()
+            if row: name_id = row[0]
+            else:
+                self.cursor.execute('INSERT INTO {} (hash, string) VALUES (?, ?) ;'.format(NAMES_TABLE), (h, string))
+                name_id = self.cursor.lastrowid
+        self.current[string] = name_id
+        if len(self.current) >= self.size:
+            self.current, self.previous = {}, self.current
+        return name_id
+
+
 class IdentityGraphDatabase:
 
-    def __init__(self):
+    def __init__(self, path=DATABASE_PATH, profile='bulk-ingest', sample=False):
         # Connect to database
-        print('\n\nConnecting to local database ...')
-        print('----------------------------------------')
-        print(str(datetime.datetime.now()))
-
-        self.conn = sqlite3.connect(DATABASE_PATH)
-        self.cursor = self.conn.cursor()
+        self.path = path
+        self.metrics = Metrics(name=os.path.basename(self.path))
+        self.batch = BatchController()
+        self.edges = EdgeCache()
+        self.conn = sqlite3.connect(self.path)
+        self.conn.create_function('name_hash', 1, name_hash, deterministic=True)
+        self.profiler = SQLProfiler() if SQL_PROFILE else None
+        self.cursor = self.new_cursor()
+        self.names = NameDictionary(self.new_cursor())
+        # Only one sampler can run at once, since it uses the process's interval timer, so only the shared database has one
+        self.sampler = None
+        if sample:
+            self.sampler = SamplingProfiler()
+            self.metrics.attach_profiler(self.sampler)
 
         # Set up database
-        self.cursor.execute('PRAGMA synchronous = OFF')
-        self.cursor.execute('PRAGMA journal_mode = OFF')
-        self.cursor.execute('PRAGMA locking_mode = EXCLUSIVE')
+        self.cursor.execute('PRAGMA journal_mode')
+        self.wal = self.cursor.fetchone()[0].lower() == 'wal'
+        self.locking_mode, self.profile = 'NORMAL', None
+        # The schema is upgraded before the storage profile is applied, since a profile may turn off the rollback journal
+        self.migrate()
+        self.set_storage_profile(profile)
         self.cursor.execute('PRAGMA count_changes = FALSE')
-        self.cursor.execute("PRAGMA temp_store_directory = 'I:\Temp'")
 
-        # Create tables
-        for table in GRAPH_TABLES:
+    def set_storage_profile(self, profile):
+        """Function to apply the settings of a storage profile (see STORAGE_PROFILES)
+
+        If STORAGE_PROFILE is set, it is used instead of the profile given"""
+        profile = STORAGE_PROFILE or profile
+        if profile not in STORAGE_PROFILES: raise ValueError('Storage profile {} not recognised'.format(profile))
+        if profile == self.profile: return
+        settings = storage_settings(profile, self.path)
+        self.conn.commit()
+        # If the database has been put into WAL mode for serving lookups, it is left in WAL mode,
+        # without an exclusive lock, so that lookups can continue while data is added
+        locking_mode = 'NORMAL' if self.wal or settings['journal_mode'] == 'WAL' else settings['locking_mode']
+        self.cursor.execute('PRAGMA locking_mode = {}'.format(locking_mode))
+        if locking_mode == 'NORMAL' and self.locking_mode != 'NORMAL':
+            # An exclusive lock is only released the next time the database file is accessed
+            self.cursor.execute('SELECT COUNT(*) FROM sqlite_master;').fetchone()
+        self.locking_mode = locking_mode
+        if not self.wal:
+            self.cursor.execute('PRAGMA journal_mode = {}'.format(settings['journal_mode']))
+            self.wal = self.cursor.fetchone()[0].lower() == 'wal'
+        for pragma in ['synchronous', 'temp_store', 'cache_size', 'mmap_size', 'page_size']:
+            # The page size of an existing database only changes when it is next vacuumed
+            if settings.get(pragma) is not None: self.cursor.execute('PRAGMA {} = {}'.format(pragma, settings[pragma]))
+        self.profile = profile
+
+    def migrate(self):
+        """Function to upgrade the schema of the database to the current version, if it is out of date"""
+        self.cursor.execute('PRAGMA user_version')
+        version = self.cursor.fetchone()[0]
+        if version > SCHEMA_VERSION:
+            self.close()
+            raise RuntimeError('Database schema version {} is newer than this program (version {})'.format(version, SCHEMA_VERSION))
+        for i in range(version, SCHEMA_VERSION):
+            print('Upgrading database schema to version {} ...'.format(str(i + 1)))
+            # Each migration is applied in one transaction with its version number, so a failed migration is rolled back
+            self.conn.commit()
+            self.cursor.execute('BEGIN')
+            try:
+                getattr(self, MIGRATIONS[i])()
+                self.cursor.execute('PRAGMA user_version = {}'.format(i + 1))
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+
+    def create_tables(self):
+        """Function to create the graph tables, change log and dump fingerprints (schema version 1)
+
+        Tables are only created if they do not exist, since databases created before the schema was versioned
+        are at version 0 but already contain them; they are created as they were at version 1 (SCHEMA_V1_TABLES)"""
+        for table in SCHEMA_V1_TABLES:
             print('Creating table {} ...'.format(table))
             self.cursor.execute('CREATE TABLE IF NOT EXISTS {} '
                                 '({}, UNIQUE({}));'
-                                .format(table, ', '.join('{} {}'.format(key, value) for (key, value) in GRAPH_TABLES[table]),
-                                        ', '.join(key for (key, value) in GRAPH_TABLES[table])))
-        self.conn.commit()
-        gc.collect()
+                                .format(table, ', '.join('{} {}'.format(key, value) for (key, value) in SCHEMA_V1_TABLES[table]),
+                                        ', '.join(key for (key, value) in SCHEMA_V1_TABLES[table])))
+        self.create_change_log(tables=SCHEMA_V1_TABLES)
+        self.cursor.execute('CREATE TABLE IF NOT EXISTS {} '
+                            '(table_name TEXT, row_count INTEGER, max_rowid INTEGER, path TEXT, PRIMARY KEY(table_name, path));'
+                            .format(FINGERPRINT_TABLE))
+
+    def create_names(self):
+        """Function to create the names table, and replace the name strings in the graph tables by their ids (schema version 2)"""
+        self.cursor.execute('CREATE TABLE IF NOT EXISTS {} (id INTEGER PRIMARY KEY, hash INTEGER, string TEXT) ;'.format(NAMES_TABLE))
+        self.cursor.execute('CREATE INDEX IF NOT EXISTS IDX_{}_hash ON {} (hash) ;'.format(NAMES_TABLE, NAMES_TABLE))
+        for table in GRAPH_TABLES:
+            columns = [key for (key, value) in GRAPH_TABLES[table]]
+            if NAME_ID not in columns: continue
+            self.cursor.execute('SELECT name FROM pragma_table_info(?) ;', (table,))
+            if 'string' in [row[0] for row in self.cursor.fetchall()]:
+                # Tables created before version 2 contain name strings, and are rebuilt
+                print('Converting names in table {} ...'.format(table))
+                self.cursor.execute('SELECT COUNT(*) FROM sqlite_master WHERE type = \'index\' AND name = ? ;', ('IDX_{}_0'.format(table),))
+                indexed = self.cursor.fetchone()[0] > 0
+                self.cursor.execute('INSERT INTO {n} (hash, string) SELECT DISTINCT name_hash(string), string FROM {t} '
+                                    'WHERE string IS NOT NULL AND string != \'\' AND NOT EXISTS '
+                                    '(SELECT 1 FROM {n} WHERE hash = name_hash({t}.string) AND {n}.string = {t}.string) ;'
+                                    .format(n=NAMES_TABLE, t=table))
+                # Renaming a table checks every trigger in the schema, so the change log triggers are dropped first
+                self.drop_change_log_triggers()
+                self.cursor.execute('ALTER TABLE {t} RENAME TO {t}_old ;'.format(t=table))
+                self.cursor.execute('CREATE TABLE {} ({}, UNIQUE({}));'
+                                    .format(table, ', '.join('{} {}'.format(key, value) for (key, value) in GRAPH_TABLES[table]),
+                                            ', '.join(columns)))
+                self.cursor.execute('INSERT INTO {t} ({c}) SELECT {s} FROM {t}_old '
+                                    'INNER JOIN {n} ON {n}.hash = name_hash({t}_old.string) AND {n}.string = {t}_old.string '
+                                    'ORDER BY {t}_old.rowid ;'
+                                    .format(t=table, n=NAMES_TABLE, c=', '.join(columns),
+                                            s=', '.join('{}.id'.format(NAMES_TABLE) if key == NAME_ID else '{}_old.{}'.format(table, key) for key in columns)))
+                # Dropping the old table also drops its indexes, which are recreated
+                self.cursor.execute('DROP TABLE {}_old ;'.format(table))
+                if indexed: self.build_index(table, commit=False)
+                self.cursor.execute('DELETE FROM {} WHERE table_name = ? ;'.format(FINGERPRINT_TABLE), (table,))
+                if columns[0] == NAME_ID:
+                    self.cursor.execute('UPDATE {c} SET node = (SELECT id FROM {n} WHERE hash = name_hash({c}.node) AND string = {c}.node) '
+                                        'WHERE table_name = ? ;'.format(c=CHANGE_LOG_TABLE, n=NAMES_TABLE), (table,))
+                    self.cursor.execute('DELETE FROM {} WHERE table_name = ? AND node IS NULL ;'.format(CHANGE_LOG_TABLE), (table,))
+            self.cursor.execute('CREATE VIEW IF NOT EXISTS {t}_text AS SELECT {s} FROM {t} INNER JOIN {n} ON {n}.id = {t}.{i} ;'
+                                .format(t=table, n=NAMES_TABLE, i=NAME_ID,
+                                        s=', '.join('{}.string AS string'.format(NAMES_TABLE) if key == NAME_ID else '{}.{}'.format(table, key) for key in columns)))
+        self.create_change_log()
 
     def close(self):
+        # Closing the cursors first finalises their statements, so that the lock on the database is released immediately
+        self.cursor.close()
+        self.names.cursor.close()
+        if self.profiler: self.profiler.write()
+        if self.sampler: self.sampler.write(name=os.path.splitext(os.path.basename(self.path))[0])
         self.conn.close()
         gc.collect()
+        if self.metrics.phases: self.metrics.write()
+
+    def new_cursor(self, connection=None):
+        """Function to open a cursor on a connection (by default the main connection),
+        which records the statements it runs if SQL profiling is turned on"""
+        cursor = (connection or self.conn).cursor()
+        return ProfiledCursor(cursor, self.profiler) if self.profiler else cursor
+
+    def connect_read_only(self):
+        """Function to open a separate read-only connection to the database"""
+        # urllib.request is slow to import, and only needed here
+        import urllib.request
+        uri = 'file:{}?mode=ro'.format(urllib.request.pathname2url(os.path.abspath(self.path)))
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+    def unlock(self):
+        """Function to release the exclusive lock on the database, so that other connections can read it"""
+        self.conn.commit()
+        self.cursor.execute('PRAGMA locking_mode = NORMAL')
+        # The lock is only released the next time the database file is accessed
+        self.cursor.execute('SELECT COUNT(*) FROM sqlite_master;').fetchone()
+
+    def lock(self):
+        """Function to restore the locking mode set when the database was opened"""
+        self.cursor.execute('PRAGMA locking_mode = {}'.format(self.locking_mode))
+
+    @contextmanager
+    def snapshot(self, count):
+        """Function to open a number of read-only connections which all see the same state of the database
+
+        Each connection starts a read transaction while the main connection holds the write lock,
+        so no data can be committed in between; the read transactions last until the connections are closed"""
+        self.unlock()
+        connections = []
+        try:
+            self.cursor.execute('BEGIN IMMEDIATE')
+            try:
+                for i in range(count):
+                    connection = self.connect_read_only()
+                    connections.append(connection)
+                    connection.execute('BEGIN')
+                    connection.execute('SELECT COUNT(*) FROM sqlite_master;').fetchone()
+            finally: self.conn.rollback()
+            yield connections
+        finally:
+            for connection in connections:
+                connection.close()
+            self.lock()
+
+    def run_with_connection(self, pool, function, *args, **kwargs):
+        """Function to call a function with a connection taken from a pool (a queue of connections)"""
+        connection = pool.get()
+        try: return function(*args, connection=connection, **kwargs)
+        finally: pool.put(connection)
+
+    def create_change_log(self, tables=None):
+        """Function to create the change log table, and the triggers which populate it"""
+        if tables is None: tables = GRAPH_TABLES
+        self.cursor.execute('CREATE TABLE IF NOT EXISTS {} '
+                            '(table_name TEXT, node TEXT, UNIQUE(table_name, node));'.format(CHANGE_LOG_TABLE))
+        for table in tables:
+            key = tables[table][0][0]
+            for event, row in [('INSERT', 'NEW'), ('DELETE', 'OLD')]:
+                self.cursor.execute('CREATE TRIGGER IF NOT EXISTS TRG_{}_{} AFTER {} ON {} '
+                                    'WHEN {}.{} IS NOT NULL '
+                                    'BEGIN INSERT OR IGNORE INTO {} (table_name, node) VALUES (\'{}\', {}.{}); END;'
+                                    .format(table, event.lower(), event, table, row, key, CHANGE_LOG_TABLE, table, row, key))
+
+    def drop_change_log_triggers(self):
+        """Function to drop the triggers which populate the change log"""
+        for table in GRAPH_TABLES:
+            for event in ['insert', 'delete']:
+                self.cursor.execute('DROP TRIGGER IF EXISTS TRG_{}_{} ;'.format(table, event))
 
-    def clean(self):
+    def clear_change_log(self):
+        """Function to empty the change log once the changes it records have been exported"""
+        self.cursor.execute('DELETE FROM {};'.format(CHANGE_LOG_TABLE))
+        self.conn.commit()
+
+    def clear_fingerprints(self):
+        """Function to forget the fingerprints of the tables when they were last dumped (e.g. before deleting rows),
+        so that every table is dumped again"""
+        self.cursor.execute('DELETE FROM {};'.format(FINGERPRINT_TABLE))
+        self.conn.commit()
+
+    def clean(self, vacuum=True):
         date_time_message('Cleaning')
 
+        # The dump fingerprints are cleared before any rows are deleted
         self.cross_reference()
 
         # Delete null entries
-        for table in GRAPH_TABLES:
-            print('Deleting NULL entries from table {} ...'.format(table))
-            self.cursor.execute('DELETE FROM {} '
-                                'WHERE {} IS NULL OR {} IS NULL OR {} = "" OR {} = "" ;'
-                                .format(table, GRAPH_TABLES[table][0][0], GRAPH_TABLES[table][1][0], GRAPH_TABLES[table][0][0], GRAPH_TABLES[table][1][0]))
-        self.conn.commit()
+        with self.metrics.phase('clean'):
+            self.edges.clear()
+            for table in GRAPH_TABLES:
+                print('Deleting NULL entries from table {} ...'.format(table))
+                self.cursor.execute('DELETE FROM {} '
+                                    'WHERE {} IS NULL OR {} IS NULL OR {} = "" OR {} = "" ;'
+                                    .format(table, GRAPH_TABLES[table][0][0], GRAPH_TABLES[table][1][0], GRAPH_TABLES[table][0][0], GRAPH_TABLES[table][1][0]))
+            self.conn.commit()
         gc.collect()
 
+        if not vacuum: return
         date_time_message('Vacuuming')
-        self.conn.execute("VACUUM")
-        self.conn.commit()
+        with self.metrics.phase('vacuum'):
+            self.cursor.execute("VACUUM")
+            self.conn.commit()
         gc.collect()
 
     def cross_reference(self):
-        print('Cross-referencing tables VIAF_equivalences and other_equivalences ...')
-        self.cursor.execute('INSERT OR IGNORE INTO VIAF_equivalences (VIAF, identifier) '
-                            'SELECT VIAF_equivalences.VIAF, other_equivalences.identifier '
-                            'FROM VIAF_equivalences INNER JOIN other_equivalences ON VIAF_equivalences.identifier = other_equivalences.other  ;')
-        self.conn.commit()
-        self.cursor.execute('INSERT OR IGNORE INTO VIAF_equivalences (VIAF, identifier) '
-                            'SELECT VIAF_equivalences.VIAF, other_equivalences.other '
-                            'FROM VIAF_equivalences INNER JOIN other_equivalences ON VIAF_equivalences.identifier = other_equivalences.identifier  ;')
-        self.conn.commit()
-        self.cursor.execute('DELETE FROM other_equivalences '
-                            'WHERE other_equivalences.identifier IN '
-                            '(SELECT identifier FROM VIAF_equivalences) ;')
-        self.conn.commit()
-        self.cursor.execute('DELETE FROM other_equivalences '
-                            'WHERE other_equivalences.other IN '
-                            '(SELECT identifier FROM VIAF_equivalences) ;')
-        self.conn.commit()
-        gc.collect()
-        print('Cross-referencing tables VIAF_isbn, VIAF_equivalences and other_isbn ...')
-        self.cursor.execute('INSERT OR IGNORE INTO VIAF_isbn (VIAF, isbn) '
-                            'SELECT VIAF_equivalences.VIAF, other_isbn.isbn '
-                            'FROM VIAF_equivalences INNER JOIN other_isbn ON VIAF_equivalences.identifier = other_isbn.other  ;')
-        self.conn.commit()
-        self.cursor.execute('DELETE FROM other_isbn '
-                            'WHERE other_isbn.other IN '
-                            '(SELECT identifier FROM VIAF_equivalences) ;')
-        self.conn.commit()
-        gc.collect()
+        self.clear_fingerprints()
+        with self.metrics.phase('cross_reference'):
+            # Rows are deleted, so edges which have been written may no longer be in the database
+            self.edges.clear()
+            print('Cross-referencing tables VIAF_equivalences and other_equivalences ...')
+            self.cursor.execute('INSERT OR IGNORE INTO VIAF_equivalences (VIAF, identifier) '
+                                'SELECT VIAF_equivalences.VIAF, other_equivalences.identifier '
+                                'FROM VIAF_equivalences INNER JOIN other_equivalences ON VIAF_equivalences.identifier = other_equivalences.other  ;')
+            self.conn.commit()
+            self.cursor.execute('INSERT OR IGNORE INTO VIAF_equivalences (VIAF, identifier) '
+                                'SELECT VIAF_equivalences.VIAF, other_equivalences.other '
+                                'FROM VIAF_equivalences INNER JOIN other_equivalences ON VIAF_equivalences.identifier = other_equivalences.identifier  ;')
+            self.conn.commit()
+            self.cursor.execute('DELETE FROM other_equivalences '
+                                'WHERE other_equivalences.identifier IN '
+                                '(SELECT identifier FROM VIAF_equivalences) ;')
+            self.conn.commit()
+            self.cursor.execute('DELETE FROM other_equivalences '
+                                'WHERE other_equivalences.other IN '
+                                '(SELECT identifier FROM VIAF_equivalences) ;')
+            self.conn.commit()
+            gc.collect()
+            print('Cross-referencing tables VIAF_isbn, VIAF_equivalences and other_isbn ...')
+            self.cursor.execute('INSERT OR IGNORE INTO VIAF_isbn (VIAF, isbn) '
+                                'SELECT VIAF_equivalences.VIAF, other_isbn.isbn '
+                                'FROM VIAF_equivalences INNER JOIN other_isbn ON VIAF_equivalences.identifier = other_isbn.other  ;')
+            self.conn.commit()
+            self.cursor.execute('DELETE FROM other_isbn '
+                                'WHERE other_isbn.other IN '
+                                '(SELECT identifier FROM VIAF_equivalences) ;')
+            self.conn.commit()
+            gc.collect()
 
     def set_queries(self):
         queries, values = {}, {}
@@ -241,14 +735,34 @@ class IdentityGraphDatabase:
             values['{}'.format(table)] = []
         return queries, values
 
-    def execute_all(self, query, values):
-        if values:
-            self.cursor.executemany(query, values)
+    def flush(self, queries, values):
+        """Function to write a batch of rows to one or more tables, and commit them together
+
+        Rows already in the batch, or recently written to the database, are not written again;
+        returns empty lists of values for the next batch"""
+        for v in values:
+            if v not in GRAPH_TABLES or not values[v]: continue
+            rows = len(values[v])
+            values[v] = self.edges.filter(v, values[v])
+            self.metrics.increment('duplicate rows skipped', rows - len(values[v]))
+        rows = sum(len(values[v]) for v in values)
+        if rows:
+            self.batch.sample(values)
+            start = time.perf_counter()
+            for v in queries:
+                if values[v]: self.cursor.executemany(queries[v], values[v])
             self.conn.commit()
-            gc.collect()
-        return []
+            seconds = time.perf_counter() - start
+            self.batch.update(rows, seconds)
+            self.metrics.commit_latency(seconds)
+            self.metrics.lap('write')
+            self.metrics.count('write', records=rows)
+        return {v: [] for v in values}
 
-    def build_index(self, table):
+    def execute_all(self, query, values):
+        return self.flush({query: query}, {query: values})[query]
+
+    def build_index(self, table, commit=True):
         """Function to build indexes in a table"""
         if table not in GRAPH_TABLES:
             print('Table name {} not recognised'.format(table))
@@ -259,7 +773,7 @@ class IdentityGraphDatabase:
         self.cursor.execute("""CREATE INDEX IDX_{}_0 ON {} ({});""".format(table, table, GRAPH_TABLES[table][0][0]))
         self.cursor.execute("""DROP INDEX IF EXISTS IDX_{}_1 ;""".format(table))
         self.cursor.execute("""CREATE INDEX IDX_{}_1 ON {} ({});""".format(table, table, GRAPH_TABLES[table][1][0]))
-        self.conn.commit()
+        if commit: self.conn.commit()
         gc.collect()
 
     def build_indexes(self):
@@ -268,8 +782,9 @@ class IdentityGraphDatabase:
         print('----------------------------------------')
         print(str(datetime.datetime.now()))
 
-        for table in GRAPH_TABLES:
-            self.build_index(table)
+        with self.metrics.phase('index'):
+            for table in GRAPH_TABLES:
+                self.build_index(table)
 
     def drop_indexes(self):
         """Function to drop indexes in the whole database"""
@@ -279,40 +794,327 @@ class IdentityGraphDatabase:
             self.conn.commit()
         gc.collect()
 
-    def dump_table(self, table):
-        """Function to dump a database table into a text file"""
+    def fingerprint(self, table, connection=None):
+        """Function to get the row count and maximum rowid of a table"""
+        cursor = self.new_cursor(connection) if connection else self.cursor
+        cursor.execute('SELECT COUNT(*), MAX(rowid) FROM {};'.format(table))
+        row_count, max_rowid = cursor.fetchone()
+        return row_count, max_rowid or 0
+
+    def dump_unchanged(self, table, path, connection=None):
+        """Function to test whether a table is unchanged since it was dumped to a file"""
+        if not os.path.isfile(path): return False
+        cursor = self.new_cursor(connection) if connection else self.cursor
+        cursor.execute('SELECT row_count, max_rowid FROM {} WHERE table_name = ? AND path = ?;'
+                       .format(FINGERPRINT_TABLE), (table, path))
+        return cursor.fetchone() == self.fingerprint(table, connection=connection)
+
+    def dump_table(self, table, connection=None, compression=None):
+        """Function to dump a database table into a TSV file
+
+        Rows are streamed in batches of DUMP_BATCH_SIZE;
+        if a connection is given, it is used instead of the main connection (e.g. to dump tables in parallel)"""
         print('Creating dump of {} table ...'.format(table))
-        self.cursor.execute('SELECT * FROM {};'.format(table))
-        file = open('{}_DUMP_.txt'.format(table), mode='w', encoding='utf-8', errors='replace')
-        record_count = 0
-        row = self.cursor.fetchone()
-        while row:
-            record_count += 1
-            if record_count % 100 == 0:
-                print('\r{} records processed'.format(str(record_count)), end='\r')
-            file.write('{}\n'.format(str(row)))
-            row = self.cursor.fetchone()
-        del row
-        print('\r{} records processed'.format(str(record_count)), end='\r')
+        cursor = self.new_cursor(connection) if connection else self.cursor
+        cursor.execute('SELECT * FROM {};'.format(text_view(table)))
+        file = open_dump_file(dump_file_name(table, compression), compression)
+        record_count = write_tsv(file, cursor, header=text_columns(table),
+                                 progress=connection is None)
         file.close()
-        gc.collect()
         print('{} records in {} table'.format(str(record_count), table))
         return record_count
 
-    def dump_database(self):
-        """Function to create dumps of all tables within the database"""
+    def dump_database(self, compression=None, workers=None, force=False, reports=False):
+        """Function to create dumps of all tables within the database, and (if reports is True) write the reports
+
+        Tables which are unchanged since they were last dumped are skipped, unless force is True;
+        the remaining tables and the reports are written in parallel, over separate read-only connections
+        which all see the same snapshot of the database"""
         print('\nCreating dump of database ...')
         print('----------------------------------------')
         print(str(datetime.datetime.now()))
 
+        compression = compression or DUMP_COMPRESSION
+        report_functions = [self.write_naco_isni_equivalents, self.write_proprietary_identifiers] if reports else []
+        workers = workers or min(len(GRAPH_TABLES) + len(report_functions), os.cpu_count() or 1)
+        self.metrics.lap()
+        if workers == 1:
+            tables = self.tables_to_dump(compression, force)
+            record_count = sum(self.dump_table(table, compression=compression) for table in tables)
+        else:
+            # concurrent.futures is slow to import, and only needed here
+            from concurrent.futures import ThreadPoolExecutor
+            # The time taken by reports written in parallel with the dumps is included in the dump phase
+            with self.snapshot(workers) as connections:
+                tables = self.tables_to_dump(compression, force, connection=connections[0])
+                pool = queue.Queue()
+                for connection in connections:
+                    pool.put(connection)
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    dump_futures = [executor.submit(self.run_with_connection, pool, self.dump_table, table, compression=compression)
+                             for table in tables]
+                    report_futures = [executor.submit(self.run_with_connection, pool, function) for function in report_functions]
+                    record_count = sum(future.result() for future in dump_futures)
+                    self.metrics.count('report', records=sum(future.result() for future in report_futures))
+
+        for table in tables:
+            (row_count, max_rowid), path = tables[table]
+            self.cursor.execute('INSERT OR REPLACE INTO {} (table_name, row_count, max_rowid, path) '
+                                'VALUES (?, ?, ?, ?);'.format(FINGERPRINT_TABLE), (table, row_count, max_rowid, path))
+        self.conn.commit()
+        self.metrics.lap('dump')
+        self.metrics.count('dump', records=record_count)
+        if workers == 1:
+            for function in report_functions:
+                function()
+
+    def tables_to_dump(self, compression=None, force=False, connection=None):
+        """Function to get the fingerprints and dump file names of the tables which have changed since they were last dumped"""
+        tables = {}
         for table in GRAPH_TABLES:
-            self.dump_table('{}'.format(table))
+            path = dump_file_name(table, compression)
+            if not force and self.dump_unchanged(table, path, connection=connection):
+                print('Table {} is unchanged since the last dump'.format(table))
+                continue
+            tables[table] = (self.fingerprint(table, connection=connection), path)
+        return tables
+
+    def dump_changes(self, table):
+        """Function to write the current state of the keys in a table which have changed since the last export
+
+        Each changed key is written in full, so that consumers can replace all their rows for that key;
+        keys which no longer have any rows are written as tombstones"""
+        print('Creating dump of changes to {} table ...'.format(table))
+        key, value = GRAPH_TABLES[table][0][0], GRAPH_TABLES[table][1][0]
+        # Name ids are replaced by the name strings
+        node, joins = '{}.node'.format(CHANGE_LOG_TABLE), ''
+        if key == NAME_ID:
+            node, joins = 'kn.string', 'LEFT JOIN {} AS kn ON kn.id = {}.node '.format(NAMES_TABLE, CHANGE_LOG_TABLE)
+        val = '{}.{}'.format(table, value)
+        if value == NAME_ID:
+            val, joins = 'vn.string', joins + 'LEFT JOIN {} AS vn ON vn.id = {}.{} '.format(NAMES_TABLE, table, value)
+        self.cursor.execute('SELECT {n}, {t}.{v} IS NULL, {val} FROM {c} LEFT JOIN {t} ON {t}.{k} = {c}.node {j}'
+                            'WHERE {c}.table_name = ? ORDER BY {n} ;'
+                            .format(c=CHANGE_LOG_TABLE, t=table, k=key, v=value, n=node, val=val, j=joins), (table,))
+        file = open_dump_file('{}_CHANGES_.tsv'.format(table))
+        writer = csv.writer(file, delimiter='\t', lineterminator='\n')
+        writer.writerow(['Change'] + text_columns(table))
+        record_count, tombstone_count = 0, 0
+        rows = self.cursor.fetchmany(DUMP_BATCH_SIZE)
+        while rows:
+            for node, tombstone, val in rows:
+                record_count += 1
+                if tombstone:
+                    tombstone_count += 1
+                    writer.writerow(['-', node, ''])
+                else: writer.writerow(['+', node, val])
+            self.metrics.progress(record_count)
+            rows = self.cursor.fetchmany(DUMP_BATCH_SIZE)
+        file.close()
+        self.metrics.progress(record_count, final=True)
+        print('{} changed records and {} tombstones in {} table'.format(str(record_count - tombstone_count), str(tombstone_count), table))
+        return record_count
+
+    def dump_database_changes(self):
+        """Function to create dumps of the changes to all tables since the last export"""
+        print('\nCreating dump of changes to database ...')
+        print('----------------------------------------')
+        print(str(datetime.datetime.now()))
+
+        with self.metrics.phase('dump') as phase:
+            for table in GRAPH_TABLES:
+                phase['records'] += self.dump_changes('{}'.format(table))
+        self.clear_change_log()
+
+    def export_csr(self, path=CSR_FILE_PATH):
+        """Function to export the graph as an interned node table and one compressed sparse row adjacency per table
+
+        Files written (all integers are little-endian, and can be memory-mapped directly):
+            nodes.bin                   UTF-8 node names (type:value), concatenated in sorted order
+            nodes_offsets.bin           int64 [nodes + 1]: node i is nodes.bin[offsets[i]:offsets[i + 1]]
+            TABLE_offsets.bin           int64 [nodes + 1]: the neighbours of node i are neighbours[offsets[i]:offsets[i + 1]]
+            TABLE_neighbours.bin        int32 [2 * edges]: edges are stored in both directions
+            manifest.json               counts and data types"""
+        print('\nExporting graph adjacency ...')
+        print('----------------------------------------')
+        print(str(datetime.datetime.now()))
 
-    def create_temp_table(self, columns=('string', 'isbn', 'identifier')):
-        self.cursor.execute('DROP TABLE IF EXISTS ttable ;')
-        self.cursor.execute('CREATE TABLE ttable ({} TEXT, {} TEXT, {} TEXT) ;'.format(columns[0], columns[1], columns[2]))
+        os.makedirs(path, exist_ok=True)
+        self.metrics.lap()
+        print('Interning nodes ...')
+        self.cursor.execute('DROP TABLE IF EXISTS temp.csr_nodes ;')
+        self.cursor.execute('CREATE TEMP TABLE csr_nodes (id INTEGER PRIMARY KEY, node TEXT UNIQUE) ;')
+        self.cursor.execute('INSERT INTO csr_nodes (id, node) SELECT NULL, node FROM ({}) '
+                            'WHERE node IS NOT NULL AND node NOT LIKE \'%:\' ORDER BY node ;'
+                            .format(' UNION '.join('SELECT {} AS node FROM {}'.format(expression, text_view(table))
+                                                   for table in GRAPH_NODES for expression in GRAPH_NODES[table])))
+        self.conn.commit()
+        self.cursor.execute('SELECT COUNT(*) FROM csr_nodes ;')
+        node_count = self.cursor.fetchone()[0]
+
+        # Node ids are assigned in sorted order; rowids start from 1, but node ids start from 0
+        self.cursor.execute('SELECT node FROM csr_nodes ORDER BY id ;')
+        offsets, position = array('q', [0]), 0
+        with open(os.path.join(path, 'nodes.bin'), mode='wb', buffering=DUMP_BUFFER_SIZE) as file:
+            rows = self.cursor.fetchmany(DUMP_BATCH_SIZE)
+            while rows:
+                for row in rows:
+                    node = row[0].encode('utf-8')
+                    file.write(node)
+                    position += len(node)
+                    offsets.append(position)
+                rows = self.cursor.fetchmany(DUMP_BATCH_SIZE)
+        write_array(os.path.join(path, 'nodes_offsets.bin'), offsets)
+        print('{} nodes'.format(str(node_count)))
+
+        edge_counts = {}
+        for table in GRAPH_NODES:
+            edge_counts[table] = self.export_csr_table(table, node_count, path)
+
+        with open(os.path.join(path, 'manifest.json'), mode='w', encoding='utf-8') as file:
+            json.dump({'nodes': node_count, 'edges': edge_counts, 'offsets_dtype': '<i8', 'neighbours_dtype': '<i4',
+                       'created': str(datetime.datetime.now())}, file, indent=2)
+        self.cursor.execute('DROP TABLE IF EXISTS temp.csr_nodes ;')
+        self.conn.commit()
+        self.metrics.lap('export')
+        self.metrics.count('export', records=sum(edge_counts.values()))
+        gc.collect()
+        return node_count
+
+    def export_csr_table(self, table, node_count, path=CSR_FILE_PATH):
+        """Function to write the compressed sparse row adjacency of the edges in a single table"""
+        print('Exporting adjacency of {} table ...'.format(table))
+        edges = 'SELECT a.id - 1 AS src, b.id - 1 AS dst FROM {} JOIN csr_nodes AS a ON a.node = {} ' \
+                'JOIN csr_nodes AS b ON b.node = {} WHERE a.id != b.id'.format(text_view(table), *GRAPH_NODES[table])
+        self.cursor.execute('SELECT src, dst FROM ({} UNION SELECT dst, src FROM ({})) ORDER BY src, dst ;'
+                            .format(edges, edges))
+        offsets, edge_count, node = array('q', [0] * (node_count + 1)), 0, 0
+        with open(os.path.join(path, '{}_neighbours.bin'.format(table)), mode='wb') as file:
+            rows = self.cursor.fetchmany(DUMP_BATCH_SIZE)
+            while rows:
+                neighbours = array('i')
+                for src, dst in rows:
+                    while node < src:
+                        node += 1
+                        offsets[node] = edge_count
+                    neighbours.append(dst)
+                    edge_count += 1
+                write_array(file, neighbours)
+                rows = self.cursor.fetchmany(DUMP_BATCH_SIZE)
+        while node < node_count:
+            node += 1
+            offsets[node] = edge_count
+        write_array(os.path.join(path, '{}_offsets.bin'.format(table)), offsets)
+        print('{} edges in {} table'.format(str(edge_count // 2), table))
+        return edge_count // 2
+
+    def export_columnar(self, path=COLUMNAR_FILE_PATH, file_format=None, batch_size=COLUMNAR_BATCH_SIZE):
+        """Function to export all tables to Arrow IPC or Parquet files, streaming fixed-size record batches
+
+        Columns containing prefixed identifiers (e.g. viaf:123) are split into a dictionary-encoded type column
+        (e.g. VIAF_type) and a value column (e.g. VIAF); requires the pyarrow module"""
+        print('\nExporting columnar tables ...')
+        print('----------------------------------------')
+        print(str(datetime.datetime.now()))
+
+        file_format = file_format or COLUMNAR_FORMAT
+        if file_format not in COLUMNAR_EXTENSIONS:
+            raise ValueError('Columnar format {} not recognised'.format(file_format))
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError: raise ImportError('Columnar export requires the pyarrow module')
+
+        os.makedirs(path, exist_ok=True)
+        self.metrics.lap()
+        node_types = pyarrow.array(NODE_TYPES, type=pyarrow.string())
+        type_index = {t: i for i, t in enumerate(NODE_TYPES)}
+        for table in GRAPH_TABLES:
+            print('Exporting {} table ...'.format(table))
+            columns, fields, prefixed = [], [], []
+            for i, key in enumerate(text_columns(table)):
+                if GRAPH_NODES[table][i] == key:
+                    columns.extend(['SUBSTR({k}, 1, INSTR({k}, \':\') - 1)'.format(k=key),
+                                    'SUBSTR({k}, INSTR({k}, \':\') + 1)'.format(k=key)])
+                    fields.extend([pyarrow.field('{}_type'.format(key), pyarrow.dictionary(pyarrow.int8(), pyarrow.string())),
+                                   pyarrow.field(key, pyarrow.string())])
+                    prefixed.append(True)
+                    prefixed.append(False)
+                else:
+                    columns.append(key)
+                    fields.append(pyarrow.field(key, pyarrow.string()))
+                    prefixed.append(False)
+            schema = pyarrow.schema(fields)
+            filename = os.path.join(path, '{}{}'.format(table, COLUMNAR_EXTENSIONS[file_format]))
+            if file_format == 'parquet': writer = pyarrow.parquet.ParquetWriter(filename, schema)
+            else: writer = pyarrow.ipc.new_file(filename, schema)
+
+            self.cursor.execute('SELECT {} FROM {} ;'.format(', '.join(columns), text_view(table)))
+            record_count = 0
+            rows = self.cursor.fetchmany(batch_size)
+            while rows:
+                arrays = []
+                for i, values in enumerate(zip(*rows)):
+                    if prefixed[i]:
+                        # The dictionary is the same in every batch, as the Arrow IPC file format requires
+                        indices = pyarrow.array([type_index.get(v) for v in values], type=pyarrow.int8())
+                        arrays.append(pyarrow.DictionaryArray.from_arrays(indices, node_types))
+                    else: arrays.append(pyarrow.array(values, type=pyarrow.string()))
+                batch = pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+                if file_format == 'parquet': writer.write_table(pyarrow.Table.from_batches([batch]))
+                else: writer.write_batch(batch)
+                record_count += len(rows)
+                self.metrics.progress(record_count)
+                rows = self.cursor.fetchmany(batch_size)
+            writer.close()
+            self.metrics.progress(record_count, final=True)
+            self.metrics.lap('export')
+            self.metrics.count('export', records=record_count)
+            print('{} records in {} table'.format(str(record_count), table))
+        gc.collect()
+
+    def create_temp_table(self, columns=('source INTEGER', 'string TEXT', 'isbn TEXT', 'identifier TEXT')):
+        """Function to create the temporary table ttable, in the in-memory database"""
+        # Databases created by earlier versions of the script may still contain ttable
+        self.cursor.execute('DROP TABLE IF EXISTS main.ttable ;')
+        self.conn.commit()
+        self.cursor.execute('PRAGMA database_list')
+        if MEMORY_DATABASE not in [row[1] for row in self.cursor.fetchall()]:
+            self.cursor.execute('ATTACH DATABASE \':memory:\' AS {} ;'.format(MEMORY_DATABASE))
+        self.cursor.execute('DROP TABLE IF EXISTS {}.ttable ;'.format(MEMORY_DATABASE))
+        self.cursor.execute('CREATE TABLE {}.ttable ({}) ;'.format(MEMORY_DATABASE, ', '.join(columns)))
         self.conn.commit()
 
+    def drop_temp_table(self):
+        self.cursor.execute('DROP TABLE IF EXISTS {}.ttable ;'.format(MEMORY_DATABASE))
+        self.conn.commit()
+
+    def build_isbn_filter(self, path=ISBN_FILTER_FILE):
+        """Function to write the sorted array of ISBNs which have an equivalent ISBN in VIAF_isbn,
+        unless neither table has changed since it was last written"""
+        if all(self.dump_unchanged(table, path) for table in ISBN_FILTER_TABLES): return
+        print('Building ISBN filter ...')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 13-digit ISBNs sort in the same order as strings and as integers
+        self.cursor.execute('SELECT DISTINCT isbn_equivalents.isbna FROM isbn_equivalents '
+                            'INNER JOIN VIAF_isbn ON VIAF_isbn.isbn = isbn_equivalents.isbnb '
+                            'ORDER BY isbn_equivalents.isbna ;')
+        isbn_count = 0
+        with open(path, mode='wb', buffering=DUMP_BUFFER_SIZE) as file:
+            rows = self.cursor.fetchmany(DUMP_BATCH_SIZE)
+            while rows:
+                isbns = array('Q', (int(row[0]) for row in rows if row[0] and len(row[0]) == 13 and row[0].isdigit()))
+                write_array(file, isbns)
+                isbn_count += len(isbns)
+                rows = self.cursor.fetchmany(DUMP_BATCH_SIZE)
+        for table in ISBN_FILTER_TABLES:
+            row_count, max_rowid = self.fingerprint(table)
+            self.cursor.execute('INSERT OR REPLACE INTO {} (table_name, row_count, max_rowid, path) '
+                                'VALUES (?, ?, ?, ?);'.format(FINGERPRINT_TABLE), (table, row_count, max_rowid, path))
+        self.conn.commit()
+        print('{} ISBNs in filter'.format(str(isbn_count)))
+
     def add_values(self, identifiers, names, values):
 
         if len(identifiers['viaf']) > 0:
@@ -333,24 +1135,26 @@ class IdentityGraphDatabase:
                         values['other_isbn'].append(('{}:{}'.format(h, i), isbn))
 
         for name in names:
+            name_id = self.names.get_id(name)
             for isbn in identifiers['isbn']:
-                values['string_isbn'].append((name, isbn))
+                values['string_isbn'].append((name_id, isbn))
             for v in identifiers['viaf']:
-                values['VIAF_string'].append(('viaf:{}'.format(v), name))
+                values['VIAF_string'].append(('viaf:{}'.format(v), name_id))
 
         return values
 
-    def add_marc(self, record_type='BNB'):
+    def add_marc(self, record_type='BNB', file_list=None, clean=True):
         """Function to add data from MARC files"""
 
         # This currently only works for NACO records, which do not contain ISBNs
 
-        if record_type == 'NACO':
-            file_list = glob.glob('\\'.join((NACO_FILE_PATH, NACO_FILE_PATTERN)))
-        elif record_type == 'VIAF':
-            file_list = glob.glob('\\'.join((VIAF_FILE_PATH, VIAF_FILE_PATTERN)))
-        else:
-            file_list = glob.glob('\\'.join((BNB_FILE_PATH, BNB_FILE_PATTERN)))
+        if file_list is None:
+            if record_type == 'NACO':
+                file_list = get_file_list(NACO_FILE_PATH, NACO_FILE_PATTERN)
+            elif record_type == 'VIAF':
+                file_list = get_file_list(VIAF_FILE_PATH, VIAF_FILE_PATTERN)
+            else:
+                file_list = get_file_list(BNB_FILE_PATH, BNB_FILE_PATTERN)
 
         for file in file_list:
             queries, values = self.set_queries()
@@ -360,40 +1164,44 @@ class IdentityGraphDatabase:
             print(str(datetime.datetime.now()))
 
             record_count = 0
-            file = open(file, mode='rb')
+            file = open_input(file, mode='rb')
             reader = MARCReader(file)
-            for record in reader:
-                record_count += 1
-                identifiers = record.get_identifiers(record_type=record_type)
-                names = record.get_name_strings()
-
-                if record_type == 'NACO':
-                    authorised_name = record.get_authorised_name()
-                    if not authorised_name: continue
-                    for n in identifiers['naco']:
-                        values['NACO_authorised'].append((n, authorised_name))
-                        for name in names:
-                            if name == authorised_name: continue
-                            values['NACO_variants'].append((n, name))
-
-                values = self.add_values(identifiers, names, values)
-
-                if record_count % 10000 == 0:
-                    print('\r{} records processed'.format(str(record_count)), end='\r')
-                    for v in queries:
-                        values[v] = self.execute_all(queries[v], values[v])
-
-                del identifiers, names
+            self.metrics.lap()
+            for records in chunks(reader):
+                record_count += len(records)
+                self.metrics.lap('parse')
+                for record in records: values = self.add_marc_record(record, record_type, values)
+                self.metrics.lap('extract')
+                self.metrics.progress(record_count)
+
+                if self.batch.full(values): values = self.flush(queries, values)
             file.close()
-            print('\r{} records processed'.format(str(record_count)), end='\r')
-            for v in queries:
-                self.execute_all(queries[v], values[v])
-        self.clean()
+            self.metrics.progress(record_count, final=True)
+            self.metrics.count('parse', records=record_count, bytes=os.path.getsize(file.name))
+            self.flush(queries, values)
+        if clean: self.clean()
         del file_list
 
-    def add_tsv(self):
+    def add_marc_record(self, record, record_type, values):
+        """Function to add the rows extracted from a MARC record to a batch of values"""
+        identifiers = record.get_identifiers(record_type=record_type)
+        names = record.get_name_strings()
+
+        if record_type == 'NACO':
+            authorised_name = record.get_authorised_name()
+            if not authorised_name: return values
+            authorised_id = self.names.get_id(authorised_name)
+            variant_ids = [self.names.get_id(name) for name in names if name != authorised_name]
+            for n in identifiers['naco']:
+                values['NACO_authorised'].append((n, authorised_id))
+                for name_id in variant_ids:
+                    values['NACO_variants'].append((n, name_id))
+
+        return self.add_values(identifiers, names, values)
+
+    def add_tsv(self, file_list=None, clean=True):
         """Function to add data from TSV files"""
-        file_list = glob.glob('\\'.join((TSV_FILE_PATH, TSV_FILE_PATTERN)))
+        if file_list is None: file_list = get_file_list(TSV_FILE_PATH, TSV_FILE_PATTERN)
         for file in file_list:
             queries, values = self.set_queries()
 
@@ -401,35 +1209,37 @@ class IdentityGraphDatabase:
             print('----------------------------------------')
             print(str(datetime.datetime.now()))
 
-            file = open(file, mode='r', encoding='utf-8', errors='replace')
+            file = open_input(file, mode='r')
             headers = list(enumerate(file.readline().split('\t')))
             record_count = 0
 
-            for filelineno, line in enumerate(file):
-                record_count += 1
-
-                tsv = TSV(line.strip('\n'), headers)
-                identifiers = tsv.get()
-                names = tsv.get_names()
-                if not identifiers:
-                    continue
+            self.metrics.lap()
+            for lines in chunks(file):
+                record_count += len(lines)
+                self.metrics.lap('parse')
+                for line in lines: values = self.add_tsv_line(line, headers, values)
+                self.metrics.lap('extract')
+                self.metrics.progress(record_count)
 
-                values = self.add_values(identifiers, names, values)
-
-                if record_count % 1000 == 0:
-                    print('\r{} records processed'.format(str(record_count)), end='\r')
-                    for v in queries:
-                        values[v] = self.execute_all(queries[v], values[v])
+                if self.batch.full(values): values = self.flush(queries, values)
 
             file.close()
-            print('\r{} records processed'.format(str(record_count)), end='\r')
-            for v in queries:
-                self.execute_all(queries[v], values[v])
-        self.clean()
-
-    def add_viaf_links(self):
+            self.metrics.progress(record_count, final=True)
+            self.metrics.count('parse', records=record_count, bytes=os.path.getsize(file.name))
+            self.flush(queries, values)
+        if clean: self.clean()
+
+    def add_tsv_line(self, line, headers, values):
+        """Function to add the rows extracted from a line of a TSV file to a batch of values"""
+        tsv = TSV(line.strip('\n'), headers)
+        identifiers = tsv.get()
+        names = tsv.get_names()
+        if not identifiers: return values
+        return self.add_values(identifiers, names, values)
+
+    def add_viaf_links(self, file_list=None, clean=True):
         """Function to add data from VIAF links table"""
-        file_list = glob.glob('\\'.join((VIAF_TABLE_PATH, VIAF_TABLE_PATTERN)))
+        if file_list is None: file_list = get_file_list(VIAF_TABLE_PATH, VIAF_TABLE_PATTERN)
         for file in file_list:
             queries, values = self.set_queries()
 
@@ -437,157 +1247,179 @@ class IdentityGraphDatabase:
             print('----------------------------------------')
             print(str(datetime.datetime.now()))
 
-            file = open(file, mode='r', encoding='utf-8', errors='replace')
+            file = open_input(file, mode='r')
             record_count = 0
 
-            for filelineno, line in enumerate(file):
-                record_count += 1
-
-                if '@' in line or '|' not in line: continue
-                if '\tISNI|' not in line and '\tLC|' not in line: continue
-                viaf, other = line.strip().split('\t')
-                viaf = clean_identifier(viaf.replace('http://viaf.org/viaf/', ''), type='viaf')
-                other_type, other = other.split('|')
-                if other_type == 'LC':
-                    other = clean_identifier(other, type='naco')
-                    values['VIAF_equivalences'].append(('viaf:{}'.format(viaf), 'naco:{}'.format(other)))
-                elif other_type == 'ISNI':
-                    other = clean_identifier(other, type='isni')
-                    values['VIAF_equivalences'].append(('viaf:{}'.format(viaf), 'isni:{}'.format(other)))
-                if record_count % 10000 == 0:
-                    print('\r{} records processed'.format(str(record_count)), end='\r')
-                    for v in queries:
-                        values[v] = self.execute_all(queries[v], values[v])
-                del viaf, other, other_type
+            self.metrics.lap()
+            for lines in chunks(file):
+                record_count += len(lines)
+                self.metrics.lap('parse')
+                for line in lines: values = self.add_viaf_link(line, values)
+                self.metrics.lap('extract')
+                self.metrics.progress(record_count)
+                if self.batch.full(values): values = self.flush(queries, values)
             file.close()
-            print('\r{} records processed'.format(str(record_count)), end='\r')
-            for v in queries:
-                self.execute_all(queries[v], values[v])
-            self.clean()
+            self.metrics.progress(record_count, final=True)
+            self.metrics.count('parse', records=record_count, bytes=os.path.getsize(file.name))
+            self.flush(queries, values)
+            if clean: self.clean()
+
+    def add_viaf_link(self, line, values):
+        """Function to add the row extracted from a line of the VIAF links table to a batch of values"""
+        if '@' in line or '|' not in line: return values
+        if '\tISNI|' not in line and '\tLC|' not in line: return values
+        viaf, other = line.strip().split('\t')
+        viaf = clean_identifier(viaf, type='viaf')
+        if not viaf: return values
+        other_type, other = other.split('|', 1)
+        if other_type == 'LC':
+            other = clean_identifier(other, type='naco')
+            if other: values['VIAF_equivalences'].append(('viaf:{}'.format(viaf), 'naco:{}'.format(other)))
+        elif other_type == 'ISNI':
+            other = clean_identifier(other, type='isni')
+            if other: values['VIAF_equivalences'].append(('viaf:{}'.format(viaf), 'isni:{}'.format(other)))
+        return values
 
-    def add_isbns(self):
+    def add_isbns(self, file_list=None, clean=True):
         """Function to add ISBN equivalences"""
-        file_list = glob.glob('\\'.join((ISBN_FILE_PATH, ISBN_FILE_PATTERN)))
+        if file_list is None: file_list = get_file_list(ISBN_FILE_PATH, ISBN_FILE_PATTERN)
         for file in file_list:
 
             print('\n\nParsing ISBN equivalences from file {} ...'.format(str(file)))
             print('----------------------------------------')
             print(str(datetime.datetime.now()))
 
-            query = 'INSERT OR IGNORE INTO isbn_equivalents (isbna, isbnb) VALUES (?, ?);'
-            values = []
+            queries = {'isbn_equivalents': 'INSERT OR IGNORE INTO isbn_equivalents (isbna, isbnb) VALUES (?, ?);'}
+            values = {'isbn_equivalents': []}
 
-            file = open(file, mode='r', encoding='utf-8', errors='replace')
+            file = open_input(file, mode='r')
             record_count = 0
 
-            for filelineno, line in enumerate(file):
-                record_count += 1
-                _, isbna, _, isbnb, _ = line.split('\'')
-                values.append((isbna, isbnb))
-                values.append((isbnb, isbna))
-                values.append((isbna, isbna))
-                values.append((isbnb, isbnb))
-                if record_count % 1000 == 0:
-                    print('\r{} records processed'.format(str(record_count)), end='\r')
-                    self.execute_all(query, values)
+            self.metrics.lap()
+            for lines in chunks(file):
+                record_count += len(lines)
+                self.metrics.lap('parse')
+                for line in lines: values = self.add_isbn_equivalence(line, values)
+                self.metrics.lap('extract')
+                self.metrics.progress(record_count)
+                if self.batch.full(values): values = self.flush(queries, values)
             file.close()
-            print('\r{} records processed'.format(str(record_count)), end='\r')
-            self.execute_all(query, values)
-            self.clean()
+            self.metrics.progress(record_count, final=True)
+            self.metrics.count('parse', records=record_count, bytes=os.path.getsize(file.name))
+            self.flush(queries, values)
+            if clean: self.clean()
+
+    def add_isbn_equivalence(self, line, values):
+        """Function to add the rows extracted from a line of a list of ISBN equivalences to a batch of values"""
+        _, isbna, _, isbnb, _ = line.split('\'')
+        values['isbn_equivalents'].extend([(isbna, isbnb), (isbnb, isbna), (isbna, isbna), (isbnb, isbnb)])
+        return values
 
-    def find_name_matches(self):
-        """Function to find matching names"""
-        file_list = glob.glob('\\'.join((TSV_FILE_PATH, TSV_FILE_PATTERN)))
-        for file in file_list:
+    def find_name_matches(self, file_list=None, isbn_filter_path=ISBN_FILTER_FILE):
+        """Function to find matching names
+
+        The rows of all the TSV files are loaded into ttable, tagged with the index of their file, so that
+        the names are matched in a single query; the results are written to the name lists of each file in turn"""
+        # fuzzywuzzy is slow to import, and only needed here
+        from fuzzywuzzy import fuzz
+        if file_list is None: file_list = get_file_list(TSV_FILE_PATH, TSV_FILE_PATTERN)
+        self.metrics.lap()
+        self.build_isbn_filter(isbn_filter_path)
+        self.metrics.lap('match')
+        # Rows are only added to ttable if their ISBN can match
+        isbn_filter = ISBNFilter(isbn_filter_path)
+        self.create_temp_table()
+        queries = {'ttable': 'INSERT INTO ttable (source, string, isbn, identifier) VALUES (?, ?, ?, ?);'}
+        filenames = []
+        for source, file in enumerate(file_list):
 
             print('\nSearching file {} for name matches ...'.format(str(file)))
             print('----------------------------------------')
             print(str(datetime.datetime.now()))
 
-            self.create_temp_table()
-            query = 'INSERT INTO ttable (string, isbn, identifier) VALUES (?, ?, ?);'
-            values = []
-
-            filename, _ = os.path.splitext(os.path.basename(file))
-            file = open(file, mode='r', encoding='utf-8', errors='replace')
+            values = {'ttable': []}
+            filenames.append(os.path.splitext(os.path.basename(uncompressed_name(file)))[0])
+            file = open_input(file, mode='r')
             headers = list(enumerate(file.readline().split('\t')))
             record_count = 0
 
-            for filelineno, line in enumerate(file):
-                record_count += 1
-
-                tsv = TSV(line.strip('\n'), headers)
-                names = tsv.get_names()
-                isbns = tsv.get_isbns()
-                proprietary = tsv.get_proprietary()
-                if names and isbns:
-                    for name in names:
-                        for isbn in isbns:
-                            values.append((name, isbn, proprietary))
-
-                if record_count % 100 == 0:
-                    print('\r{} records processed'.format(str(record_count)), end='\r')
-                    values = self.execute_all(query, values)
-
-            self.execute_all(query, values)
-
-            print('\nSearching for name matches ...')
-
-            file_accept = open('{}_name_list_accepted.txt'.format(filename), 'w', encoding='utf-8', errors='replace')
-            file_reject = open('{}_name_list_rejected.txt'.format(filename), 'w', encoding='utf-8', errors='replace')
-            for f in [file_accept, file_reject]:
-                f.write('Name\tOriginal ISBN\tEquivalent ISBN\tProprietary identifier\tVIAF\tISNI\tNACO\tOther identifiers\tVariant name forms\n')
-                # f.write('Name\tISBN\tProprietary identifier\tVIAF\tISNI\tNACO\tOther identifiers\tVariant name forms\n')
-
-            '''
-            self.cursor.execute("""SELECT ttable.string, ttable.isbn, ttable.identifier, VIAF_isbn.VIAF, GROUP_CONCAT(VIAF_equivalences.identifier, '|'), GROUP_CONCAT(VIAF_string.string, '|')
-            FROM ttable 
-            INNER JOIN VIAF_isbn on ttable.isbn = VIAF_isbn.isbn
-            INNER JOIN VIAF_equivalences on VIAF_isbn.VIAF = VIAF_equivalences.VIAF
-            INNER JOIN VIAF_string on VIAF_isbn.VIAF = VIAF_string.VIAF
-            GROUP BY VIAF_equivalences.VIAF
-            ORDER BY ttable.string ASC, ttable.isbn ASC ;""")
-            '''
-
-            self.cursor.execute("""SELECT ttable.string, ttable.isbn, isbn_equivalents.isbnb, ttable.identifier, VIAF_isbn.VIAF, GROUP_CONCAT(VIAF_equivalences.identifier, '|'), GROUP_CONCAT(VIAF_string.string, '|')
-            FROM ttable 
-            INNER JOIN isbn_equivalents on ttable.isbn = isbn_equivalents.isbna 
-            INNER JOIN VIAF_isbn on isbn_equivalents.isbnb = VIAF_isbn.isbn
-            INNER JOIN VIAF_equivalences on VIAF_isbn.VIAF = VIAF_equivalences.VIAF
-            INNER JOIN VIAF_string on VIAF_isbn.VIAF = VIAF_string.VIAF
-            GROUP BY VIAF_equivalences.VIAF
-            ORDER BY ttable.string ASC, ttable.isbn ASC ;""")
-
+            self.metrics.lap()
+            for lines in chunks(file):
+                record_count += len(lines)
+                self.metrics.lap('parse')
+
+                for line in lines:
+                    tsv = TSV(line.strip('\n'), headers)
+                    names = tsv.get_names()
+                    isbns = tsv.get_isbns()
+                    proprietary = tsv.get_proprietary()
+                    if names and isbns:
+                        for name in names:
+                            for isbn in isbns:
+                                values['ttable'].append((source, name, isbn, proprietary))
+                self.metrics.lap('extract')
+                self.metrics.progress(record_count)
 
+                if self.batch.full(values): values = self.flush(queries, self.filter_isbns(isbn_filter, values))
 
-            record_count = 0
-            try:
-                row = list(self.cursor.fetchone())
-            except:
-                row = None
-            while row:
-                record_count += 1
-                if record_count % 100 == 0:
-                    print('\r{} records processed'.format(str(record_count)), end='\r')
-                # string_name, isbn, identifier, viaf, other, string_name_list = row[0], row[1], row[2], row[3], row[4], row[5]
-                string_name, isbn, isbnb, identifier, viaf, other, string_name_list = row[0], row[1], row[2], row[3], row[4], row[5], row[6]
-                isni = '|'.join(sorted(set(o for o in other.split('|') if o.startswith('isni:'))))
-                naco = '|'.join(sorted(set(o for o in other.split('|') if o.startswith('naco:'))))
-                other = '|'.join(sorted(set(o for o in other.split('|') if not(o.startswith('naco:') or o.startswith('isni:')))))
-                string_name_list = '|'.join(sorted(set(string_name_list.split('|'))))
-                score = max(fuzz.token_set_ratio(string_name, s) for s in string_name_list.split('|'))
-                f = file_accept if score >= 80 else file_reject
-                # f.write('{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(string_name, isbn, identifier, viaf, isni, naco, other, string_name_list))
-                f.write('{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(string_name, isbn, isbnb, identifier, viaf, isni, naco, other, string_name_list))
-                try: row = list(self.cursor.fetchone())
-                except: break
-            for f in [file_accept, file_reject]:
-                f.close()
-
+            self.flush(queries, self.filter_isbns(isbn_filter, values))
+            self.metrics.progress(record_count, final=True)
+            self.metrics.count('parse', records=record_count, bytes=os.path.getsize(file.name))
             file.close()
+        isbn_filter.close()
+
+        print('\nSearching for name matches ...')
+        self.metrics.lap()
+        self.cursor.execute('CREATE INDEX {}.IDX_ttable_isbn ON ttable (isbn, source) ;'.format(MEMORY_DATABASE))
+
+        # Matches are read in order of source file and VIAF cluster, joined to the identifiers and names of the cluster,
+        # and grouped as they stream in; the first match (by name and ISBN) of each cluster is written
+        self.cursor.execute("""SELECT ttable.source, VIAF_isbn.VIAF, ttable.string, ttable.isbn, isbn_equivalents.isbnb, ttable.identifier,
+        VIAF_equivalences.identifier, names.string
+        FROM ttable 
+        INNER JOIN isbn_equivalents on ttable.isbn = isbn_equivalents.isbna 
+        INNER JOIN VIAF_isbn on isbn_equivalents.isbnb = VIAF_isbn.isbn
+        INNER JOIN VIAF_equivalences on VIAF_isbn.VIAF = VIAF_equivalences.VIAF
+        INNER JOIN VIAF_string on VIAF_isbn.VIAF = VIAF_string.VIAF
+        INNER JOIN names on VIAF_string.name_id = names.id
+        ORDER BY ttable.source ASC, VIAF_isbn.VIAF ASC, ttable.string ASC, ttable.isbn ASC ;""")
+
+        files = [open_name_lists(filename) for filename in filenames]
+        record_count = 0
+        for (source, viaf), rows in groupby(self.cursor, key=lambda row: row[:2]):
+            row = next(rows)
+            string_name, isbn, isbnb, identifier = row[2:6]
+            other, string_names = {row[6]}, {row[7]}
+            for row in rows:
+                other.add(row[6])
+                string_names.add(row[7])
+            record_count += 1
+            self.metrics.progress(record_count)
+            isni = '|'.join(sorted(o for o in other if o.startswith('isni:')))
+            naco = '|'.join(sorted(o for o in other if o.startswith('naco:')))
+            other = '|'.join(sorted(o for o in other if not(o.startswith('naco:') or o.startswith('isni:'))))
+            score = max(fuzz.token_set_ratio(string_name, s) for s in string_names)
+            f = files[source][0] if score >= 80 else files[source][1]
+            f.write('{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(string_name, isbn, isbnb, identifier, viaf, isni, naco, other, '|'.join(sorted(string_names))))
+        for f in [f for pair in files for f in pair]:
+            f.close()
+        self.metrics.progress(record_count, final=True)
+        self.metrics.lap('match')
+        self.metrics.count('match', records=record_count)
+        self.drop_temp_table()
+
+    def filter_isbns(self, isbn_filter, values):
+        """Function to remove the rows of ttable whose ISBN is not in the ISBN filter"""
+        rows = len(values['ttable'])
+        values['ttable'] = isbn_filter.filter(values['ttable'], column=2)
+        self.metrics.increment('rows pruned by ISBN filter', rows - len(values['ttable']))
+        self.metrics.lap('filter')
+        return values
+
+    def write_naco_isni_equivalents(self, connection=None):
+        """Function to write a list of NACO and ISNI equivalent identifiers
 
-    def write_naco_isni_equivalents(self):
-        """Function to write a list of NACO and ISNI equivalent identifiers"""
+        If a connection is given, it is used instead of the main connection (e.g. to write reports in parallel)"""
         print('\nWriting NACO and ISNI equivalents ...')
         print('----------------------------------------')
         print(str(datetime.datetime.now()))
@@ -595,77 +1427,271 @@ class IdentityGraphDatabase:
         file = open('naco_isni_equivalents.txt', 'w', encoding='utf-8', errors='replace')
         file.write('NACO ID\tISNI\n')
         record_count = 0
+        cursor = self.new_cursor(connection) if connection else self.cursor
+        if connection is None: self.metrics.lap()
 
-        for query in ["""SELECT other_equivalences.other, GROUP_CONCAT(other_equivalences.identifier, ';')
+        # Rows are read in order of NACO identifier (using its index), and the ISNIs of each are joined as they stream in
+        for query in ["""SELECT other_equivalences.other, other_equivalences.identifier
         FROM other_equivalences 
         WHERE other_equivalences.other LIKE 'naco%' AND other_equivalences.identifier LIKE 'isni%' 
-        GROUP BY other_equivalences.other 
         ORDER BY other_equivalences.other ASC;""",
-                      """SELECT t1.identifier, GROUP_CONCAT(t2.identifier, ';')
+                      """SELECT t1.identifier, t2.identifier
         FROM VIAF_equivalences as t1
         INNER JOIN VIAF_equivalences as t2
         ON t1.VIAF = t2.VIAF
         WHERE t1.identifier LIKE 'naco%' AND t2.identifier LIKE 'isni%' 
-        GROUP BY t1.identifier 
         ORDER BY t1.identifier ASC;"""]:
-            self.cursor.execute(query)
-            try: row = list(self.cursor.fetchone())
-            except: row = None
-            while row:
+            cursor.execute(query)
+            for naco, rows in groupby(cursor, key=lambda row: row[0]):
                 record_count += 1
-                if record_count % 100 == 0:
-                    print('\r{} records processed'.format(str(record_count)), end='\r')
-                naco, isni = row[0], row[1]
-                file.write('{}\t{}\n'.format(naco, isni))
-                try: row = list(self.cursor.fetchone())
-                except: break
-            print('\r{} records processed'.format(str(record_count)), end='\r')
+                if connection is None: self.metrics.progress(record_count)
+                file.write('{}\t{}\n'.format(naco, ';'.join(row[1] for row in rows)))
+            if connection is None: self.metrics.progress(record_count, final=True)
 
         file.close()
+        if connection is None:
+            self.metrics.lap('report')
+            self.metrics.count('report', records=record_count)
         gc.collect()
         print('{} NACO and ISNI equivalents found'.format(str(record_count)))
         return record_count
 
-    def write_proprietary_identifiers(self):
+    def write_proprietary_identifiers(self, connection=None):
+        """Function to write lists of the VIAF clusters and equivalent identifiers of proprietary identifiers
+
+        If a connection is given, it is used instead of the main connection (e.g. to write reports in parallel)"""
         print('\nReporting proprietary identifiers ...')
         print('----------------------------------------')
         print(str(datetime.datetime.now()))
 
+        cursor = self.new_cursor(connection) if connection else self.cursor
+        if connection is None: self.metrics.lap()
         files = {}
         for identifier_type in ['HarperCollins', 'Penguin', 'RandomHouse']:
             files[identifier_type] = open('{}_identifiers.txt'.format(identifier_type), 'w', encoding='utf-8', errors='replace')
             files[identifier_type].write('{} identifier\tVIAF\tISNI\tNACO\tOther identifiers\tNACO authorised name\n'.format(identifier_type))
 
-        self.cursor.execute("""SELECT t1.identifier, GROUP_CONCAT(t2.VIAF, ';'), GROUP_CONCAT(t2.identifier, ';'), GROUP_CONCAT(NACO_authorised.string, ';')
+        # Rows are read in order of proprietary identifier (using its index), and aggregated as they stream in
+        cursor.execute("""SELECT t1.identifier, t2.VIAF, t2.identifier, names.string
         FROM VIAF_equivalences AS t1 
         INNER JOIN VIAF_equivalences AS t2 ON t1.VIAF = t2.VIAF 
         LEFT JOIN NACO_authorised ON NACO_authorised.NACO = SUBSTR(t2.identifier,6) 
+        LEFT JOIN names ON NACO_authorised.name_id = names.id 
         WHERE t1.identifier NOT LIKE 'naco%' AND  t1.identifier NOT LIKE 'isni%' AND t1.identifier NOT LIKE t2.identifier 
-        GROUP BY t1.identifier 
         ORDER BY t1.identifier ASC ;""")
 
         record_count = 0
-        try: row = list(self.cursor.fetchone())
-        except: row = None
-        while row:
+        for identifier, rows in groupby(cursor, key=lambda row: row[0]):
             record_count += 1
-            if record_count % 100 == 0:
-                print('\r{} records processed'.format(str(record_count)), end='\r')
-            identifier, viaf, equivalent, string = row[0], row[1], row[2], row[3]
-            viaf = ';'.join(sorted(set(viaf.split(';'))))
-            isni, naco, other = set(), set(), set()
-            for e in equivalent.split(';'):
+            if connection is None: self.metrics.progress(record_count)
+            identifier_type = 'HarperCollins' if  identifier.startswith('harpercollins:') else 'Penguin' if  identifier.startswith('penguin:') else 'RandomHouse' if  identifier.startswith('randomhouse:') else None
+            if not identifier_type: continue
+            viaf, isni, naco, other, strings = set(), set(), set(), set(), []
+            for _, v, e, string in rows:
+                viaf.add(v)
                 if e.startswith('isni:'): isni.add(e)
                 elif e.startswith('naco:'): naco.add(e)
                 else: other.add(e)
-            identifier_type = 'HarperCollins' if  identifier.startswith('harpercollins:') else 'Penguin' if  identifier.startswith('penguin:') else 'RandomHouse' if  identifier.startswith('randomhouse:') else None
-            if identifier_type:
-                files[identifier_type].write('{}\t{}\t{}\t{}\t{}\t{}\n'.format(identifier, viaf, ';'.join(sorted(isni)), ';'.join(sorted(naco)), ';'.join(sorted(other)), string))
-            try: row = list(self.cursor.fetchone())
-            except: break
+                if string is not None: strings.append(string)
+            files[identifier_type].write('{}\t{}\t{}\t{}\t{}\t{}\n'.format(identifier, ';'.join(sorted(viaf)), ';'.join(sorted(isni)), ';'.join(sorted(naco)), ';'.join(sorted(other)), ';'.join(strings) if strings else None))
 
         for identifier_type in files:
             files[identifier_type].close()
+        if connection is None:
+            self.metrics.progress(record_count, final=True)
+            self.metrics.lap('report')
+            self.metrics.count('report', records=record_count)
+        return record_count
+
+
+class IngestEstimator:
+    """Class to estimate the time taken to add data from input files, and the rows and database size it adds
+
+    Records are sampled from places spread evenly through each file (by byte offset), and passed through the
+    functions used to add data, using a scratch database; totals are projected from the size of the files,
+    with confidence bounds from the variation between the samples.
+    Compressed files cannot be read from an offset, so they are decompressed from the start, skipping the data
+    between the places sampled, and read to the end; samples and totals are measured in decompressed bytes"""
+
+    def __init__(self, option):
+        self.option = option
+        self.description, self.path, self.pattern, self.record_type = ESTIMATE_INPUTS[option]
+        self.scratch = tempfile.mkdtemp(prefix='identities_estimate_')
+        with redirect_stdout(io.StringIO()):
+            self.db = IdentityGraphDatabase(os.path.join(self.scratch, 'estimate.db'), profile='bulk-ingest')
+        self.samples, self.files, self.total_bytes, self.data_bytes = [], 0, 0, 0
+
+    def close(self):
+        with redirect_stdout(io.StringIO()):
+            self.db.close()
+        shutil.rmtree(self.scratch, ignore_errors=True)
+
+    def sample_files(self, file_list=None):
+        """Function to sample the records in all the input files"""
+        if file_list is None: file_list = get_file_list(self.path, self.pattern)
+        for filename in file_list:
+            print('Sampling {} ...'.format(str(filename)))
+            self.sample_file(filename)
+
+    def sample_file(self, filename):
+        size = os.path.getsize(filename)
+        extension = os.path.splitext(filename)[1].lower()
+        compressed = extension in INPUT_EXTENSIONS
+        raw = open(filename, mode='rb')
+        file = decompress(raw, extension) if compressed else raw
+        headers = None
+        if self.record_type == 'tsv':
+            headers = list(enumerate(file.readline().decode('utf-8', errors='replace').split('\t')))
+        start = raw.tell()
+        offsets = [max(start, size * i // ESTIMATE_SAMPLES) for i in range(ESTIMATE_SAMPLES)] + [size]
+        for i in range(ESTIMATE_SAMPLES):
+            if offsets[i] >= offsets[i + 1]: continue
+            if compressed:
+                # The position in the compressed file is only known to within a block read by the decompressor,
+                # which is enough to choose the place sampled; sizes are measured in decompressed bytes
+                if raw.tell() >= offsets[i + 1]: continue
+                while raw.tell() < offsets[i] and file.read(io.DEFAULT_BUFFER_SIZE): pass
+            else: raw.seek(offsets[i])
+            # Skip to the start of the next record
+            if raw.tell() > start: self.skip_partial_record(file, compressed)
+            position = file.tell()
+            sample = self.sample_records(file, headers, limit=None if compressed else offsets[i + 1])
+            if not sample['records']: break
+            sample['bytes'] = file.tell() - position
+            self.samples.append(sample)
+        if compressed:
+            while file.read(INPUT_BLOCK_SIZE): pass
+            self.data_bytes += file.tell()
+            file.close()
+        else: self.data_bytes += size
+        raw.close()
+        self.files += 1
+        self.total_bytes += size
+
+    def skip_partial_record(self, file, compressed=False):
+        if self.record_type not in ['VIAF', 'NACO']:
+            file.readline()
+            return
+        # MARC records end with a record terminator; decompressed streams cannot seek back cheaply
+        if compressed:
+            while file.read(1) not in [b'', b'\x1d']: pass
+            return
+        while True:
+            position = file.tell()
+            block = file.read(INPUT_BLOCK_SIZE)
+            if not block: return
+            i = block.find(b'\x1d')
+            if i >= 0:
+                file.seek(position + i + 1)
+                return
+
+    def sample_records(self, file, headers=None, limit=None):
+        """Function to read, extract and write a sample of consecutive records, timing each stage"""
+        queries, values = self.db.set_queries()
+        self.db.cursor.execute('SELECT COUNT(*) FROM {} ;'.format(NAMES_TABLE))
+        names = self.db.cursor.fetchone()[0]
+        reader = MARCReader(file) if self.record_type in ['VIAF', 'NACO'] else None
+        record_count = 0
+        start = time.perf_counter()
+        while record_count < ESTIMATE_SAMPLE_RECORDS and (limit is None or file.tell() < limit):
+            if reader:
+                record = next(reader, None)
+                if record is None: break
+                values = self.db.add_marc_record(record, self.record_type, values)
+            else:
+                line = file.readline()
+                if not line: break
+                line = line.decode('utf-8', errors='replace')
+                if self.record_type == 'link': values = self.db.add_viaf_link(line, values)
+                elif self.record_type == 'tsv': values = self.db.add_tsv_line(line, headers, values)
+                else: values = self.db.add_isbn_equivalence(line, values)
+            record_count += 1
+        seconds = time.perf_counter() - start
+        sample = {'records': record_count, 'seconds': seconds, 'rows': {}, 'sizes': {}}
+        for table in GRAPH_TABLES:
+            rows = len(values[table])
+            row_bytes = sum(len(str(x)) for row in values[table] for x in row if x is not None)
+            sample['rows'][table] = rows
+            # The table, its unique index on both columns, and the indexes on each column (see build_index)
+            sample['sizes'][table] = (row_bytes + rows * ESTIMATE_ROW_OVERHEAD) / ESTIMATE_PAGE_FILL
+            sample['sizes']['{} indexes'.format(table)] = (2 * row_bytes + 3 * rows * ESTIMATE_INDEX_OVERHEAD) / ESTIMATE_PAGE_FILL
+        start = time.perf_counter()
+        for v in queries:
+            if values[v]: self.db.cursor.executemany(queries[v], values[v])
+        self.db.conn.commit()
+        sample['write_seconds'] = time.perf_counter() - start
+        self.db.cursor.execute('SELECT COUNT(*), TOTAL(LENGTH(CAST(string AS BLOB))) FROM {} WHERE id > ? ;'.format(NAMES_TABLE), (names,))
+        rows, row_bytes = self.db.cursor.fetchone()
+        sample['rows'][NAMES_TABLE] = rows
+        sample['sizes'][NAMES_TABLE] = (row_bytes + rows * (ESTIMATE_ROW_OVERHEAD + 8)) / ESTIMATE_PAGE_FILL
+        sample['sizes']['{} indexes'.format(NAMES_TABLE)] = rows * (8 + ESTIMATE_INDEX_OVERHEAD) / ESTIMATE_PAGE_FILL
+        return sample
+
+    def project(self, quantity):
+        """Function to project a quantity measured in each sample to all the input files,
+        returning the estimate and its lower and upper confidence bounds"""
+        quantities = [quantity(sample) for sample in self.samples]
+        sizes = [sample['bytes'] for sample in self.samples]
+        return ratio_estimate(quantities, sizes, self.data_bytes)
+
+    def estimate(self):
+        """Function to get the projected totals, as a dictionary which can be serialised as JSON"""
+        estimate = {
+            'option': self.option,
+            'input': self.description,
+            'files': self.files,
+            'bytes': self.total_bytes,
+            'data_bytes': self.data_bytes,
+            'samples': len(self.samples),
+            'sampled_records': sum(sample['records'] for sample in self.samples),
+            'sampled_bytes': sum(sample['bytes'] for sample in self.samples),
+            'records': self.project(lambda sample: sample['records']),
+            'seconds': self.project(lambda sample: sample['seconds'] + sample['write_seconds']),
+            'rows': OrderedDict(),
+            'sizes': OrderedDict(),
+        }
+        for table in list(GRAPH_TABLES) + [NAMES_TABLE]:
+            estimate['rows'][table] = self.project(lambda sample: sample['rows'][table])
+            for name in [table, '{} indexes'.format(table)]:
+                estimate['sizes'][name] = self.project(lambda sample: sample['sizes'][name])
+        estimate['database_bytes'] = os.path.getsize(DATABASE_PATH) if os.path.isfile(DATABASE_PATH) else 0
+        estimate['added_bytes'] = [sum(size[i] for size in estimate['sizes'].values()) for i in range(3)]
+        estimate['free_bytes'] = shutil.disk_usage(os.path.dirname(os.path.abspath(DATABASE_PATH))).free
+        return estimate
+
+    def report(self, estimate=None, path=ESTIMATE_FILE_PATH):
+        """Function to display an estimate, and append it to a file of JSON lines"""
+        estimate = estimate or self.estimate()
+        print('\nEstimate for adding {} ({} files, {})'.format(
+            estimate['input'], str(estimate['files']), format_bytes(estimate['bytes'])))
+        print('----------------------------------------')
+        if estimate['data_bytes'] != estimate['bytes']:
+            print('Decompressed size {}; sizes of samples are given decompressed'.format(format_bytes(estimate['data_bytes'])))
+        print('Sampled {} records ({}) from {} places'.format(
+            str(estimate['sampled_records']), format_bytes(estimate['sampled_bytes']), str(estimate['samples'])))
+        print('Estimates are given with 95% confidence bounds in brackets\n')
+        print('{:<32}{}'.format('Records', format_estimate(estimate['records'])))
+        print('{:<32}{}'.format('Time to add (hh:mm:ss)', format_estimate(estimate['seconds'], format_seconds)))
+        records, seconds = estimate['records'][0], estimate['seconds'][0]
+        if seconds: print('{:<32}{:,.0f}'.format('Records per second', records / seconds))
+        print('\n{:<32}{:>40}{:>40}'.format('Table', 'Rows', 'Size (table, then indexes)'))
+        for table in estimate['rows']:
+            if not estimate['rows'][table][2]: continue
+            print('{:<32}{:>40}{:>40}'.format(table, format_estimate(estimate['rows'][table]),
+                                              format_estimate(estimate['sizes'][table], format_bytes)))
+            print('{:<32}{:>40}{:>40}'.format('', '', format_estimate(estimate['sizes']['{} indexes'.format(table)], format_bytes)))
+        print('\n{:<32}{}'.format('Current database size', format_bytes(estimate['database_bytes'])))
+        print('{:<32}{}'.format('Database size added', format_estimate(estimate['added_bytes'], format_bytes)))
+        print('{:<32}{}'.format('Free disk space', format_bytes(estimate['free_bytes'])))
+        print('\nRows which are already in the database, and names which are repeated, are only stored once, '
+              'so the rows and sizes are upper bounds.\nTimes are measured on an empty database, '
+              'and do not include cleaning or vacuuming, which needs free space of up to the size of the database.')
+        # Vacuuming makes a copy of the database
+        if estimate['added_bytes'][2] + estimate['database_bytes'] > estimate['free_bytes']:
+            print('\nWarning: the disk may not have enough free space')
+        with open(path, mode='a', encoding='utf-8') as file:
+            file.write(json.dumps(estimate) + '\n')
+        return estimate
 
 
 # ====================
@@ -673,53 +1699,161 @@ class IdentityGraphDatabase:
 # ====================
 
 
+def get_database(path=DATABASE_PATH, profile='report'):
+    """Function to get a connection to the database which is shared between actions, opening it if necessary,
+    with the storage profile for an action"""
+    global SHARED_DATABASE
+    if SHARED_DATABASE is not None and SHARED_DATABASE.path != path: close_database()
+    if SHARED_DATABASE is None: SHARED_DATABASE = IdentityGraphDatabase(path, profile=profile, sample=PROFILE)
+    else: SHARED_DATABASE.set_storage_profile(profile)
+    return SHARED_DATABASE
+
+
+def close_database() -> None:
+    """Function to close the shared connection to the database, if it is open"""
+    global SHARED_DATABASE
+    if SHARED_DATABASE is not None: SHARED_DATABASE.close()
+    SHARED_DATABASE = None
+
+
+@contextmanager
+def sample_action():
+    """Function to sample the stack of the shared database (if --profile is set) only while an action runs,
+    and not while the menu waits for the next option"""
+    if SHARED_DATABASE is not None and SHARED_DATABASE.sampler: SHARED_DATABASE.sampler.resume()
+    try: yield
+    finally:
+        if SHARED_DATABASE is not None and SHARED_DATABASE.sampler: SHARED_DATABASE.sampler.pause()
+
+
+def estimate_ingest(option, file_list=None):
+    """Function to estimate the effect of adding data with an ingest option (e.g. 'V'), without adding it"""
+    date_time_message('Estimating the effect of adding {}'.format(ESTIMATE_INPUTS[option][0]))
+    estimator = IngestEstimator(option)
+    try:
+        estimator.sample_files(file_list)
+        return estimator.report()
+    finally: estimator.close()
+
+
 def parse_marc(record_type='BNB') -> None:
-    db = IdentityGraphDatabase()
+    if ESTIMATE:
+        estimate_ingest('N' if record_type == 'NACO' else 'V')
+        return
+    db = get_database(profile='bulk-ingest')
     db.add_marc(record_type=record_type)
     db.dump_database()
-    db.close()
 
 
 def parse_tsv() -> None:
-    db = IdentityGraphDatabase()
+    if ESTIMATE:
+        estimate_ingest('T')
+        return
+    db = get_database(profile='bulk-ingest')
     db.add_tsv()
     db.dump_database()
-    db.close()
 
 
 def parse_viaf() -> None:
-    db = IdentityGraphDatabase()
+    if ESTIMATE:
+        estimate_ingest('L')
+        return
+    db = get_database(profile='bulk-ingest')
     db.add_viaf_links()
     db.dump_database()
-    db.close()
 
 
 def parse_isbns() -> None:
-    db = IdentityGraphDatabase()
+    if ESTIMATE:
+        estimate_ingest('Q')
+        return
+    db = get_database(profile='bulk-ingest')
     db.add_isbns()
     db.dump_database()
-    db.close()
 
 
 def find_name_matches() -> None:
-    db = IdentityGraphDatabase()
+    db = get_database()
     db.find_name_matches()
-    db.close()
 
 
 def index() -> None:
-    db = IdentityGraphDatabase()
+    db = get_database()
     db.build_indexes()
-    db.close()
 
 
 def export_graph() -> None:
-    db = IdentityGraphDatabase()
+    db = get_database()
     db.clean()
-    db.dump_database()
-    db.write_naco_isni_equivalents()
-    db.write_proprietary_identifiers()
-    db.close()
+    db.dump_database(reports=True)
+    db.clear_change_log()
+
+
+def export_changes() -> None:
+    db = get_database()
+    db.clean(vacuum=False)
+    db.dump_database_changes()
+
+
+def export_csr() -> None:
+    db = get_database()
+    db.export_csr()
+
+
+def export_columnar() -> None:
+    db = get_database()
+    db.export_columnar()
+
+
+def extract_subset() -> None:
+    identifiers = get_tsv_identifiers()
+    for record_type, path, pattern in [('VIAF', VIAF_FILE_PATH, VIAF_FILE_PATTERN), ('NACO', NACO_FILE_PATH, NACO_FILE_PATTERN)]:
+        for file in get_file_list(path, pattern):
+            extract_marc_subset(file, identifiers, record_type=record_type)
+
+
+def run_pipeline(stages) -> None:
+    """Function to run a list of stages (e.g. ['L', 'V', 'N', 'Q', 'I', 'X']) in order, sharing one connection
+
+    Cleaning (including vacuuming) is deferred until a stage needs the data to have been cleaned,
+    and the database is dumped once at the end of the pipeline, unless it has already been exported"""
+    for stage in stages:
+        if stage not in PIPELINE_STAGES: raise ValueError('Stage {} cannot be run in a pipeline'.format(stage))
+    if ESTIMATE:
+        # Only the ingest stages are estimated; the other stages would change the database
+        for stage in stages:
+            if stage in PIPELINE_INGEST_STAGES: estimate_ingest(stage)
+        return
+    db = get_database()
+    dirty, dumped = False, True
+    for stage in stages:
+        db.set_storage_profile('bulk-ingest' if stage in PIPELINE_INGEST_STAGES else 'report')
+        if stage in PIPELINE_INGEST_STAGES:
+            if stage == 'L': db.add_viaf_links(clean=False)
+            elif stage == 'V': db.add_marc(record_type='VIAF', clean=False)
+            elif stage == 'N': db.add_marc(record_type='NACO', clean=False)
+            elif stage == 'T': db.add_tsv(clean=False)
+            elif stage == 'Q': db.add_isbns(clean=False)
+            dirty, dumped = True, False
+            continue
+        if stage == 'U':
+            extract_subset()
+            continue
+        if dirty:
+            db.clean()
+            dirty = False
+        if stage == 'I': db.build_indexes()
+        elif stage == 'F': db.find_name_matches()
+        elif stage == 'X':
+            db.dump_database(reports=True)
+            db.clear_change_log()
+            dumped = True
+        elif stage == 'C': db.dump_database_changes()
+        elif stage == 'G': db.export_csr()
+        elif stage == 'A': db.export_columnar()
+    if not dumped:
+        if dirty: db.clean()
+        db.dump_database()
 
 
 # ====================
@@ -736,23 +1870,171 @@ def is_null(var) -> bool:
     return False
 
 
-def clean_identifier(s, type=None):
-    if s is None or not s: return None
-    s = s.strip().rstrip('/').strip()
-    s = re.sub(r'https?:\/\/(www\.)?(isni|viaf)\.org\/(isni|viaf)\/?', '', s).strip()
-    if '/' in s:
-        s = s.rsplit('/')[-1]
-    if type == 'naco':
-        s = re.sub(r'\s+', '', s.lower().strip().replace(' ', ''))
-        if re.search(r'[^0-9nbors]]', s): return None
-        if not s.startswith('n'): return None
-    if type == 'isni':
-        s = s.upper().strip().replace(' ', '').replace('-', '')
-        if re.search(r'[^0-9X]]', s): return None
-    if type == 'viaf':
-        s = re.sub(r'\s*\(Personal\)', '', s).strip()
-        if re.search(r'[^0-9]]', s): return None
-    return s.strip()
+def name_hash(string) -> int:
+    """Function to get a stable 64-bit hash of a name string, used to look up names in the names table"""
+    return int.from_bytes(hashlib.blake2b(string.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+def text_view(table) -> str:
+    """Function to get the name of the table or view in which a graph table's name ids are replaced by name strings"""
+    if NAME_ID in (key for (key, value) in GRAPH_TABLES[table]): return '{}_text'.format(table)
+    return table
+
+
+def text_columns(table) -> list:
+    """Function to get the column names of a graph table, as they appear in its text view and in dumps"""
+    return ['string' if key == NAME_ID else key for (key, value) in GRAPH_TABLES[table]]
+
+
+def storage_settings(profile, path=DATABASE_PATH, connections=1) -> dict:
+    """Function to get the settings of a storage profile, sizing any which are not given from the memory available
+    and the size of the database
+
+    The cache is divided between a number of connections, and (except when adding data) is no larger than the database"""
+    settings = dict(STORAGE_PROFILES[profile])
+    size = os.path.getsize(path) if os.path.isfile(path) else 0
+    budget = int((available_memory() or STORAGE_DEFAULT_MEMORY) * STORAGE_MEMORY_FRACTION)
+    if 'cache_size' in settings and settings['cache_size'] is None:
+        cache = budget if profile == 'bulk-ingest' else min(budget, size)
+        # A negative cache size is in KiB, rather than pages
+        settings['cache_size'] = -(max(cache // connections, STORAGE_MIN_CACHE) // 1024)
+    # SQLite limits the size of the memory map to its own maximum
+    if 'mmap_size' in settings and settings['mmap_size'] is None: settings['mmap_size'] = size
+    if 'temp_store' in settings and settings['temp_store'] is None:
+        settings['temp_store'] = 'MEMORY' if size < budget else 'FILE'
+    return settings
+
+
+def ratio_estimate(quantities, sizes, total) -> list:
+    """Function to project a quantity measured in samples of given sizes to a given total size (the ratio estimator),
+    returning the estimate and its lower and upper confidence bounds"""
+    n, sampled = len(sizes), sum(sizes)
+    if not n or not sampled: return [0, 0, 0]
+    ratio = sum(quantities) / sampled
+    estimate = ratio * total
+    if n < 2: return [estimate, estimate, estimate]
+    variance = sum((q - ratio * b) ** 2 for q, b in zip(quantities, sizes)) / (n - 1) / (n * (sampled / n) ** 2)
+    # The variance is reduced by the fraction of the total which has been sampled, so a file sampled in full is exact
+    variance *= max(0.0, 1 - sampled / total)
+    error = ESTIMATE_Z * total * math.sqrt(variance)
+    return [estimate, max(0, estimate - error), estimate + error]
+
+
+def format_estimate(estimate, formatter=None) -> str:
+    """Function to format an estimate with its confidence bounds"""
+    formatter = formatter or (lambda x: '{:,.0f}'.format(x))
+    return '{} [{} - {}]'.format(*(formatter(x) for x in estimate))
+
+
+def format_bytes(n) -> str:
+    for unit in ['bytes', 'KB', 'MB', 'GB', 'TB']:
+        if abs(n) < 1024 or unit == 'TB': break
+        n /= 1024
+    return '{:,.0f} {}'.format(n, unit) if unit == 'bytes' else '{:,.1f} {}'.format(n, unit)
+
+
+def format_seconds(seconds) -> str:
+    seconds = int(round(seconds))
+    return '{}:{:02d}:{:02d}'.format(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+
+def dump_file_name(table, compression=None) -> str:
+    """Function to get the name of the file into which a table is dumped"""
+    return '{}_DUMP_.tsv{}'.format(table, DUMP_EXTENSIONS[compression])
+
+
+def open_dump_file(filename, compression=None):
+    """Function to open a dump file for writing as text, through a large buffer and optional compression"""
+    if compression not in DUMP_EXTENSIONS:
+        raise ValueError('Compression {} not recognised'.format(compression))
+    if compression == 'gzip':
+        return gzip.open(filename, mode='wt', compresslevel=6, encoding='utf-8', errors='replace', newline='')
+    if compression == 'zstd':
+        try: import zstandard
+        except ImportError: raise ImportError('zstd compression requires the zstandard module')
+        return zstandard.open(filename, mode='wt', encoding='utf-8', errors='replace', newline='')
+    return open(filename, mode='w', buffering=DUMP_BUFFER_SIZE, encoding='utf-8', errors='replace', newline='')
+
+
+def open_name_lists(filename) -> tuple:
+    """Function to open the files of accepted and rejected name matches for a TSV file, and write their headers"""
+    files = (open('{}_name_list_accepted.txt'.format(filename), 'w', encoding='utf-8', errors='replace'),
+             open('{}_name_list_rejected.txt'.format(filename), 'w', encoding='utf-8', errors='replace'))
+    for f in files:
+        f.write('Name\tOriginal ISBN\tEquivalent ISBN\tProprietary identifier\tVIAF\tISNI\tNACO\tOther identifiers\tVariant name forms\n')
+    return files
+
+
+def write_tsv(file, cursor, header=None, progress=True) -> int:
+    """Function to write the rows returned by a cursor to a file as TSV, streaming them in batches"""
+    writer = csv.writer(file, delimiter='\t', lineterminator='\n')
+    if header: writer.writerow(header)
+    record_count = 0
+    rows = cursor.fetchmany(DUMP_BATCH_SIZE)
+    while rows:
+        writer.writerows(rows)
+        record_count += len(rows)
+        if progress:
+            print('\r{} records processed'.format(str(record_count)), end='\r')
+        rows = cursor.fetchmany(DUMP_BATCH_SIZE)
+    return record_count
+
+
+def get_tsv_identifiers(file_list=None) -> set:
+    """Function to get the set of all identifiers (other than name strings) in TSV files, in the form type:value"""
+    if file_list is None: file_list = get_file_list(TSV_FILE_PATH, TSV_FILE_PATTERN)
+    identifiers = set()
+    for file in file_list:
+        print('\nReading identifiers from file {} ...'.format(str(file)))
+        file = open_input(file, mode='r')
+        headers = list(enumerate(file.readline().split('\t')))
+        for line in file:
+            tsv = TSV(line.strip('\n'), headers)
+            for h, values in tsv.get().items():
+                if h == 'string': continue
+                identifiers.update('{}:{}'.format(h, v) for v in values)
+        file.close()
+    print('{} identifiers found'.format(str(len(identifiers))))
+    return identifiers
+
+
+def extract_marc_subset(file_name, identifiers, record_type='VIAF', path=SUBSET_FILE_PATH) -> int:
+    """Function to write the records in a MARC file which contain any of a set of identifiers (in the form type:value)
+    to a file of the same name in the folder path"""
+    print('\n\nExtracting subset of {} file {} ...'.format(record_type, str(file_name)))
+    print('----------------------------------------')
+    print(str(datetime.datetime.now()))
+
+    os.makedirs(path, exist_ok=True)
+    metrics = Metrics()
+    record_count, subset_count = 0, 0
+    reader = MARCReader(open_input(file_name, mode='rb'))
+    writer = MARCWriter(open(os.path.join(path, os.path.basename(uncompressed_name(file_name))), mode='wb'))
+    # Records are decoded to find their identifiers, but written as they were read
+    for marc in iter(reader.read_marc, None):
+        record_count += 1
+        record_identifiers = Record(marc).get_identifiers(record_type=record_type)
+        if any('{}:{}'.format(h, v) in identifiers
+               for h in record_identifiers if h != 'string' for v in record_identifiers[h]):
+            writer.write_marc(marc)
+            subset_count += 1
+        metrics.progress(record_count)
+    reader.close()
+    writer.close()
+    metrics.progress(record_count, final=True)
+    print('{} of {} records extracted'.format(str(subset_count), str(record_count)))
+    return subset_count
+
+
+def write_array(file, values) -> None:
+    """Function to write an array of integers to a file (or file name) in little-endian byte order"""
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    if isinstance(file, str):
+        with open(file, mode='wb') as f:
+            values.tofile(f)
+    else: values.tofile(file)
 
 
 def which(s, l):
@@ -779,7 +2061,7 @@ def date_time_exit():
 def message(s) -> str:
     """Function to convert OPTIONS description to present tense"""
     if s == 'Exit program': return 'Shutting down'
-    return s.replace('Parse', 'Parsing').replace('eXport', 'Exporting').replace('Find', 'Finding').replace('build', 'Building').replace('Index', 'index')
+    return s.replace('Parse', 'Parsing').replace('eXport', 'Exporting').replace('export', 'Exporting').replace('Find', 'Finding').replace('extract', 'Extracting').replace('Serve', 'Serving').replace('build', 'Building').replace('Index', 'index')
 
 
 def exit_prompt(message=None):
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ====================
+#       Set-up
+# ====================
+
+# Import required modules
+from functools import lru_cache
+import re
+
+
+__author__ = 'Victoria Morris'
+__license__ = 'MIT License'
+__version__ = '1.0.0'
+__status__ = '4 - Beta Development'
+
+
+# ====================
+#  Regular expressions
+# ====================
+
+
+RE_IDENTIFIER_URI = re.compile(r'https?://(www\.)?(isni|viaf)\.org/(isni|viaf)/?')
+RE_WHITESPACE = re.compile(r'\s+')
+RE_VIAF_PERSONAL = re.compile(r'\s*\(Personal\)')
+
+# Validators for the normalised form of each type of identifier
+IDENTIFIER_VALIDATORS = {
+    'isni': re.compile(r'[0-9]{15}[0-9X]'),
+    'naco': re.compile(r'n[bors]?[0-9]{8}(?:[0-9]{2})?'),
+    'viaf': re.compile(r'[0-9]{1,22}'),
+}
+
+
+# ====================
+#     Constants
+# ====================
+
+
+IDENTIFIER_CACHE_SIZE = 1 << 18     # Maximum number of normalised identifiers remembered
+
+
+# ====================
+#      Functions
+# ====================
+
+
+@lru_cache(maxsize=IDENTIFIER_CACHE_SIZE)
+def clean_identifier(s, type=None):
+    """Function to normalise an ISNI, VIAF or NACO identifier, given as a bare value or a URI
+
+    Returns None if the identifier is not valid for its type (including ISNIs with the wrong check digit)"""
+    if s is None or not s: return None
+    s = s.strip().rstrip('/').strip()
+    s = RE_IDENTIFIER_URI.sub('', s).strip()
+    if '/' in s:
+        s = s.rsplit('/')[-1]
+    if type == 'naco':
+        s = RE_WHITESPACE.sub('', s.lower())
+    elif type == 'isni':
+        s = RE_WHITESPACE.sub('', s.upper()).replace('-', '')
+    elif type == 'viaf':
+        s = RE_VIAF_PERSONAL.sub('', s).strip()
+    else: return s.strip() or None
+    if not IDENTIFIER_VALIDATORS[type].fullmatch(s): return None
+    if type == 'isni' and isni_check_digit(s[:15]) != s[15]: return None
+    return s
+
+
+def clean_identifiers(values, type=None) -> set:
+    """Function to normalise a batch of identifiers of the same type, leaving out any which are not valid"""
+    identifiers = set()
+    for s in values:
+        s = clean_identifier(s, type=type)
+        if s: identifiers.add(s)
+    return identifiers
+
+
+def isni_check_digit(fifteen_digits) -> str:
+    """Function to get the ISO 7064 Mod 11-2 check digit of the first 15 digits of an ISNI"""
+    total = 0
+    for digit in fifteen_digits:
+        total = (total + int(digit)) * 2
+    check = (12 - total % 11) % 11
+    return 'X' if check == 10 else str(check)
+
+
+def is_isni(s) -> bool:
+    """Function to test whether a string is a valid ISNI of 16 characters, with the correct check digit"""
+    return bool(s) and IDENTIFIER_VALIDATORS['isni'].fullmatch(s) is not None and isni_check_digit(s[:15]) == s[15]
@@ -11,6 +11,7 @@ import os
 import gc
 import glob
 import re
+from identities_tools.identifier_tools import *
 from identities_tools.isbn_tools import *
 
 
@@ -27,6 +28,7 @@ __status__ = '4 - Beta Development'
 LEADER_LENGTH, DIRECTORY_ENTRY_LENGTH = 24, 12
 SUBFIELD_INDICATOR, END_OF_FIELD, END_OF_RECORD = chr(0x1F), chr(0x1E), chr(0x1D)
 ALEPH_CONTROL_FIELDS = ['DB ', 'FMT', 'SYS']
+MARC_WRITER_BUFFER_SIZE = 1 << 20
 
 NODE_TYPES = ['string', 'isbn', 'isni', 'viaf', 'naco', 'harpercollins', 'penguin', 'randomhouse']
 
@@ -80,10 +82,47 @@ class MARCReader(object):
             self.file_handle = None
 
     def __next__(self):
+        marc = self.read_marc()
+        if marc is None: raise StopIteration
+        return Record(marc)
+
+    def read_marc(self):
+        """Function to read the next record as MARC21 data, without decoding it (returns None at the end of the file)"""
         first5 = self.file_handle.read(5)
-        if not first5: raise StopIteration
+        if not first5: return None
         if len(first5) < 5: raise RecordLengthError
-        return Record(first5 + self.file_handle.read(int(first5) - 5))
+        return first5 + self.file_handle.read(int(first5) - 5)
+
+
+class MARCWriter(object):
+    """Class to write records to a file of MARC21 records, buffering them to reduce the number of writes"""
+
+    def __init__(self, marc_target, buffer_size=MARC_WRITER_BUFFER_SIZE):
+        super(MARCWriter, self).__init__()
+        if not (hasattr(marc_target, 'write') and callable(marc_target.write)):
+            raise TypeError('MARCWriter requires a file object opened for writing in binary mode')
+        self.file_handle = marc_target
+        self.buffer_size = buffer_size
+        self.buffer, self.buffered = [], 0
+
+    def write(self, record):
+        self.write_marc(record.as_marc())
+
+    def write_marc(self, data):
+        """Function to write a record which is already MARC21 data (e.g. as read by MARCReader.read_marc)"""
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.buffer_size: self.flush()
+
+    def flush(self):
+        if self.buffer: self.file_handle.write(b''.join(self.buffer))
+        self.buffer, self.buffered = [], 0
+
+    def close(self):
+        if self.file_handle:
+            self.flush()
+            self.file_handle.close()
+            self.file_handle = None
 
 
 class Record(object):
@@ -191,26 +230,25 @@ class Record(object):
         if field_count == 0: raise FieldsError
 
     def as_marc(self):
-        fields, directory = b'', b''
+        # Fields and directory entries are collected in lists and joined once, rather than concatenated
+        fields, directory = [], []
         offset = 0
 
         for field in self.fields:
             field_data = field.as_marc()
-            fields += field_data
-            if field.tag.isdigit():
-                directory += ('%03d' % int(field.tag)).encode('utf-8')
-            else:
-                directory += ('%03s' % field.tag).encode('utf-8')
-            directory += ('%04d%05d' % (len(field_data), offset)).encode('utf-8')
+            fields.append(field_data)
+            tag = '%03d' % int(field.tag) if field.tag.isdigit() else '%03s' % field.tag
+            directory.append('%s%04d%05d' % (tag, len(field_data), offset))
             offset += len(field_data)
 
-        directory += END_OF_FIELD.encode('utf-8')
-        fields += END_OF_RECORD.encode('utf-8')
+        directory.append(END_OF_FIELD)
+        directory = ''.join(directory).encode('utf-8')
+        fields.append(END_OF_RECORD.encode('utf-8'))
         base_address = LEADER_LENGTH + len(directory)
-        record_length = base_address + len(fields)
+        record_length = base_address + offset + 1
         strleader = '%05d%s%05d%s' % (record_length, self.leader[5:12], base_address, self.leader[17:])
         leader = strleader.encode('utf-8')
-        return leader + directory + fields
+        return b''.join([leader, directory] + fields)
 
     def get_name_strings(self):
         if any(s in self.fields for s in ['130', '147', '148', '150', '151', '155', '162',
@@ -250,31 +288,35 @@ class Record(object):
         identifiers = {a: set() for a in NODE_TYPES}
         identifiers['isbn'] = self.get_isbns(record_type=record_type)
         identifiers['string'] = self.get_name_strings()
+        # Identifiers are collected as they appear, then normalised together
+        found = {a: [] for a in ['isni', 'viaf', 'naco']}
         if record_type=='NACO':
             for field in self.get_fields('001'):
-                identifiers['naco'].add(field.data.strip())
+                found['naco'].append(field.data)
         for field in self.get_fields('024'):
             for subfield in field.get_subfields('a'):
                 if 'viaf' in subfield or ('2' in field and 'viaf' in field['2']):
-                    identifiers['viaf'].add(clean_identifier(subfield.strip(), type='viaf'))
+                    found['viaf'].append(subfield)
                 elif 'isni' in subfield or ('2' in field and 'isni' in field['2']):
-                    identifiers['isni'].add(clean_identifier(subfield.strip(), type='isni'))
+                    found['isni'].append(subfield)
         for field in self.get_fields('100', '400', '600', '700'):
             if any(s in field for s in ['f', 'h', 'k', 'l', 'm', 'n', 'o', 'p', 'r', 's', 't', 'v']): continue
             for subfield in field.get_subfields('0'):
                 if subfield.startswith('(ISNI)'):
-                    identifiers['isni'].add(clean_identifier(subfield.strip().replace('(ISNI)', ''), type='isni'))
+                    found['isni'].append(subfield.replace('(ISNI)', ''))
                 elif subfield.startswith('(VIAF)'):
-                    identifiers['viaf'].add(clean_identifier(subfield.strip().replace('(VIAF)', ''), type='viaf'))
+                    found['viaf'].append(subfield.replace('(VIAF)', ''))
                 elif subfield.startswith('(LC)'):
-                    identifiers['naco'].add(clean_identifier(subfield.strip().replace('(LC)', ''), type='naco'))
+                    found['naco'].append(subfield.replace('(LC)', ''))
             if record_type == 'BNB':
                 for subfield in field.get_subfields('8'):
                     if 'isni' in subfield:
-                        identifiers['isni'].add(clean_identifier(subfield.strip(), type='isni'))
+                        found['isni'].append(subfield)
                 for subfield in field.get_subfields('9'):
                     if 'viaf' in subfield:
-                        identifiers['viaf'].add(clean_identifier(subfield.strip(), type='viaf'))
+                        found['viaf'].append(subfield)
+        for a in found:
+            identifiers[a] = clean_identifiers(found[a], type=a)
         return identifiers
 
 
@@ -353,10 +395,11 @@ class Field(object):
     def as_marc(self):
         if self.is_control_field():
             return (self.data + END_OF_FIELD).encode('utf-8')
-        marc = self.indicator1 + self.indicator2
-        for subfield in self:
-            marc += SUBFIELD_INDICATOR + subfield[0] + subfield[1]
-        return (marc + END_OF_FIELD).encode('utf-8')
+        marc = [self.indicator1, self.indicator2]
+        for code, value in zip(self.subfields[0::2], self.subfields[1::2]):
+            marc.extend((SUBFIELD_INDICATOR, code, value))
+        marc.append(END_OF_FIELD)
+        return ''.join(marc).encode('utf-8')
 
 
 # ====================
@@ -364,25 +407,6 @@ class Field(object):
 # ====================
 
 
-def clean_identifier(s, type=None):
-    if s is None or not s: return None
-    s = s.strip().rstrip('/').strip()
-    s = re.sub(r'https?:\/\/(www\.)?(isni|viaf)\.org\/(isni|viaf)\/?', '', s).strip()
-    if '/' in s:
-        s = s.rsplit('/')[-1]
-    if type == 'naco':
-        s = re.sub(r'\s+', '', s.lower().strip().replace(' ', ''))
-        if re.search(r'[^0-9nbors]]', s): return None
-        if not s.startswith('n'): return None
-    if type == 'isni':
-        s = s.upper().strip().replace(' ', '').replace('-', '')
-        if re.search(r'[^0-9X]]', s): return None
-    if type == 'viaf':
-        s = re.sub(r'\s*\(Personal\)', '', s).strip()
-        if re.search(r'[^0-9]]', s): return None
-    return s.strip()
-
-
 '''
 def parse_marc_file(record_type='BNB'):
 
@@ -0,0 +1,487 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ====================
+#       Set-up
+# ====================
+
+# Import required modules
+from contextlib import contextmanager
+import ctypes
+import datetime
+import itertools
+import json
+import os
+import re
+import signal
+import sqlite3
+import sys
+import threading
+import time
+
+try: import resource
+except ImportError: resource = None
+
+
+__author__ = 'Victoria Morris'
+__license__ = 'MIT License'
+__version__ = '1.0.0'
+__status__ = '4 - Beta Development'
+
+
+# ====================
+#      Constants
+# ====================
+
+METRICS_FILE_PATH = 'identities_graph_metrics.jsonl'
+PROGRESS_INTERVAL = 0.5     # Minimum interval (in seconds) between progress messages
+PROGRESS_CHECK = 256        # Number of records between checks of the time since the last progress message
+LAP_RECORDS = 256           # Number of records read by an ingest loop before timing the stages which process them (see chunks)
+
+SQL_PROFILE_FILE_PATH = 'identities_graph_sql_profile.txt'
+SQL_PROFILE_PLANS = 10      # Number of the slowest statements for which query plans are reported
+SQL_PROFILE_PLAN_SECONDS = 0.01     # Minimum time taken by a run of a statement before its query plan is captured
+
+PROFILE_FILE_PATH = 'identities_graph_profile'     # Folder in which the stacks sampled in each phase are written
+PROFILE_INTERVAL = 0.01     # Interval (in seconds) between samples of the stack
+PROFILE_OTHER_PHASE = 'other'       # Name under which samples taken outside any phase are written
+# Interval (in seconds) after which a thread holding the GIL must release it, while sampling in a background thread;
+# otherwise samples are delayed until the profiled thread releases the GIL (e.g. in SQLite), and are biased towards such calls
+PROFILE_SWITCH_INTERVAL = 0.0001
+
+# Upper bounds (in milliseconds) of the buckets in the commit latency histogram
+LATENCY_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000]
+
+
+# ====================
+#       Classes
+# ====================
+
+
+class Metrics:
+    """Class to record the time spent in each phase of processing, with throughput and memory use
+
+    Phases can be timed as blocks (with metrics.phase('index'): ...),
+    or within loops as laps (metrics.lap('parse') attributes the time since the previous lap to the phase parse)"""
+
+    def __init__(self, name=None):
+        self.name = name
+        self.started = datetime.datetime.now()
+        self.start = time.perf_counter()
+        self.phases = {}
+        self.latencies = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.commits, self.commit_seconds, self.commit_max = 0, 0.0, 0.0
+        self.counters = {}
+        self.mark = time.perf_counter()
+        self.next_check, self.last_progress = PROGRESS_CHECK, 0.0
+
+    def get_phase(self, name):
+        if name not in self.phases:
+            self.phases[name] = {'seconds': 0.0, 'calls': 0, 'records': 0, 'bytes': 0}
+        return self.phases[name]
+
+    @contextmanager
+    def phase(self, name):
+        """Function to time a block as a phase"""
+        phase = self.get_phase(name)
+        phase['calls'] += 1
+        start = time.perf_counter()
+        try: yield phase
+        finally:
+            phase['seconds'] += time.perf_counter() - start
+            self.mark = time.perf_counter()
+
+    def lap(self, name=None):
+        """Function to attribute the time since the previous lap to a phase (or to no phase, if name is None)"""
+        now = time.perf_counter()
+        if name: self.get_phase(name)['seconds'] += now - self.mark
+        self.mark = now
+
+    def attach_profiler(self, profiler):
+        """Function to attribute the samples taken by a SamplingProfiler to phases, as the time is attributed
+
+        The functions which time phases are only replaced when a profiler is attached, so timing costs nothing extra otherwise"""
+        self.profiler = profiler
+        self.lap = self.profiled_lap
+        self.phase = self.profiled_phase
+
+    def profiled_lap(self, name=None):
+        self.profiler.attribute(name)
+        Metrics.lap(self, name)
+
+    @contextmanager
+    def profiled_phase(self, name):
+        self.profiler.attribute(None)
+        with Metrics.phase(self, name) as phase:
+            try: yield phase
+            finally: self.profiler.attribute(name)
+
+    def count(self, name, records=0, bytes=0):
+        """Function to add to the number of records and bytes processed in a phase"""
+        phase = self.get_phase(name)
+        phase['records'] += records
+        phase['bytes'] += bytes
+
+    def increment(self, counter, value=1):
+        """Function to add to a named counter"""
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def commit_latency(self, seconds):
+        """Function to record the latency of writing and committing a batch"""
+        self.commits += 1
+        self.commit_seconds += seconds
+        self.commit_max = max(self.commit_max, seconds)
+        milliseconds = seconds * 1000
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if milliseconds < bound:
+                self.latencies[i] += 1
+                return
+        self.latencies[-1] += 1
+
+    def progress(self, record_count, final=False):
+        """Function to display the number of records processed, at most once every PROGRESS_INTERVAL seconds"""
+        if record_count < self.next_check and not final: return
+        # Once a loop has finished, the next loop starts counting again from 0
+        self.next_check = PROGRESS_CHECK if final else record_count + PROGRESS_CHECK
+        now = time.monotonic()
+        if final or now - self.last_progress >= PROGRESS_INTERVAL:
+            self.last_progress = now
+            print('\r{} records processed'.format(str(record_count)), end='\n' if final else '\r')
+            sys.stdout.flush()
+
+    def summary(self):
+        """Function to get a summary of the metrics, as a dictionary which can be serialised as JSON"""
+        phases = {}
+        for name, phase in self.phases.items():
+            phases[name] = dict(phase)
+            phases[name]['seconds'] = round(phase['seconds'], 6)
+            if phase['seconds'] > 0:
+                if phase['records']: phases[name]['records_per_second'] = round(phase['records'] / phase['seconds'], 1)
+                if phase['bytes']: phases[name]['bytes_per_second'] = round(phase['bytes'] / phase['seconds'], 1)
+        histogram = {}
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            histogram['<{}ms'.format(bound)] = self.latencies[i]
+        histogram['>={}ms'.format(LATENCY_BUCKETS[-1])] = self.latencies[-1]
+        return {
+            'name': self.name,
+            'started': str(self.started),
+            'elapsed_seconds': round(time.perf_counter() - self.start, 6),
+            'peak_rss_bytes': peak_rss(),
+            'phases': phases,
+            'counters': self.counters,
+            'commits': {
+                'count': self.commits,
+                'total_seconds': round(self.commit_seconds, 6),
+                'max_seconds': round(self.commit_max, 6),
+                'histogram': histogram,
+            },
+        }
+
+    def write(self, path=METRICS_FILE_PATH):
+        """Function to append the summary to a file of JSON lines"""
+        with open(path, mode='a', encoding='utf-8') as file:
+            file.write(json.dumps(self.summary()) + '\n')
+
+
+class SamplingProfiler:
+    """Class to sample the stack of the main thread at regular intervals, counting the time for which each stack is seen
+
+    Where the platform supports interval timers, samples are taken by a signal handler, which runs in the main thread;
+    otherwise (e.g. on Windows) they are taken by a background thread. Either way, the profiled code is not traced.
+    A sample counts for the number of intervals since the previous sample, as the signals which arrive while
+    a long call to C code (e.g. SQLite) runs are only handled once, when it returns.
+    Sampling can be paused (e.g. while a program waits for input), so that the time spent waiting is not counted.
+    Samples are pending until they are attributed to a phase (see Metrics.attach_profiler), and the stacks of each phase
+    are written as collapsed stacks (one line per stack, of the form outer;...;inner count), which flame graph viewers open directly"""
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.pending, self.phases, self.labels = {}, {}, {}
+        self.samples, self.last = 0, time.perf_counter()
+        self.stopped, self.running = threading.Event(), threading.Event()
+        self.running.set()
+        self.thread, self.handler = None, None
+        if hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread():
+            self.handler = signal.signal(signal.SIGALRM, self.handle)
+            # System calls interrupted by the signal are restarted, rather than failing
+            signal.siginterrupt(signal.SIGALRM, False)
+            signal.setitimer(signal.ITIMER_REAL, interval, interval)
+            return
+        self.thread_id = threading.main_thread().ident
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.switch_interval, PROFILE_SWITCH_INTERVAL))
+        self.thread = threading.Thread(target=self.run, name='SamplingProfiler', daemon=True)
+        self.thread.start()
+
+    def handle(self, signum, frame):
+        self.sample(frame)
+
+    def run(self):
+        while self.running.wait() and not self.stopped.wait(self.interval):
+            self.sample(sys._current_frames().get(self.thread_id))
+
+    def sample(self, frame):
+        if not self.running.is_set(): return
+        now = time.perf_counter()
+        weight, self.last = max(1, round((now - self.last) / self.interval)), now
+        # Stacks are keyed by their code objects, which are only labelled when they are written
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        if not codes: return
+        stack, pending = tuple(codes), self.pending
+        pending[stack] = pending.get(stack, 0) + weight
+        self.samples += 1
+
+    def attribute(self, phase):
+        """Function to attribute the samples taken since the previous call to a phase (or to no phase, if phase is None)"""
+        if not self.pending: return
+        # Samples taken after the swap are added to the new dictionary, so none are lost
+        pending, self.pending = self.pending, {}
+        stacks = self.phases.setdefault(phase or PROFILE_OTHER_PHASE, {})
+        for stack, count in pending.items():
+            stacks[stack] = stacks.get(stack, 0) + count
+
+    def pause(self):
+        """Function to stop taking samples until sampling is resumed"""
+        if self.stopped.is_set() or not self.running.is_set(): return
+        self.running.clear()
+        if not self.thread: signal.setitimer(signal.ITIMER_REAL, 0, 0)
+
+    def resume(self):
+        """Function to start taking samples again after sampling was paused"""
+        if self.stopped.is_set() or self.running.is_set(): return
+        # The time for which sampling was paused is not counted in the weight of the next sample
+        self.last = time.perf_counter()
+        self.running.set()
+        if not self.thread: signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+
+    def stop(self):
+        if not self.stopped.is_set():
+            self.stopped.set()
+            # A paused sampling thread waits to be resumed, so it is released in order to finish
+            self.running.set()
+            if self.thread:
+                self.thread.join()
+                sys.setswitchinterval(self.switch_interval)
+            else:
+                signal.setitimer(signal.ITIMER_REAL, 0, 0)
+                signal.signal(signal.SIGALRM, self.handler)
+        self.attribute(None)
+
+    def label(self, code) -> str:
+        if code not in self.labels:
+            self.labels[code] = '{} ({}:{})'.format(getattr(code, 'co_qualname', code.co_name),
+                                                    os.path.basename(code.co_filename), code.co_firstlineno).replace(';', ',')
+        return self.labels[code]
+
+    def write(self, name='profile', path=PROFILE_FILE_PATH):
+        """Function to stop sampling, and write the stacks of each phase to a file named NAME_PHASE.folded in the folder path
+
+        The count of each stack is the number of sampling intervals for which it was seen"""
+        self.stop()
+        os.makedirs(path, exist_ok=True)
+        for phase, stacks in sorted(self.phases.items()):
+            lines = {}
+            for stack, count in stacks.items():
+                line = ';'.join(self.label(code) for code in reversed(stack))
+                lines[line] = lines.get(line, 0) + count
+            with open(os.path.join(path, '{}_{}.folded'.format(name, phase)), mode='w', encoding='utf-8') as file:
+                for line, count in sorted(lines.items(), key=lambda l: l[1], reverse=True):
+                    file.write('{} {}\n'.format(line, count))
+        print('Profile of {} samples written to {}'.format(str(self.samples), path))
+
+
+class SQLProfiler:
+    """Class to record the number of runs, time taken and rows returned for each distinct SQL statement
+
+    The time taken by a run of a statement includes the time taken to fetch its rows,
+    since SQLite only evaluates a query as its rows are fetched.
+    Runs are tracked by the cursors which make them (see ProfiledCursor), so cursors on different connections
+    and in different threads can share a profiler; the totals are updated while holding a lock.
+    Query plans are captured as soon as a slow run finishes, while any temporary tables it uses still exist"""
+
+    def __init__(self):
+        self.statements = {}
+        self.lock = threading.Lock()
+
+    def start(self, sql):
+        """Function to start recording a run of a statement, returning the key under which it is recorded"""
+        key = re.sub(r'\s+', ' ', sql).strip()
+        with self.lock:
+            if key not in self.statements:
+                self.statements[key] = {'runs': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows': 0, 'plan': None}
+            self.statements[key]['runs'] += 1
+        return key
+
+    def add(self, key, seconds, rows=0):
+        """Function to add to the time taken and rows returned by a run of a statement"""
+        with self.lock:
+            self.statements[key]['seconds'] += seconds
+            self.statements[key]['rows'] += rows
+
+    def finish(self, key, seconds, params=None, connection=None):
+        """Function to finish recording a run of a statement, given the total time it took"""
+        with self.lock:
+            statement = self.statements[key]
+            if seconds <= statement['max_seconds']: return
+            statement['max_seconds'] = seconds
+        if seconds < SQL_PROFILE_PLAN_SECONDS or connection is None: return
+        plan = self.query_plan(connection, key, params)
+        with self.lock:
+            if statement['max_seconds'] == seconds: statement['plan'] = plan
+
+    def query_plan(self, connection, sql, params=None):
+        """Function to get the query plan of a statement, as a list of lines"""
+        if not sql.upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH')): return []
+        try: rows = connection.execute('EXPLAIN QUERY PLAN {}'.format(sql), params or ()).fetchall()
+        except sqlite3.Error as e: return ['Query plan not available: {}'.format(str(e))]
+        # Each row of the plan is (id, parent, unused, detail)
+        depth, lines = {0: 0}, []
+        for node, parent, _, detail in rows:
+            depth[node] = depth.get(parent, 0) + 1
+            lines.append('{}{}'.format('  ' * depth[node], detail))
+        return lines
+
+    def write(self, path=SQL_PROFILE_FILE_PATH):
+        """Function to write a report of the statements ranked by the total time taken,
+        with the query plans of the statements with the longest single runs"""
+        with self.lock: statements = {sql: dict(s) for (sql, s) in self.statements.items()}
+        ranked = sorted(statements.items(), key=lambda s: s[1]['seconds'], reverse=True)
+        slowest = sorted(statements, key=lambda s: statements[s]['max_seconds'], reverse=True)[:SQL_PROFILE_PLANS]
+        total = sum(s['seconds'] for s in statements.values()) or 1.0
+        with open(path, mode='w', encoding='utf-8', errors='replace') as file:
+            file.write('SQL profile {}\n\n'.format(str(datetime.datetime.now())))
+            file.write('Rank\tTotal (s)\t% of total\tRuns\tMean (s)\tMax (s)\tRows\tStatement\n')
+            for rank, (sql, s) in enumerate(ranked, start=1):
+                file.write('{}\t{:.6f}\t{:.1f}\t{}\t{:.6f}\t{:.6f}\t{}\t{}\n'.format(
+                    rank, s['seconds'], 100 * s['seconds'] / total, s['runs'], s['seconds'] / s['runs'],
+                    s['max_seconds'], s['rows'], sql))
+            file.write('\nQuery plans of the {} slowest statements\n'.format(str(len(slowest))))
+            for sql in slowest:
+                file.write('\n{:.6f}s\t{}\n'.format(statements[sql]['max_seconds'], sql))
+                for line in statements[sql]['plan'] or []:
+                    file.write('{}\n'.format(line))
+        print('SQL profile written to {}'.format(path))
+
+
+class ProfiledCursor:
+    """Class to wrap a database cursor, recording the statements it runs with an SQLProfiler
+
+    A run of a statement lasts until its rows have all been fetched, the cursor runs another statement,
+    or the cursor is closed"""
+
+    def __init__(self, cursor, profiler):
+        self.cursor = cursor
+        self.profiler = profiler
+        self.key, self.params, self.seconds = None, None, 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def start(self, sql, params):
+        self.finish()
+        self.key, self.params, self.seconds = self.profiler.start(sql), params, 0.0
+
+    def add(self, seconds, rows=0):
+        if self.key is None: return
+        self.seconds += seconds
+        self.profiler.add(self.key, seconds, rows)
+
+    def finish(self):
+        if self.key is None: return
+        key, self.key = self.key, None
+        self.profiler.finish(key, self.seconds, self.params, self.cursor.connection)
+
+    def execute(self, sql, params=()):
+        self.start(sql, params)
+        start = time.perf_counter()
+        try: self.cursor.execute(sql, params)
+        finally: self.add(time.perf_counter() - start)
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        self.start(sql, seq_of_params[0] if seq_of_params else None)
+        start = time.perf_counter()
+        try: self.cursor.executemany(sql, seq_of_params)
+        finally: self.add(time.perf_counter() - start)
+        return self
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self.cursor.fetchone()
+        self.add(time.perf_counter() - start, 0 if row is None else 1)
+        if row is None: self.finish()
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = self.cursor.fetchmany(self.cursor.arraysize if size is None else size)
+        self.add(time.perf_counter() - start, len(rows))
+        if not rows: self.finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self.cursor.fetchall()
+        self.add(time.perf_counter() - start, len(rows))
+        self.finish()
+        return rows
+
+    def __iter__(self):
+        row = self.fetchone()
+        while row is not None:
+            yield row
+            row = self.fetchone()
+
+    def close(self):
+        self.finish()
+        self.cursor.close()
+
+
+# ====================
+#      Functions
+# ====================
+
+
+def chunks(iterable, size=LAP_RECORDS):
+    """Function to split an iterable into lists of consecutive items, so that a loop can lap the time taken to read
+    and to process each list, rather than each item"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk: return
+        yield chunk
+
+
+def peak_rss():
+    """Function to get the peak resident set size of the process in bytes, where the platform reports it"""
+    if resource is None: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes; macOS reports bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def available_memory():
+    """Function to get the physical memory available to the process in bytes, where the platform reports it"""
+    # On Linux, MemAvailable includes memory used for caches which can be reclaimed
+    try:
+        with open('/proc/meminfo', mode='r') as file:
+            for line in file:
+                if line.startswith('MemAvailable:'): return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError): pass
+    if sys.platform == 'win32':
+        class MemoryStatus(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+        status = MemoryStatus()
+        status.dwLength = ctypes.sizeof(MemoryStatus)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)): return status.ullAvailPhys
+        return None
+    try: return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+    except (AttributeError, ValueError, OSError): return None
@@ -0,0 +1,494 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ====================
+#       Set-up
+# ====================
+
+# Import required modules
+from array import array
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import mmap
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from identities_tools.graph_tools import *
+
+
+__author__ = 'Victoria Morris'
+__license__ = 'MIT License'
+__version__ = '1.0.0'
+__status__ = '4 - Beta Development'
+
+
+# ====================
+#      Constants
+# ====================
+
+RESOLVER_POOL_SIZE = 4
+RESOLVER_CACHE_SIZE = 100000
+RESOLVER_CACHED_STATEMENTS = 32
+RESOLVER_REFRESH_INTERVAL = 1.0     # Minimum interval (in seconds) between checks for changes to the database
+
+EXPLAIN_MAX_DEPTH = 12     # Maximum number of edges in the path explaining why two identifiers are linked
+
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8765
+SERVER_MAX_BATCH = 10000
+
+# Types of identifier which can be resolved, as they are prefixed in the graph tables
+IDENTIFIER_TYPES = ['isbn', 'isni', 'viaf', 'naco', 'harpercollins', 'penguin', 'randomhouse']
+
+# The VIAF clusters containing a single identifier (?1) or ISBN (?2)
+SQL_CLUSTERS = """SELECT VIAF, identifier FROM VIAF_equivalences WHERE VIAF IN (
+    SELECT VIAF FROM VIAF_equivalences WHERE VIAF = ?1
+    UNION SELECT VIAF FROM VIAF_equivalences WHERE identifier = ?1
+    UNION SELECT VIAF FROM VIAF_isbn WHERE isbn = ?2
+    UNION SELECT VIAF_isbn.VIAF FROM isbn_equivalents
+    INNER JOIN VIAF_isbn ON VIAF_isbn.isbn = isbn_equivalents.isbnb WHERE isbn_equivalents.isbna = ?2)
+ORDER BY VIAF, identifier ;"""
+
+# Equivalences outside VIAF, for a single identifier which is not in any VIAF cluster
+SQL_OTHER = """SELECT identifier FROM other_equivalences WHERE other = ?1
+UNION SELECT other FROM other_equivalences WHERE identifier = ?1 ;"""
+
+# The VIAF clusters containing each identifier in the temporary table resolve_input
+SQL_CLUSTERS_MANY = """WITH matches (node, VIAF) AS (
+    SELECT resolve_input.node, VIAF_equivalences.VIAF FROM resolve_input
+    INNER JOIN VIAF_equivalences ON VIAF_equivalences.VIAF = resolve_input.node
+    UNION SELECT resolve_input.node, VIAF_equivalences.VIAF FROM resolve_input
+    INNER JOIN VIAF_equivalences ON VIAF_equivalences.identifier = resolve_input.node
+    UNION SELECT resolve_input.node, VIAF_isbn.VIAF FROM resolve_input
+    INNER JOIN VIAF_isbn ON VIAF_isbn.isbn = resolve_input.isbn
+    UNION SELECT resolve_input.node, VIAF_isbn.VIAF FROM resolve_input
+    INNER JOIN isbn_equivalents ON isbn_equivalents.isbna = resolve_input.isbn
+    INNER JOIN VIAF_isbn ON VIAF_isbn.isbn = isbn_equivalents.isbnb)
+SELECT matches.node, matches.VIAF, VIAF_equivalences.identifier FROM matches
+INNER JOIN VIAF_equivalences ON VIAF_equivalences.VIAF = matches.VIAF
+ORDER BY matches.node, matches.VIAF, VIAF_equivalences.identifier ;"""
+
+SQL_OTHER_MANY = """SELECT resolve_input.node, other_equivalences.identifier FROM resolve_input
+INNER JOIN other_equivalences ON other_equivalences.other = resolve_input.node
+UNION SELECT resolve_input.node, other_equivalences.other FROM resolve_input
+INNER JOIN other_equivalences ON other_equivalences.identifier = resolve_input.node ;"""
+
+
+# ====================
+#       Classes
+# ====================
+
+
+# The result of resolving an identifier:
+#   identifier      the normalised identifier, of the form type:value
+#   viaf            the VIAF clusters containing the identifier
+#   identifiers     all identifiers equivalent to the identifier
+Cluster = namedtuple('Cluster', ['identifier', 'viaf', 'identifiers'])
+
+# An edge in the path explaining why two identifiers are linked:
+#   source, target  the nodes at either end of the edge, of the form type:value
+#   table           the table in which the edge is found (e.g. VIAF_equivalences)
+Evidence = namedtuple('Evidence', ['source', 'table', 'target'])
+
+EXPLAINER = None
+
+
+class IdentityResolver:
+    """Class to resolve identifiers to their clusters in the identity graph
+
+    Lookups use a pool of read-only connections, each of which reuses its prepared statements,
+    and a size-bounded LRU cache of resolved clusters, which is cleared when the database changes (see refresh);
+    the resolver can be shared between threads.
+    The database must not be held open in exclusive locking mode by an IdentityGraphDatabase;
+    the connections use the read settings of a storage profile (see STORAGE_PROFILES)"""
+
+    def __init__(self, path=DATABASE_PATH, pool_size=RESOLVER_POOL_SIZE, cache_size=RESOLVER_CACHE_SIZE, profile='serve'):
+        self.path = path
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.hits, self.misses = 0, 0
+        self.pool = queue.Queue()
+        uri = 'file:{}?mode=ro'.format(urllib.request.pathname2url(os.path.abspath(self.path)))
+        # A separate connection detects changes committed to the database by other processes
+        self.version_conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        self.version_lock = threading.Lock()
+        self.data_version, self.checked = self.version_conn.execute('PRAGMA data_version').fetchone()[0], time.monotonic()
+        settings = storage_settings(STORAGE_PROFILE or profile, path, connections=pool_size)
+        for i in range(pool_size):
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False, isolation_level=None,
+                                   cached_statements=RESOLVER_CACHED_STATEMENTS)
+            for pragma in STORAGE_READ_PRAGMAS:
+                if settings.get(pragma) is not None: conn.execute('PRAGMA {} = {}'.format(pragma, settings[pragma]))
+            conn.execute('CREATE TEMP TABLE resolve_input (node TEXT PRIMARY KEY, isbn TEXT) ;')
+            self.pool.put(conn)
+        self.pool_size = pool_size
+
+    def close(self):
+        for i in range(self.pool_size):
+            self.pool.get().close()
+        self.version_conn.close()
+
+    def refresh(self):
+        """Function to clear the cache if the database has changed since it was last checked
+
+        Checks are made at most once every RESOLVER_REFRESH_INTERVAL seconds"""
+        with self.version_lock:
+            if time.monotonic() - self.checked < RESOLVER_REFRESH_INTERVAL: return
+            self.checked = time.monotonic()
+            data_version = self.version_conn.execute('PRAGMA data_version').fetchone()[0]
+            if data_version == self.data_version: return
+            self.data_version = data_version
+        self.clear_cache()
+
+    @contextmanager
+    def connection(self):
+        """Function to borrow a connection from the pool, within a read transaction"""
+        conn = self.pool.get()
+        try:
+            # All queries for a lookup read from the same snapshot of the database
+            conn.execute('BEGIN ;')
+            try: yield conn
+            finally: conn.execute('COMMIT ;')
+        finally: self.pool.put(conn)
+
+    def cached(self, node):
+        with self.cache_lock:
+            cluster = self.cache.get(node)
+            if cluster is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.cache.move_to_end(node)
+            return cluster
+
+    def store(self, cluster):
+        with self.cache_lock:
+            self.cache[cluster.identifier] = cluster
+            self.cache.move_to_end(cluster.identifier)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def clear_cache(self):
+        with self.cache_lock:
+            self.cache.clear()
+
+    def resolve(self, identifier):
+        """Function to resolve a single identifier to its cluster
+
+        Returns None if the identifier is not recognised,
+        or a Cluster (with empty viaf and identifiers if the identifier is not in the graph)"""
+        self.refresh()
+        node = normalise_identifier(identifier)
+        if not node: return None
+        cluster = self.cached(node)
+        if cluster: return cluster
+        isbn = node[5:] if node.startswith('isbn:') else None
+        with self.connection() as conn:
+            rows = conn.execute(SQL_CLUSTERS, (node, isbn)).fetchall()
+            if rows:
+                cluster = Cluster(node, tuple(sorted(set(row[0] for row in rows))),
+                                  tuple(sorted(set(row[1] for row in rows))))
+            else:
+                cluster = Cluster(node, (), tuple(sorted(row[0] for row in conn.execute(SQL_OTHER, (node,)))))
+        self.store(cluster)
+        return cluster
+
+    def resolve_many(self, identifiers):
+        """Function to resolve an iterable of identifiers to their clusters
+
+        Returns a dictionary of {identifier: Cluster or None};
+        identifiers which are not cached are looked up together, by joining a temporary table"""
+        self.refresh()
+        results, nodes = {}, {}
+        for identifier in identifiers:
+            node = normalise_identifier(identifier)
+            if not node:
+                results[identifier] = None
+                continue
+            cluster = self.cached(node)
+            if cluster: results[identifier] = cluster
+            else: nodes.setdefault(node, []).append(identifier)
+        if not nodes: return results
+
+        viaf, equivalents = {node: set() for node in nodes}, {node: set() for node in nodes}
+        with self.connection() as conn:
+            conn.execute('DELETE FROM resolve_input ;')
+            conn.executemany('INSERT INTO resolve_input (node, isbn) VALUES (?, ?) ;',
+                             ((node, node[5:] if node.startswith('isbn:') else None) for node in nodes))
+            for node, v, identifier in conn.execute(SQL_CLUSTERS_MANY):
+                viaf[node].add(v)
+                equivalents[node].add(identifier)
+            for node, identifier in conn.execute(SQL_OTHER_MANY):
+                if not viaf[node]: equivalents[node].add(identifier)
+            conn.execute('DELETE FROM resolve_input ;')
+
+        for node in nodes:
+            cluster = Cluster(node, tuple(sorted(viaf[node])), tuple(sorted(equivalents[node])))
+            self.store(cluster)
+            for identifier in nodes[node]:
+                results[identifier] = cluster
+        return results
+
+
+class GraphExplainer:
+    """Class to explain why two identifiers are linked, by finding the shortest path between them in the graph
+
+    The path is found by a bidirectional breadth-first search over the graph adjacency written by
+    IdentityGraphDatabase.export_csr; the files are memory-mapped, so they are cached by the operating system
+    and only the parts of the graph which are searched are read"""
+
+    def __init__(self, path=CSR_FILE_PATH, tables=None):
+        self.path = path
+        with open(os.path.join(path, 'manifest.json'), mode='r', encoding='utf-8') as file:
+            self.manifest = json.load(file)
+        self.node_count = self.manifest['nodes']
+        self.files, self.maps, self.views = [], [], []
+        self.names = self.map_file('nodes.bin')
+        self.offsets = self.map_file('nodes_offsets.bin', 'q')
+        self.adjacency = [(table, self.map_file('{}_offsets.bin'.format(table), 'q'),
+                           self.map_file('{}_neighbours.bin'.format(table), 'i'))
+                          for table in (tables or GRAPH_NODES) if table in self.manifest['edges']]
+
+    def map_file(self, filename, typecode=None):
+        """Function to memory-map a file of the graph adjacency, as bytes or (given a typecode) as an array of integers"""
+        file = open(os.path.join(self.path, filename), mode='rb')
+        self.files.append(file)
+        if os.fstat(file.fileno()).st_size == 0: return array(typecode) if typecode else b''
+        m = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.maps.append(m)
+        if typecode is None: return m
+        if sys.byteorder == 'little':
+            view = memoryview(m).cast(typecode)
+            self.views.append(view)
+            return view
+        values = array(typecode)
+        values.frombytes(m)
+        values.byteswap()
+        return values
+
+    def close(self):
+        for view in self.views: view.release()
+        for m in self.maps: m.close()
+        for file in self.files: file.close()
+        self.views, self.maps, self.files = [], [], []
+
+    def node(self, i) -> str:
+        """Function to get the name of a node (of the form type:value) from its id"""
+        return self.names[self.offsets[i]:self.offsets[i + 1]].decode('utf-8')
+
+    def find(self, node):
+        """Function to get the id of a node from its name, or None if it is not in the graph"""
+        # Nodes are sorted by their UTF-8 bytes, so can be found by bisection
+        key, low, high = node.encode('utf-8'), 0, self.node_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.names[self.offsets[middle]:self.offsets[middle + 1]] < key: low = middle + 1
+            else: high = middle
+        if low < self.node_count and self.names[self.offsets[low]:self.offsets[low + 1]] == key: return low
+        return None
+
+    def neighbours(self, i):
+        for table, offsets, neighbours in self.adjacency:
+            for j in neighbours[offsets[i]:offsets[i + 1]]:
+                yield j, table
+
+    def explain(self, a, b, max_depth=EXPLAIN_MAX_DEPTH):
+        """Function to find the shortest chain of evidence linking two identifiers
+
+        Identifiers are normalised as for IdentityResolver.resolve; names may be given in the form string:NAME.
+        Returns a list of Evidence, one for each edge in the path from a to b (an empty list if a and b are the same),
+        or None if either identifier is not in the graph, or they are not linked by a path of at most max_depth edges"""
+        ends = []
+        for identifier in [a, b]:
+            node = identifier if str(identifier).startswith('string:') else normalise_identifier(identifier)
+            i = self.find(node) if node else None
+            if i is None: return None
+            ends.append(i)
+        if ends[0] == ends[1]: return []
+        # The nodes reached from each end, with the node and table by which they were reached, and their distance
+        reached = [{ends[0]: (None, None, 0)}, {ends[1]: (None, None, 0)}]
+        frontiers = [[ends[0]], [ends[1]]]
+        for depth in range(max_depth):
+            if not (frontiers[0] and frontiers[1]): return None
+            # The smaller frontier is expanded by a whole level, keeping the meeting point closest to the other end
+            side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+            seen, other, frontier, meeting = reached[side], reached[1 - side], [], None
+            for i in frontiers[side]:
+                distance = seen[i][2] + 1
+                for j, table in self.neighbours(i):
+                    if j in seen: continue
+                    seen[j] = (i, table, distance)
+                    frontier.append(j)
+                    if j in other and (meeting is None or other[j][2] < other[meeting][2]): meeting = j
+            if meeting is not None: return self.trace(reached, meeting)
+            frontiers[side] = frontier
+        return None
+
+    def trace(self, reached, meeting) -> list:
+        """Function to get the path from one end of a search to the other, through the node at which the searches met"""
+        path, i = [], meeting
+        while reached[0][i][0] is not None:
+            previous, table, _ = reached[0][i]
+            path.append(Evidence(self.node(previous), table, self.node(i)))
+            i = previous
+        path.reverse()
+        i = meeting
+        while reached[1][i][0] is not None:
+            following, table, _ = reached[1][i]
+            path.append(Evidence(self.node(i), table, self.node(following)))
+            i = following
+        return path
+
+
+class LookupRequestHandler(BaseHTTPRequestHandler):
+    """Class to handle requests to the lookup service
+
+        GET /resolve?id=IDENTIFIER[&id=IDENTIFIER...]
+        POST /resolve with a JSON list of identifiers
+        GET /status
+    Responses are JSON objects of {identifier: cluster}, where cluster is null if the identifier is not recognised"""
+
+    resolver = None
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == '/status':
+            resolver = self.resolver
+            return self.send_json({'database': os.path.abspath(resolver.path), 'cached': len(resolver.cache),
+                                   'hits': resolver.hits, 'misses': resolver.misses})
+        if url.path != '/resolve': return self.send_error(404, 'Not found')
+        identifiers = urllib.parse.parse_qs(url.query).get('id', [])
+        if not identifiers: return self.send_error(400, 'No identifiers given')
+        self.resolve(identifiers)
+
+    def do_POST(self):
+        if urllib.parse.urlsplit(self.path).path != '/resolve': return self.send_error(404, 'Not found')
+        try:
+            identifiers = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+        except ValueError: return self.send_error(400, 'Request body is not valid JSON')
+        if not isinstance(identifiers, list): return self.send_error(400, 'Request body must be a JSON list')
+        if len(identifiers) > SERVER_MAX_BATCH:
+            return self.send_error(413, 'No more than {} identifiers may be resolved at once'.format(SERVER_MAX_BATCH))
+        self.resolve([str(i) for i in identifiers])
+
+    def resolve(self, identifiers):
+        if len(identifiers) == 1: results = {identifiers[0]: self.resolver.resolve(identifiers[0])}
+        else: results = self.resolver.resolve_many(identifiers)
+        self.send_json({i: results[i]._asdict() if results[i] else None for i in results})
+
+    def send_json(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Requests are not logged, as logging every lookup would slow the service down
+        pass
+
+
+# ====================
+#      Functions
+# ====================
+
+
+def enable_wal(path=DATABASE_PATH) -> None:
+    """Function to put the database into WAL mode, so that it can be read while data is being added
+
+    The setting is persistent, and is respected by IdentityGraphDatabase"""
+    conn = sqlite3.connect(path)
+    mode = conn.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+    conn.close()
+    if mode.lower() != 'wal':
+        raise sqlite3.OperationalError('Could not put database {} into WAL mode'.format(path))
+
+
+def serve(path=DATABASE_PATH, host=SERVER_HOST, port=None, pool_size=RESOLVER_POOL_SIZE) -> None:
+    """Function to run the lookup service until it is interrupted"""
+    # The port is looked up when the service starts, so that it can be set with --port
+    port = port or SERVER_PORT
+    # The shared connection holds an exclusive lock, which would prevent the database being put into WAL mode
+    close_database()
+    enable_wal(path)
+    handler = type('Handler', (LookupRequestHandler,), {'resolver': IdentityResolver(path, pool_size=pool_size)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    print('Serving lookups from {} at http://{}:{}/resolve ...'.format(path, host, port))
+    print('Press Ctrl+C to stop')
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally:
+        server.server_close()
+        handler.resolver.close()
+
+
+def get_explainer(path=CSR_FILE_PATH, database_path=DATABASE_PATH):
+    """Function to get the graph explainer which is shared between actions,
+    exporting the graph adjacency first if the database has changed since it was last exported"""
+    global EXPLAINER
+    manifest = os.path.join(path, 'manifest.json')
+    changed = max(os.path.getmtime(f) for f in [database_path, database_path + '-wal'] if os.path.isfile(f))
+    if not os.path.isfile(manifest) or os.path.getmtime(manifest) < changed:
+        # The files are rewritten, so must not be mapped while they are exported
+        close_explainer()
+        get_database(database_path).export_csr(path)
+    if EXPLAINER is None: EXPLAINER = GraphExplainer(path)
+    return EXPLAINER
+
+
+def close_explainer() -> None:
+    """Function to close the shared graph explainer, if it is open"""
+    global EXPLAINER
+    if EXPLAINER is not None: EXPLAINER.close()
+    EXPLAINER = None
+
+
+def explain_link() -> None:
+    """Function to explain why two identifiers are linked, asking for the identifiers"""
+    explainer = get_explainer()
+    a = input('First identifier:').strip()
+    b = input('Second identifier:').strip()
+    start = time.perf_counter()
+    path = explainer.explain(a, b)
+    elapsed = (time.perf_counter() - start) * 1000
+    if path is None:
+        print('\nNo link found between {} and {} ({:.1f} ms)'.format(a, b, elapsed))
+        return
+    print('\nPath of {} edges found in {:.1f} ms:'.format(str(len(path)), elapsed))
+    for evidence in path:
+        print('{}\t-- {} --\t{}'.format(evidence.source, evidence.table, evidence.target))
+
+
+def normalise_identifier(identifier):
+    """Function to convert an identifier to the form type:value used in the graph tables
+
+    Identifiers may be prefixed with their type (e.g. isni:0000000121032683), be VIAF or ISNI URIs, or be bare ISBNs"""
+    if identifier is None: return None
+    identifier = str(identifier).strip()
+    if not identifier: return None
+    if ':' in identifier and not identifier.lower().startswith('http'):
+        identifier_type, value = identifier.split(':', 1)
+        identifier_type = identifier_type.strip().lower()
+    else:
+        identifier_type = 'viaf' if 'viaf.org' in identifier else 'isni' if 'isni.org' in identifier else 'isbn'
+        value = identifier
+    if identifier_type not in IDENTIFIER_TYPES: return None
+    if identifier_type == 'isbn':
+        value = str(Isbn(value))
+        if not (is_isbn_13(value) or is_isbn_10(value)): return None
+    elif identifier_type in ['isni', 'viaf', 'naco']:
+        value = clean_identifier(value, type=identifier_type)
+    else: value = value.strip()
+    if is_null(value): return None
+    return '{}:{}'.format(identifier_type, value)
@@ -29,6 +29,7 @@ requirements = [
 setup(
     console=[
         'bin/identities_graph.py',
+        'bin/identities_benchmark.py',
     ],
     zipfile=None,
     options={
@@ -46,6 +47,7 @@ setup(
     packages=['identities_tools'],
     scripts=[
         'bin/identities_graph.py',
+        'bin/identities_benchmark.py',
     ],
     classifiers=[
         'Development Status :: 4 - Beta',
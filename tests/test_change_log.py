@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ====================
+#       Set-up
+# ====================
+
+# Import required modules
+from contextlib import redirect_stdout
+import io
+import os
+import tempfile
+import unittest
+from identities_tools.graph_tools import *
+
+__author__ = 'Victoria Morris'
+__license__ = 'MIT License'
+__version__ = '1.0.0'
+__status__ = '4 - Beta Development'
+
+
+# ====================
+#        Tests
+# ====================
+
+
+class TestChangeLog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        # Dumps and metrics are written to the working directory
+        os.chdir(self.directory.name)
+        with redirect_stdout(io.StringIO()):
+            self.db = IdentityGraphDatabase(os.path.join(self.directory.name, 'identities_graph.db'))
+
+    def tearDown(self):
+        with redirect_stdout(io.StringIO()): self.db.close()
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def insert(self, table, rows):
+        columns = [key for (key, value) in GRAPH_TABLES[table]]
+        self.db.cursor.executemany('INSERT INTO {} ({}) VALUES (?, ?) ;'.format(table, ', '.join(columns)), rows)
+        self.db.conn.commit()
+
+    def export_changes(self):
+        """Function to export the changes to all tables, returning the rows of each file of changes"""
+        with redirect_stdout(io.StringIO()): self.db.dump_database_changes()
+        changes = {}
+        for table in GRAPH_TABLES:
+            with open('{}_CHANGES_.tsv'.format(table), mode='r', encoding='utf-8') as file:
+                lines = file.read().splitlines()
+            self.assertEqual(lines[0], '\t'.join(['Change'] + text_columns(table)))
+            changes[table] = sorted(lines[1:])
+        return changes
+
+    def change_log(self):
+        self.db.cursor.execute('SELECT table_name, node FROM {} ;'.format(CHANGE_LOG_TABLE))
+        return self.db.cursor.fetchall()
+
+    def test_inserts(self):
+        self.insert('VIAF_isbn', [('viaf:1', '9780141439648'), ('viaf:1', '9780141439518'), ('viaf:2', '9780141439600')])
+        self.insert('string_isbn', [(self.db.names.get_id('Twain, Mark, 1835-1910'), '9780141439648')])
+        changes = self.export_changes()
+        self.assertEqual(changes['VIAF_isbn'], ['+\tviaf:1\t9780141439518', '+\tviaf:1\t9780141439648',
+                                                '+\tviaf:2\t9780141439600'])
+        self.assertEqual(changes['string_isbn'], ['+\tTwain, Mark, 1835-1910\t9780141439648'])
+        self.assertEqual(changes['VIAF_equivalences'], [])
+        self.assertEqual(self.change_log(), [])
+        # Once the log has been cleared, the next export is empty
+        self.assertTrue(all(rows == [] for rows in self.export_changes().values()))
+
+    def test_deletes(self):
+        self.insert('VIAF_isbn', [('viaf:1', '9780141439648'), ('viaf:1', '9780141439518'), ('viaf:2', '9780141439600')])
+        self.export_changes()
+        self.db.cursor.execute('DELETE FROM VIAF_isbn WHERE isbn IN (?, ?) ;', ('9780141439518', '9780141439600'))
+        self.db.conn.commit()
+        # A key which still has rows is written in full; a key with no rows left is written as a tombstone
+        self.assertEqual(self.export_changes()['VIAF_isbn'], ['+\tviaf:1\t9780141439648', '-\tviaf:2\t'])
+
+    def test_clean(self):
+        self.insert('VIAF_equivalences', [('viaf:1', 'naco:n79021164')])
+        self.insert('other_equivalences', [('naco:n79021164', 'penguin:P1'), ('naco:n50000001', 'penguin:P2')])
+        self.insert('VIAF_isbn', [('viaf:2', '')])
+        self.export_changes()
+        with redirect_stdout(io.StringIO()): self.db.clean()
+        changes = self.export_changes()
+        self.assertEqual(changes['VIAF_equivalences'], ['+\tviaf:1\tnaco:n79021164', '+\tviaf:1\tpenguin:P1'])
+        self.assertEqual(changes['other_equivalences'], ['-\tnaco:n79021164\t'])
+        self.assertEqual(changes['VIAF_isbn'], ['-\tviaf:2\t'])
+        self.assertEqual(self.change_log(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
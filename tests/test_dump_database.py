@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ====================
+#       Set-up
+# ====================
+
+# Import required modules
+from contextlib import redirect_stdout
+import io
+import os
+import tempfile
+import unittest
+from identities_tools.graph_tools import *
+
+__author__ = 'Victoria Morris'
+__license__ = 'MIT License'
+__version__ = '1.0.0'
+__status__ = '4 - Beta Development'
+
+
+# ====================
+#     Constants
+# ====================
+
+
+VIAF_EQUIVALENCES = [('viaf:1', 'isni:0000000121032683'), ('viaf:1', 'naco:n79021164'), ('viaf:1', 'penguin:P12345'),
+                     ('viaf:2', 'naco:n79032879'), ('viaf:2', 'harpercollins:H1')]
+OTHER_EQUIVALENCES = [('naco:n50000001', 'penguin:P1'), ('naco:n79032879', 'penguin:P2')]
+VIAF_ISBNS = [('viaf:1', '9780141439648'), ('viaf:2', '9780141439518')]
+NACO_AUTHORISED = [('n79021164', 'Twain, Mark, 1835-1910'), ('n79032879', 'Austen, Jane, 1775-1817')]
+
+REPORT_FILES = ['naco_isni_equivalents.txt', 'HarperCollins_identifiers.txt', 'Penguin_identifiers.txt',
+                'RandomHouse_identifiers.txt']
+
+
+# ====================
+#        Tests
+# ====================
+
+
+class TestDumpDatabase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        # Dumps and metrics are written to the working directory
+        os.chdir(self.directory.name)
+        with redirect_stdout(io.StringIO()):
+            self.db = IdentityGraphDatabase(os.path.join(self.directory.name, 'identities_graph.db'))
+            self.db.cursor.executemany('INSERT INTO VIAF_equivalences (VIAF, identifier) VALUES (?, ?) ;', VIAF_EQUIVALENCES)
+            self.db.cursor.executemany('INSERT INTO other_equivalences (other, identifier) VALUES (?, ?) ;', OTHER_EQUIVALENCES)
+            self.db.cursor.executemany('INSERT INTO VIAF_isbn (VIAF, isbn) VALUES (?, ?) ;', VIAF_ISBNS)
+            self.db.cursor.executemany('INSERT INTO NACO_authorised (NACO, name_id) VALUES (?, ?) ;',
+                                       [(naco, self.db.names.get_id(name)) for (naco, name) in NACO_AUTHORISED])
+            self.db.conn.commit()
+
+    def tearDown(self):
+        with redirect_stdout(io.StringIO()): self.db.close()
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def dump_database(self, **kwargs):
+        """Function to dump the database, returning the tables which were dumped"""
+        output = io.StringIO()
+        with redirect_stdout(output): self.db.dump_database(**kwargs)
+        skipped = set(table for table in GRAPH_TABLES
+                      if 'Table {} is unchanged since the last dump'.format(table) in output.getvalue())
+        return set(GRAPH_TABLES) - skipped
+
+    def read_dump(self, table):
+        with open(dump_file_name(table), mode='r', encoding='utf-8') as file:
+            return file.read().splitlines()[1:]
+
+    def read_outputs(self):
+        """Function to read the dumps of all the tables and the reports, deleting the files"""
+        outputs = {}
+        for filename in [dump_file_name(table) for table in GRAPH_TABLES] + REPORT_FILES:
+            with open(filename, mode='r', encoding='utf-8') as file:
+                outputs[filename] = file.read()
+            os.remove(filename)
+        return outputs
+
+    def test_unchanged_tables_are_skipped(self):
+        self.assertEqual(self.dump_database(workers=1), set(GRAPH_TABLES))
+        self.assertEqual(self.dump_database(workers=1), set())
+        self.db.cursor.execute('INSERT INTO VIAF_isbn (VIAF, isbn) VALUES (?, ?) ;', ('viaf:2', '9780141439600'))
+        self.db.conn.commit()
+        self.assertEqual(self.dump_database(workers=1), {'VIAF_isbn'})
+        self.assertIn('viaf:2\t9780141439600', self.read_dump('VIAF_isbn'))
+        self.assertEqual(self.dump_database(workers=1, force=True), set(GRAPH_TABLES))
+
+    def test_changed_table_with_same_fingerprint_is_dumped(self):
+        self.dump_database(workers=1)
+        fingerprint = self.db.fingerprint('other_equivalences')
+        # Cleaning deletes the last row of other_equivalences, whose rowid is then reused by the next row inserted
+        with redirect_stdout(io.StringIO()): self.db.clean()
+        self.db.cursor.execute('INSERT INTO other_equivalences (other, identifier) VALUES (?, ?) ;', ('naco:n50000003', 'penguin:P3'))
+        self.db.conn.commit()
+        self.assertEqual(self.db.fingerprint('other_equivalences'), fingerprint)
+        self.assertIn('other_equivalences', self.dump_database(workers=1))
+        self.assertEqual(sorted(self.read_dump('other_equivalences')),
+                         ['naco:n50000001\tpenguin:P1', 'naco:n50000003\tpenguin:P3'])
+
+    def test_parallel_dump_matches_serial_dump(self):
+        self.dump_database(workers=1, reports=True)
+        serial = self.read_outputs()
+        self.assertIn('naco:n79021164\tisni:0000000121032683', serial['naco_isni_equivalents.txt'])
+        self.assertIn('penguin:P12345\tviaf:1', serial['Penguin_identifiers.txt'])
+        self.assertEqual(self.dump_database(workers=3, reports=True, force=True), set(GRAPH_TABLES))
+        self.assertEqual(self.read_outputs(), serial)
+
+
+if __name__ == '__main__':
+    unittest.main()
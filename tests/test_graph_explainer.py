@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ====================
+#       Set-up
+# ====================
+
+# Import required modules
+from contextlib import redirect_stdout
+import io
+import os
+import tempfile
+import unittest
+from identities_tools.graph_tools import *
+from identities_tools.resolve_tools import *
+
+__author__ = 'Victoria Morris'
+__license__ = 'MIT License'
+__version__ = '1.0.0'
+__status__ = '4 - Beta Development'
+
+
+# ====================
+#        Tests
+# ====================
+
+
+class TestGraphExplainer(unittest.TestCase):
+    """Class to test that the graph adjacency exported by export_csr is read back by GraphExplainer"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.directory.name, 'CSR')
+        cwd = os.getcwd()
+        # Metrics are written to the working directory
+        os.chdir(cls.directory.name)
+        try:
+            with redirect_stdout(io.StringIO()):
+                db = IdentityGraphDatabase(os.path.join(cls.directory.name, 'identities_graph.db'))
+                name_id = db.names.get_id('Twain, Mark, 1835-1910')
+                db.cursor.executemany('INSERT INTO VIAF_equivalences (VIAF, identifier) VALUES (?, ?) ;',
+                                      [('viaf:50566653', 'isni:0000000121032683'), ('viaf:50566653', 'naco:n79021164')])
+                db.cursor.execute('INSERT INTO other_equivalences (other, identifier) VALUES (?, ?) ;',
+                                  ('naco:n79021164', 'penguin:P12345'))
+                db.cursor.execute('INSERT INTO NACO_authorised (NACO, name_id) VALUES (?, ?) ;', ('n79021164', name_id))
+                db.cursor.execute('INSERT INTO VIAF_isbn (VIAF, isbn) VALUES (?, ?) ;', ('viaf:102333412', '9780141439648'))
+                db.conn.commit()
+                cls.node_count = db.export_csr(cls.path)
+                db.close()
+        finally: os.chdir(cwd)
+        cls.explainer = GraphExplainer(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.explainer.close()
+        cls.directory.cleanup()
+
+    def test_nodes(self):
+        explainer = self.explainer
+        self.assertEqual(explainer.node_count, self.node_count)
+        nodes = [explainer.node(i) for i in range(explainer.node_count)]
+        self.assertEqual(nodes, sorted(nodes, key=lambda node: node.encode('utf-8')))
+        self.assertIn('string:Twain, Mark, 1835-1910', nodes)
+        for i, node in enumerate(nodes):
+            self.assertEqual(explainer.find(node), i)
+        self.assertIsNone(explainer.find('isni:0000000000000000'))
+
+    def test_edges_are_symmetric(self):
+        explainer = self.explainer
+        for i in range(explainer.node_count):
+            for j, table in explainer.neighbours(i):
+                self.assertIn((i, table), list(explainer.neighbours(j)))
+
+    def test_explain(self):
+        path = self.explainer.explain('http://isni.org/isni/0000000121032683', 'penguin:P12345')
+        self.assertEqual(path, [Evidence('isni:0000000121032683', 'VIAF_equivalences', 'viaf:50566653'),
+                                Evidence('viaf:50566653', 'VIAF_equivalences', 'naco:n79021164'),
+                                Evidence('naco:n79021164', 'other_equivalences', 'penguin:P12345')])
+        path = self.explainer.explain('string:Twain, Mark, 1835-1910', 'isni:0000000121032683')
+        self.assertEqual([evidence.table for evidence in path], ['NACO_authorised', 'VIAF_equivalences', 'VIAF_equivalences'])
+        self.assertEqual(self.explainer.explain('naco:n79021164', 'naco:n79021164'), [])
+
+    def test_explain_unlinked(self):
+        self.assertIsNone(self.explainer.explain('isni:0000000121032683', 'viaf:102333412'))
+        self.assertIsNone(self.explainer.explain('isni:0000000121032683', 'isni:0000000000000000'))
+
+
+if __name__ == '__main__':
+    unittest.main()
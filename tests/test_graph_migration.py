@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ====================
+#       Set-up
+# ====================
+
+# Import required modules
+from contextlib import redirect_stdout
+import io
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+from identities_tools.graph_tools import *
+
+__author__ = 'Victoria Morris'
+__license__ = 'MIT License'
+__version__ = '1.0.0'
+__status__ = '4 - Beta Development'
+
+
+# ====================
+#     Constants
+# ====================
+
+
+# Graph tables as they were created before the schema was versioned (version 0)
+V0_TABLES = {
+    'NACO_authorised': ['NACO', 'string'],
+    'NACO_variants': ['NACO', 'string'],
+    'VIAF_equivalences': ['VIAF', 'identifier'],
+    'other_equivalences': ['other', 'identifier'],
+    'VIAF_isbn': ['VIAF', 'isbn'],
+    'other_isbn': ['other', 'isbn'],
+    'VIAF_string': ['VIAF', 'string'],
+    'string_isbn': ['string', 'isbn'],
+    'isbn_equivalents': ['isbna', 'isbnb'],
+}
+
+V0_ROWS = {
+    'NACO_authorised': [('n79021164', 'Twain, Mark, 1835-1910')],
+    'NACO_variants': [('n79021164', 'Clemens, Samuel Langhorne, 1835-1910')],
+    'VIAF_string': [('50566653', 'Twain, Mark, 1835-1910'), ('50566653', 'Clemens, Samuel Langhorne, 1835-1910')],
+    'string_isbn': [('Twain, Mark, 1835-1910', '9780141439648')],
+    'VIAF_isbn': [('50566653', '9780141439648')],
+}
+
+
+# ====================
+#        Tests
+# ====================
+
+
+class TestMigration(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'identities_graph.db')
+        conn = sqlite3.connect(self.path)
+        for table in V0_TABLES:
+            conn.execute('CREATE TABLE {} ({}, UNIQUE({}));'.format(
+                table, ', '.join('{} TEXT'.format(column) for column in V0_TABLES[table]), ', '.join(V0_TABLES[table])))
+        for table in V0_ROWS:
+            conn.executemany('INSERT INTO {} VALUES (?, ?);'.format(table), V0_ROWS[table])
+        conn.commit()
+        conn.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def open_database(self):
+        with redirect_stdout(io.StringIO()):
+            return IdentityGraphDatabase(self.path)
+
+    def check_migrated(self):
+        db = self.open_database()
+        try:
+            self.assertEqual(db.cursor.execute('PRAGMA user_version').fetchone()[0], SCHEMA_VERSION)
+            for table in V0_ROWS:
+                self.assertEqual(sorted(db.cursor.execute('SELECT * FROM {}_text ;'.format(table)).fetchall()
+                                        if NAME_ID in [key for (key, value) in GRAPH_TABLES[table]]
+                                        else db.cursor.execute('SELECT * FROM {} ;'.format(table)).fetchall()),
+                                 sorted(V0_ROWS[table]))
+            self.assertEqual(db.cursor.execute('SELECT COUNT(*) FROM {} ;'.format(NAMES_TABLE)).fetchone()[0], 2)
+            # The change log triggers are keyed on the current columns
+            db.cursor.execute('INSERT INTO string_isbn (name_id, isbn) VALUES (1, \'9780140430820\') ;')
+            self.assertIn(('string_isbn', '1'),
+                          db.cursor.execute('SELECT table_name, node FROM {} ;'.format(CHANGE_LOG_TABLE)).fetchall())
+        finally:
+            db.conn.rollback()
+            db.close()
+        # The database can be opened again once it has been migrated
+        self.open_database().close()
+
+    def test_migrate_from_version_0(self):
+        self.check_migrated()
+
+    def test_migrate_from_broken_version_1(self):
+        # Databases left at version 1 by an earlier migration had change log triggers keyed on name_id
+        conn = sqlite3.connect(self.path)
+        conn.execute('CREATE TABLE {} (table_name TEXT, node TEXT, UNIQUE(table_name, node));'.format(CHANGE_LOG_TABLE))
+        for table in V0_TABLES:
+            key = [key for (key, value) in GRAPH_TABLES[table]][0]
+            conn.execute('CREATE TRIGGER TRG_{t}_insert AFTER INSERT ON {t} WHEN NEW.{k} IS NOT NULL '
+                         'BEGIN INSERT OR IGNORE INTO {c} (table_name, node) VALUES (\'{t}\', NEW.{k}); END;'
+                         .format(t=table, k=key, c=CHANGE_LOG_TABLE))
+        conn.execute('CREATE TABLE {} (table_name TEXT, row_count INTEGER, max_rowid INTEGER, path TEXT, '
+                     'PRIMARY KEY(table_name, path));'.format(FINGERPRINT_TABLE))
+        conn.execute('PRAGMA user_version = 1')
+        conn.commit()
+        conn.close()
+        self.check_migrated()
+
+    def test_failed_migration_is_rolled_back(self):
+        create_names = IdentityGraphDatabase.create_names
+
+        def failing_create_names(db):
+            create_names(db)
+            raise RuntimeError('Migration failed')
+
+        with mock.patch.object(IdentityGraphDatabase, 'create_names', failing_create_names):
+            with self.assertRaises(RuntimeError): self.open_database()
+        conn = sqlite3.connect(self.path)
+        try:
+            self.assertEqual(conn.execute('PRAGMA user_version').fetchone()[0], 1)
+            self.assertIn('string', [row[0] for row in conn.execute('SELECT name FROM pragma_table_info(\'string_isbn\') ;')])
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM sqlite_master WHERE name = ? ;', (NAMES_TABLE,)).fetchone()[0], 0)
+        finally: conn.close()
+        self.check_migrated()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ====================
+#       Set-up
+# ====================
+
+# Import required modules
+import unittest
+from identities_tools.identifier_tools import *
+
+__author__ = 'Victoria Morris'
+__license__ = 'MIT License'
+__version__ = '1.0.0'
+__status__ = '4 - Beta Development'
+
+
+# ====================
+#        Tests
+# ====================
+
+
+class TestIsniCheckDigit(unittest.TestCase):
+
+    def test_check_digit(self):
+        self.assertEqual(isni_check_digit('000000012103268'), '3')
+        self.assertEqual(isni_check_digit('000000012146438'), 'X')
+
+    def test_is_isni(self):
+        self.assertTrue(is_isni('0000000121032683'))
+        self.assertTrue(is_isni('000000012146438X'))
+        self.assertFalse(is_isni('0000000121032684'))
+        self.assertFalse(is_isni('000000012103268'))
+        self.assertFalse(is_isni(''))
+        self.assertFalse(is_isni(None))
+
+
+class TestCleanIdentifier(unittest.TestCase):
+
+    def test_isni(self):
+        self.assertEqual(clean_identifier('0000 0001 2103 2683', type='isni'), '0000000121032683')
+        self.assertEqual(clean_identifier('http://isni.org/isni/0000000121032683', type='isni'), '0000000121032683')
+        self.assertEqual(clean_identifier('0000-0001-2146-438x', type='isni'), '000000012146438X')
+        self.assertIsNone(clean_identifier('0000000121032684', type='isni'))
+        self.assertIsNone(clean_identifier('12345', type='isni'))
+
+    def test_naco(self):
+        self.assertEqual(clean_identifier('n  79021164', type='naco'), 'n79021164')
+        self.assertEqual(clean_identifier('NO2001012345', type='naco'), 'no2001012345')
+        self.assertIsNone(clean_identifier('sh85000001', type='naco'))
+
+    def test_viaf(self):
+        self.assertEqual(clean_identifier('102333412 (Personal)', type='viaf'), '102333412')
+        self.assertEqual(clean_identifier('https://viaf.org/viaf/102333412/', type='viaf'), '102333412')
+        self.assertIsNone(clean_identifier('LC|n79021164', type='viaf'))
+
+    def test_untyped(self):
+        self.assertEqual(clean_identifier('  P12345 '), 'P12345')
+        self.assertIsNone(clean_identifier(''))
+        self.assertIsNone(clean_identifier(None))
+
+    def test_clean_identifiers(self):
+        self.assertEqual(clean_identifiers(['0000 0001 2103 2683', '0000000121032684', None], type='isni'),
+                         {'0000000121032683'})
+
+
+if __name__ == '__main__':
+    unittest.main()
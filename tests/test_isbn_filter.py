@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ====================
+#       Set-up
+# ====================
+
+# Import required modules
+import importlib.util
+import os
+import random
+import sys
+import tempfile
+import unittest
+from unittest import mock
+from identities_tools.graph_tools import *
+
+__author__ = 'Victoria Morris'
+__license__ = 'MIT License'
+__version__ = '1.0.0'
+__status__ = '4 - Beta Development'
+
+
+# ====================
+#        Tests
+# ====================
+
+
+class TestISBNFilter(unittest.TestCase):
+    """Class to test that the ISBN filter gives the same answers as a set of the ISBNs, with and without NumPy"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'known_isbns.bin')
+        rng = random.Random(13)
+        self.isbns = set(str(rng.randrange(9780000000000, 9800000000000)) for i in range(5000))
+        write_array(self.path, array('Q', sorted(int(isbn) for isbn in self.isbns)))
+        candidates = list(self.isbns)[:1000] + [str(rng.randrange(9780000000000, 9800000000000)) for i in range(1000)]
+        candidates += [min(self.isbns), max(self.isbns), '9770000000000', '9990000000000',
+                       '', '978014143964', '97801414396480', '978014143964X', str(int(min(self.isbns)) - 1)]
+        self.candidates = candidates
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def check_filter(self):
+        isbn_filter = ISBNFilter(self.path)
+        try:
+            self.assertEqual(len(isbn_filter), len(self.isbns))
+            self.assertEqual(isbn_filter.contains(self.candidates), [isbn in self.isbns for isbn in self.candidates])
+            rows = [(i, isbn) for i, isbn in enumerate(self.candidates)]
+            self.assertEqual(isbn_filter.filter(rows), [row for row in rows if row[1] in self.isbns])
+            self.assertEqual(isbn_filter.contains([]), [])
+        finally: isbn_filter.close()
+        return isbn_filter
+
+    def test_without_numpy(self):
+        with mock.patch.dict(sys.modules, {'numpy': None}):
+            self.assertIsNone(self.check_filter().numpy)
+
+    @unittest.skipUnless(importlib.util.find_spec('numpy'), 'NumPy is not installed')
+    def test_with_numpy(self):
+        self.assertIsNotNone(self.check_filter().numpy)
+
+    def test_empty_filter(self):
+        open(self.path, mode='wb').close()
+        isbn_filter = ISBNFilter(self.path)
+        self.assertEqual(isbn_filter.contains(['9780141439648', 'x']), [False, False])
+        isbn_filter.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# ====================
+#       Set-up
+# ====================
+
+# Import required modules
+from contextlib import redirect_stdout
+import io
+import os
+import tempfile
+import unittest
+from identities_tools.graph_tools import *
+
+__author__ = 'Victoria Morris'
+__license__ = 'MIT License'
+__version__ = '1.0.0'
+__status__ = '4 - Beta Development'
+
+
+# ====================
+#     Constants
+# ====================
+
+
+VIAF_EQUIVALENCES = [('viaf:1', 'isni:0000000121032683'), ('viaf:1', 'naco:n79021164'),
+                     ('viaf:2', 'naco:n79032879'), ('viaf:2', 'penguin:P9'),
+                     ('viaf:3', 'naco:n79000001')]
+VIAF_STRINGS = [('viaf:1', 'Twain, Mark, 1835-1910'), ('viaf:1', 'Clemens, Samuel Langhorne, 1835-1910'),
+                ('viaf:2', 'Austen, Jane, 1775-1817')]
+VIAF_ISBNS = [('viaf:1', '9780141439648'), ('viaf:2', '9780141439518'), ('viaf:3', '9780141439600')]
+ISBN_EQUIVALENTS = [('9780140430820', '9780141439648')]
+
+TSV_FILES = {
+    'penguin': ['String\tISBN\tPenguin',
+                'Twain, Mark, 1835-1910\t9780141439648\tP1',
+                'Brontë, Charlotte, 1816-1855\t9780141439518\tP2',
+                'Nobody\t9780141439600\tP3',
+                'No match\t9780141439495\tP4'],
+    'harpercollins': ['String\tISBN\tHarperCollins',
+                      'Clemens, Samuel Langhorne, 1835-1910\t9780140430820\tH1',
+                      'Austen, Jane, 1775-1817\t9780141439518\tH2'],
+}
+
+HEADER = 'Name\tOriginal ISBN\tEquivalent ISBN\tProprietary identifier\tVIAF\tISNI\tNACO\tOther identifiers\tVariant name forms'
+
+
+# ====================
+#        Tests
+# ====================
+
+
+class TestFindNameMatches(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        # Name lists and metrics are written to the working directory
+        os.chdir(self.directory.name)
+        self.files = []
+        for name, lines in TSV_FILES.items():
+            self.files.append(os.path.join(self.directory.name, '{}.tsv'.format(name)))
+            with open(self.files[-1], mode='w', encoding='utf-8') as file:
+                file.write('\n'.join(lines) + '\n')
+        with redirect_stdout(io.StringIO()):
+            self.db = IdentityGraphDatabase(os.path.join(self.directory.name, 'identities_graph.db'))
+            cursor = self.db.cursor
+            cursor.executemany('INSERT INTO VIAF_equivalences (VIAF, identifier) VALUES (?, ?) ;', VIAF_EQUIVALENCES)
+            cursor.executemany('INSERT INTO VIAF_string (VIAF, name_id) VALUES (?, ?) ;',
+                               [(viaf, self.db.names.get_id(name)) for (viaf, name) in VIAF_STRINGS])
+            cursor.executemany('INSERT INTO VIAF_isbn (VIAF, isbn) VALUES (?, ?) ;', VIAF_ISBNS)
+            cursor.executemany('INSERT INTO isbn_equivalents (isbna, isbnb) VALUES (?, ?) ;',
+                               ISBN_EQUIVALENTS + [(isbn, isbn) for (viaf, isbn) in VIAF_ISBNS])
+            self.db.conn.commit()
+
+    def tearDown(self):
+        with redirect_stdout(io.StringIO()): self.db.close()
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def find_name_matches(self):
+        with redirect_stdout(io.StringIO()):
+            self.db.find_name_matches(file_list=self.files,
+                                      isbn_filter_path=os.path.join(self.directory.name, 'known_isbns.bin'))
+        name_lists = {}
+        for name in TSV_FILES:
+            for result in ['accepted', 'rejected']:
+                with open('{}_name_list_{}.txt'.format(name, result), mode='r', encoding='utf-8') as file:
+                    lines = file.read().splitlines()
+                self.assertEqual(lines[0], HEADER)
+                name_lists[(name, result)] = lines[1:]
+        return name_lists
+
+    def baseline_name_lists(self):
+        """Function to get the name lists written by the original implementation, which matched each file in turn,
+        grouping the matches in the database"""
+        from fuzzywuzzy import fuzz
+        name_lists = {}
+        for name, lines in TSV_FILES.items():
+            name_lists[(name, 'accepted')], name_lists[(name, 'rejected')] = [], []
+            headers = list(enumerate(lines[0].split('\t')))
+            conn = self.db.conn
+            conn.execute('CREATE TEMP TABLE ttable (string TEXT, isbn TEXT, identifier TEXT) ;')
+            for line in lines[1:]:
+                tsv = TSV(line, headers)
+                conn.executemany('INSERT INTO ttable VALUES (?, ?, ?) ;',
+                                 [(n, i, tsv.get_proprietary()) for n in tsv.get_names() for i in tsv.get_isbns()])
+            rows = conn.execute("""SELECT ttable.string, ttable.isbn, isbn_equivalents.isbnb, ttable.identifier, VIAF_isbn.VIAF,
+            GROUP_CONCAT(VIAF_equivalences.identifier, '|'), GROUP_CONCAT(VIAF_string_text.string, '|')
+            FROM ttable
+            INNER JOIN isbn_equivalents on ttable.isbn = isbn_equivalents.isbna
+            INNER JOIN VIAF_isbn on isbn_equivalents.isbnb = VIAF_isbn.isbn
+            INNER JOIN VIAF_equivalences on VIAF_isbn.VIAF = VIAF_equivalences.VIAF
+            INNER JOIN VIAF_string_text on VIAF_isbn.VIAF = VIAF_string_text.VIAF
+            GROUP BY VIAF_equivalences.VIAF
+            ORDER BY ttable.string ASC, ttable.isbn ASC ;""").fetchall()
+            conn.execute('DROP TABLE temp.ttable ;')
+            for string_name, isbn, isbnb, identifier, viaf, other, string_name_list in rows:
+                isni = '|'.join(sorted(set(o for o in other.split('|') if o.startswith('isni:'))))
+                naco = '|'.join(sorted(set(o for o in other.split('|') if o.startswith('naco:'))))
+                other = '|'.join(sorted(set(o for o in other.split('|') if not(o.startswith('naco:') or o.startswith('isni:')))))
+                string_name_list = '|'.join(sorted(set(string_name_list.split('|'))))
+                score = max(fuzz.token_set_ratio(string_name, s) for s in string_name_list.split('|'))
+                name_lists[(name, 'accepted' if score >= 80 else 'rejected')].append('\t'.join(
+                    [string_name, isbn, isbnb, identifier, viaf, isni, naco, other, string_name_list]))
+        return name_lists
+
+    def test_name_lists(self):
+        name_lists = self.find_name_matches()
+        self.assertEqual(name_lists[('penguin', 'accepted')],
+                         ['Twain, Mark, 1835-1910\t9780141439648\t9780141439648\tP1\tviaf:1\tisni:0000000121032683\t'
+                          'naco:n79021164\t\tClemens, Samuel Langhorne, 1835-1910|Twain, Mark, 1835-1910'])
+        self.assertEqual(name_lists[('penguin', 'rejected')],
+                         ['Brontë, Charlotte, 1816-1855\t9780141439518\t9780141439518\tP2\tviaf:2\t\t'
+                          'naco:n79032879\tpenguin:P9\tAusten, Jane, 1775-1817'])
+        self.assertEqual(name_lists[('harpercollins', 'accepted')],
+                         ['Clemens, Samuel Langhorne, 1835-1910\t9780140430820\t9780141439648\tH1\tviaf:1\t'
+                          'isni:0000000121032683\tnaco:n79021164\t\tClemens, Samuel Langhorne, 1835-1910|Twain, Mark, 1835-1910',
+                          'Austen, Jane, 1775-1817\t9780141439518\t9780141439518\tH2\tviaf:2\t\tnaco:n79032879\tpenguin:P9\t'
+                          'Austen, Jane, 1775-1817'])
+        self.assertEqual(name_lists[('harpercollins', 'rejected')], [])
+
+    def test_name_lists_match_baseline(self):
+        name_lists = self.find_name_matches()
+        baseline = self.baseline_name_lists()
+        for key in baseline:
+            self.assertEqual(sorted(name_lists[key]), sorted(baseline[key]), key)
+
+
+if __name__ == '__main__':
+    unittest.main()